@@ -19,6 +19,7 @@ import os.path
 from django.utils.translation import ugettext_lazy as _
 
 from desktop.lib.conf import Config, coerce_bool
+from desktop.lib.paths import get_desktop_root
 
 
 SERVER_INTERFACE = Config(
@@ -100,6 +101,35 @@ BEESWAX_RUNNING_QUERY_LIFETIME = Config(
   type=long,
   help=_('Time in seconds for Beeswax to persist queries in its cache.'))
 
+SERVER_CONFIG_CACHE_TTL = Config(
+  key='server_config_cache_ttl',
+  default=300,
+  type=int,
+  help=_('Time in seconds to cache the default configuration of a query server, e.g. whether it supports fetching from the start of the results again. 0 disables the cache.'))
+
+METADATA_CACHE_TTL = Config(
+  key='metadata_cache_ttl',
+  default=300,
+  type=int,
+  help=_('Time in seconds to cache the table lists, table schemas, partitions and sample rows shown when browsing tables. They are also refreshed after statements run from Hue that may change them. 0 disables the cache.'))
+
+RESULT_CACHE_DIR = Config(
+  key='result_cache_dir',
+  default=get_desktop_root('beeswax_results'),
+  help=_('Local directory where query results are cached as they are fetched, so that any page of the results can be shown again without asking the query server. It must belong to the user running Hue and not be accessible to others.'))
+
+RESULT_CACHE_MAX_SIZE = Config(
+  key='result_cache_max_size',
+  default=1024 * 1024 * 1024,
+  type=int,
+  help=_('Maximum size in bytes of the query results cache. The least recently used results are evicted first. 0 disables the cache.'))
+
+RESULT_CACHE_MAX_QUERY_SIZE = Config(
+  key='result_cache_max_query_size',
+  default=100 * 1024 * 1024,
+  type=int,
+  help=_('Maximum size in bytes of the cached results of a single query. The rows past it are read from the query server.'))
+
 BROWSE_PARTITIONED_TABLE_LIMIT = Config(
   key='browse_partitioned_table_limit',
   default=250,
@@ -20,7 +20,8 @@ Views & controls for creating tables
 """
 
 import logging
-import gzip
+import re
+import zlib
 
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
@@ -30,6 +31,7 @@ from desktop.lib import django_mako, i18n
 from desktop.lib.django_util import render
 from desktop.lib.exceptions_renderable import PopupException
 from desktop.lib.django_forms import MultiForm
+from desktop.lib.worker_pool import WorkerPool
 from hadoop.fs import hadoopfs
 
 from beeswax.common import TERMINATORS
@@ -91,6 +93,12 @@ def create_table(request):
 
 IMPORT_PEEK_SIZE = 8192
 IMPORT_PEEK_NLINES = 10
+# How many files of a directory, and how many places of each text file, to
+# look at. Gzipped files can only be read from the start.
+IMPORT_SAMPLE_FILES = 5
+IMPORT_SAMPLE_OFFSETS = 4
+IMPORT_SAMPLE_CONCURRENCY = 5
+GZIP_READ_SIZE = 16384
 DELIMITERS = [ hive_val for hive_val, desc, ascii in TERMINATORS ]
 DELIMITER_READABLE = {'\\001' : _('ctrl-As'),
                       '\\002' : _('ctrl-Bs'),
@@ -103,6 +111,9 @@ FILE_READERS = [ ]
 def import_wizard(request):
   """
   Help users define table and based on a file they want to import to Hive.
+  The file, or a few files of a directory, is sampled in several places to
+  guess the delimiter and the column types.
+
   Limitations:
     - Rows are delimited (no serde).
     - No detection for map and array types.
@@ -130,7 +141,7 @@ def import_wizard(request):
       #   be there as well.
       #
       delim_is_auto = False
-      fields_list, n_cols = [ [] ], 0
+      fields_list, n_cols, column_types = [ [] ], 0, [ ]
       s3_col_formset = None
 
       # Everything requires a valid file form
@@ -177,7 +188,7 @@ def import_wizard(request):
       #
       if do_s2_auto_delim:
         delim_is_auto = True
-        fields_list, n_cols, s2_delim_form = _delim_preview(
+        fields_list, n_cols, column_types, s2_delim_form = _delim_preview(
                                               request.fs,
                                               s1_file_form,
                                               encoding,
@@ -186,7 +197,7 @@ def import_wizard(request):
 
       if (do_s2_user_delim or do_s3_column_def or cancel_s3_column_def) and s2_delim_form.is_valid():
         # Delimit based on input
-        fields_list, n_cols, s2_delim_form = _delim_preview(
+        fields_list, n_cols, column_types, s2_delim_form = _delim_preview(
                                               request.fs,
                                               s1_file_form,
                                               encoding,
@@ -214,7 +225,7 @@ def import_wizard(request):
           for i in range(n_cols):
             columns.append(dict(
                 column_name='col_%s' % (i,),
-                column_type='string',
+                column_type=i < len(column_types) and column_types[i] or 'string',
             ))
           s3_col_formset = ColumnTypeFormSet(prefix='cols', initial=columns)
         return render('define_columns.mako', request, dict(
@@ -278,25 +289,24 @@ def _submit_create_and_load(request, create_hql, table_name, path, do_load):
 def _delim_preview(fs, file_form, encoding, file_types, delimiters):
   """
   _delim_preview(fs, file_form, encoding, file_types, delimiters)
-                              -> (fields_list, n_cols, delim_form)
+                              -> (fields_list, n_cols, column_types, delim_form)
 
-  Look at the beginning of the file and parse it according to the list of
-  available file_types and delimiters.
+  Sample the file (or directory) and parse it according to the list of
+  available file_types and delimiters. The fields_list shows the beginning
+  of the first file.
   """
   assert file_form.is_valid()
 
   path = file_form.cleaned_data['path']
   try:
-    file_obj = fs.open(path)
-    delim, file_type, fields_list = _parse_fields(
-              path, file_obj, encoding, file_types, delimiters)
-    file_obj.close()
+    delim, file_type, fields_list, column_types = _parse_fields(
+              fs, path, encoding, file_types, delimiters)
   except IOError, ex:
     msg = "Failed to open file '%s': %s" % (path, ex)
     LOG.exception(msg)
     raise PopupException(msg)
 
-  n_cols = max([ len(row) for row in fields_list ])
+  n_cols = max([ len(row) for row in fields_list ] or [ 0 ])
   # ``delimiter`` is a MultiValueField. delimiter_0 and delimiter_1 are the sub-fields.
   delimiter_0 = delim
   delimiter_1 = ''
@@ -311,36 +321,45 @@ def _delim_preview(fs, file_form, encoding, file_types, delimiters):
                                             n_cols=n_cols))
   if not delim_form.is_valid():
     assert False, _('Internal error when constructing the delimiter form: %(error)s' % {'error': delim_form.errors})
-  return fields_list, n_cols, delim_form
+  return fields_list, n_cols, column_types, delim_form
 
 
-def _parse_fields(path, file_obj, encoding, filetypes, delimiters):
+def _parse_fields(fs, path, encoding, filetypes, delimiters):
   """
-  _parse_fields(path, file_obj, encoding, filetypes, delimiters)
-                                  -> (delimiter, filetype, fields_list)
+  _parse_fields(fs, path, encoding, filetypes, delimiters)
+                                  -> (delimiter, filetype, fields_list, column_types)
 
   Go through the list of ``filetypes`` (gzip, text) and stop at the first one
-  that works for the data. Then apply the list of ``delimiters`` and pick the
-  most appropriate one.
-  ``path`` is used for debugging only.
+  that works for the data of the first file. Sample all the files with it, then
+  apply the list of ``delimiters`` and pick the most appropriate one.
 
-  Return the best delimiter, filetype and the data broken down into rows of fields.
+  Return the best delimiter, filetype, the first lines broken down into rows of
+  fields and the Hive types guessed for the columns.
   """
+  files = _get_sample_files(fs, path)
+  if not files:
+    raise PopupException(_("There is no file to import in '%(path)s'") % {'path': path})
   file_readers = [ reader for reader in FILE_READERS if reader.TYPE in filetypes ]
 
   for reader in file_readers:
-    LOG.debug("Trying %s for file: %s" % (reader.TYPE, path))
-    file_obj.seek(0, hadoopfs.SEEK_SET)
-    lines = reader.readlines(file_obj, encoding)
-    if lines is not None:
-      delim, fields_list = _readfields(lines, delimiters)
-      return delim, reader.TYPE, fields_list
+    LOG.debug("Trying %s for file: %s" % (reader.TYPE, files[0][0]))
+    samples = reader.sample(fs, files[0][0], files[0][1], encoding)
+    if samples is not None:
+      break
   else:
     # Even TextFileReader doesn't work
     msg = _("Failed to decode file '%(path)s' into printable characters under %(encoding)s") % {'path': path, 'encoding': encoding}
     LOG.error(msg)
     raise PopupException(msg)
 
+  samples.extend(_sample_files(fs, files[1:], reader, encoding))
+
+  # The preview shows the first lines, the guesses use all of them
+  n_head = min(IMPORT_PEEK_NLINES, len([ line for line in samples[0] if line ]))
+  delim, fields_list = _readfields([ line for lines in samples for line in lines ], delimiters)
+  column_types = _infer_column_types(fields_list)
+  return delim, reader.TYPE, fields_list[:n_head], column_types
+
 
 def _readfields(lines, delimiters):
   """
@@ -350,58 +369,161 @@ def _readfields(lines, delimiters):
 
   Choose the best delimiter from the given list of delimiters. Return that delimiter
   and the fields parsed by using that delimiter.
-  """
-  def score_delim(fields_list):
-    """
-    How good is this fields_list? Score based on variance of the number of fields
-    The score is always non-negative. The higher the better.
-    """
-    n_lines = len(fields_list)
-    len_list = [ len(fields) for fields in fields_list ]
 
+  The number of fields of each line is counted for all the delimiters in a single
+  pass over the lines. The score of a delimiter is based on the variance of its
+  number of fields, and is always non-negative. The higher the better.
+  """
+  lines = [ line for line in lines if line ]
+  if not lines:
+    return delimiters[0], [ ]
+
+  # Unescape the delimiters back to their character value
+  chars = [ delim.decode('string_escape') for delim in delimiters ]
+  sums = [ 0 ] * len(chars)
+  sums_sq = [ 0 ] * len(chars)
+  unsplit = [ False ] * len(chars)
+  for line in lines:
+    for i, char in enumerate(chars):
+      n_fields = line.count(char) + 1
+      sums[i] += n_fields
+      sums_sq[i] += n_fields * n_fields
+      if n_fields == 1:
+        unsplit[i] = True
+
+  n_lines = float(len(lines))
+  max_score = -1
+  best = 0
+  for i, delim in enumerate(delimiters):
     # All lines should break into multiple fields
-    if min(len_list) == 1:
-      return 0
+    if unsplit[i]:
+      score = 0
+    else:
+      avg_n_fields = sums[i] / n_lines
+      var = sums_sq[i] / n_lines - avg_n_fields * avg_n_fields
+      # Favour more fields
+      score = (1000.0 / (var + 1)) + avg_n_fields
+    LOG.debug("'%s' gives score of %s" % (delim, score))
+    if score > max_score:
+      max_score = score
+      best = i
 
-    avg_n_fields = sum(len_list) / n_lines
-    sq_of_exp = avg_n_fields * avg_n_fields
+  return delimiters[best], [ line.split(chars[best]) for line in lines ]
 
-    len_list_sq = [ l * l for l in len_list ]
-    exp_of_sq = sum(len_list_sq) / n_lines
-    var = exp_of_sq - sq_of_exp
-    # Favour more fields
-    return (1000.0 / (var + 1)) + avg_n_fields
 
+# Hive types guessed for the imported columns, narrowest first
+_INT_RE = re.compile(r'^[+-]?\d+$')
+_DOUBLE_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,9})?$')
 
-  max_score = -1
-  res = (None, None)
-
-  for delim in delimiters:
-    fields_list = [ ]
-    for line in lines:
-      if line:
-        # Unescape the delimiter back to its character value
-        fields_list.append(line.split(delim.decode('string_escape')))
-    score = score_delim(fields_list)
-    LOG.debug("'%s' gives score of %s" % (delim, score))
-    if score > max_score:
-      max_score = score
-      res = (delim, fields_list)
-  return res
+_COLUMN_TYPE_CHECKS = (
+  ('int', lambda value: _INT_RE.match(value) is not None and -2 ** 31 <= int(value) < 2 ** 31),
+  ('bigint', lambda value: _INT_RE.match(value) is not None and -2 ** 63 <= int(value) < 2 ** 63),
+  ('double', lambda value: _DOUBLE_RE.match(value) is not None),
+  ('timestamp', lambda value: _TIMESTAMP_RE.match(value) is not None),
+)
 
+# Values that don't tell anything about the type
+_NULL_VALUES = frozenset(['', '\\N', 'NULL', 'null'])
 
-def _peek_file(fs, file_form):
-  """_peek_file(fs, file_form) -> (path, initial data)"""
+
+def _infer_column_types(fields_list):
+  """
+  _infer_column_types(fields_list) -> [ Hive type ]
+
+  The narrowest of int, bigint, double, timestamp or string that holds all the
+  sampled values of each column. Empty and NULL values are not considered.
+  """
+  n_cols = max([ len(row) for row in fields_list ] or [ 0 ])
+  types = [ ]
+  for i in range(n_cols):
+    values = set([ row[i] for row in fields_list if len(row) > i ]) - _NULL_VALUES
+    checks = list(_COLUMN_TYPE_CHECKS)
+    for value in values:
+      checks = [ (hive_type, check) for hive_type, check in checks if check(value) ]
+      if not checks:
+        break
+    if values and checks:
+      types.append(checks[0][0])
+    else:
+      types.append('string')
+  return types
+
+
+def _get_sample_files(fs, path):
+  """
+  _get_sample_files(fs, path) -> [ (path, size) ]
+
+  ``path`` itself, or up to IMPORT_SAMPLE_FILES non-empty data files of the
+  directory ``path``, spread over its listing.
+  """
+  stats = fs.stats(path)
+  if not stats.isDir:
+    return [ (path, stats.size) ]
+
+  files = [ (stat.path, stat.size) for stat in fs.listdir_stats(path)
+            if not stat.isDir and stat.size and not fs.basename(stat.path)[0] in '._' ]
+  files.sort()
+  if len(files) > IMPORT_SAMPLE_FILES:
+    step = (len(files) - 1) / float(IMPORT_SAMPLE_FILES - 1)
+    files = [ files[int(round(i * step))] for i in range(IMPORT_SAMPLE_FILES) ]
+  return files
+
+
+def _sample_files(fs, files, reader, encoding):
+  """
+  _sample_files(fs, files, reader, encoding) -> list of list of lines
+
+  The samples of all ``files``, read concurrently. Files the reader can't
+  decode are skipped.
+  """
+  if not files:
+    return [ ]
+
+  user = fs.user
+  def sample(item):
+    # Pool threads do not inherit the thread-local user
+    fs.setuser(user)
+    return reader.sample(fs, item[0], item[1], encoding)
+
+  samples = { }
+  pool = WorkerPool(min(len(files), IMPORT_SAMPLE_CONCURRENCY), name='beeswax-import-sample')
   try:
-    path = file_form.cleaned_data['path']
-    file_obj = fs.open(path)
-    file_head = file_obj.read(IMPORT_PEEK_SIZE)
-    file_obj.close()
-    return (path, file_head)
-  except IOError, ex:
-    msg = _("Failed to open file '%(path)s': %(error)s") % {'path': path, 'error': ex}
-    LOG.exception(msg)
-    raise PopupException(msg)
+    for item, res, ex in pool.imap_unordered(sample, files):
+      if ex is not None:
+        LOG.warn("Could not sample file %s: %s" % (item[0], ex))
+      elif res is None:
+        LOG.warn("Could not read file %s as %s" % (item[0], reader.TYPE))
+      else:
+        samples[item] = res
+  finally:
+    pool.shutdown()
+
+  return [ lines for item in files for lines in samples.get(item, [ ]) ]
+
+
+def _decode_lines(data, encoding, skip_first=False, truncated=False):
+  """
+  _decode_lines(data, encoding, skip_first, truncated) -> list of lines
+
+  Leave out the first and last lines of ``data`` if they may be partial.
+  """
+  try:
+    lines = unicode(data, encoding, errors='replace').split('\n')
+  except UnicodeError:
+    return None
+  if skip_first:
+    lines = lines[1:]
+  if truncated and len(lines) > 1:
+    lines = lines[:-1]
+  return lines
+
+
+def _open_stream(fs, path):
+  """A file-like object reading ``path`` from the start."""
+  if hasattr(fs, 'read_stream'):
+    return fs.read_stream(path)
+  return fs.open(path)
 
 
 class GzipFileReader(object):
@@ -409,17 +531,46 @@ class GzipFileReader(object):
   TYPE = 'gzip'
 
   @staticmethod
-  def readlines(fileobj, encoding):
-    """readlines(fileobj, encoding) -> list of lines"""
-    gz = gzip.GzipFile(fileobj=fileobj, mode='rb')
+  def readlines(fileobj, encoding, size=None):
+    """
+    readlines(fileobj, encoding, size) -> list of lines
+
+    Decompress the first ``size`` (IMPORT_PEEK_SIZE) bytes of data as the
+    compressed data is read. Returns None if the data is not gzipped.
+    """
+    if size is None:
+      size = IMPORT_PEEK_SIZE
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = [ ]
+    length = 0
     try:
-      data = gz.read(IMPORT_PEEK_SIZE)
-    except IOError:
+      while length < size:
+        data = fileobj.read(GZIP_READ_SIZE)
+        if not data:
+          break
+        data = decompressor.decompress(data, size - length)
+        chunks.append(data)
+        length += len(data)
+        if decompressor.unused_data:
+          # End of the first member
+          break
+    except zlib.error:
+      return None
+    if not chunks:
       return None
+    return _decode_lines(''.join(chunks), encoding, truncated=length >= size)
+
+  @staticmethod
+  def sample(fs, path, size, encoding):
+    """sample(fs, path, size, encoding) -> [ list of lines ]"""
+    fileobj = _open_stream(fs, path)
     try:
-      return unicode(data, encoding, errors='replace').split('\n')[:IMPORT_PEEK_NLINES]
-    except UnicodeError:
+      lines = GzipFileReader.readlines(fileobj, encoding, IMPORT_PEEK_SIZE * IMPORT_SAMPLE_OFFSETS)
+    finally:
+      fileobj.close()
+    if lines is None:
       return None
+    return [ lines ]
 
 FILE_READERS.append(GzipFileReader)
 
@@ -429,13 +580,41 @@ class TextFileReader(object):
   TYPE = 'text'
 
   @staticmethod
-  def readlines(fileobj, encoding):
-    """readlines(fileobj, encoding) -> list of lines"""
+  def readlines(fileobj, encoding, size=None):
+    """readlines(fileobj, encoding, size) -> list of lines"""
+    if size is None:
+      size = IMPORT_PEEK_SIZE
+    data = fileobj.read(size)
+    return _decode_lines(data, encoding, truncated=len(data) >= size)
+
+  @staticmethod
+  def sample(fs, path, size, encoding):
+    """
+    sample(fs, path, size, encoding) -> [ list of lines ]
+
+    The lines of IMPORT_PEEK_SIZE bytes at IMPORT_SAMPLE_OFFSETS places spread
+    over the file, from its head to its tail.
+    """
+    n_samples = max(1, min(IMPORT_SAMPLE_OFFSETS, size / IMPORT_PEEK_SIZE))
+    offsets = [ 0 ]
+    if n_samples > 1:
+      # Up to the tail of the file
+      step = (size - IMPORT_PEEK_SIZE) / (n_samples - 1)
+      offsets.extend([ i * step for i in range(1, n_samples) ])
+
+    samples = [ ]
+    fileobj = fs.open(path)
     try:
-      data = fileobj.read(IMPORT_PEEK_SIZE)
-      return unicode(data, encoding, errors='replace').split('\n')[:IMPORT_PEEK_NLINES]
-    except UnicodeError:
-      return None
+      for offset in offsets:
+        fileobj.seek(offset, hadoopfs.SEEK_SET)
+        data = fileobj.read(IMPORT_PEEK_SIZE)
+        lines = _decode_lines(data, encoding, skip_first=offset > 0, truncated=offset + len(data) < size)
+        if lines is None:
+          return None
+        samples.append(lines)
+    finally:
+      fileobj.close()
+    return samples
 
 FILE_READERS.append(TextFileReader)
 
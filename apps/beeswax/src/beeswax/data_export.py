@@ -18,80 +18,86 @@
 # Handling of data export
 
 import logging
-import time
 
 from django.http import HttpResponse
 
-from desktop.lib.export_csvxls import CSVformatter, TooBigToDownloadException
+from desktop.lib.export_csvxls import TooBigToDownloadException, get_formatter, gzip_generator
 
-from beeswax import common
+from beeswax import common, result_cache
 
 
 LOG = logging.getLogger(__name__)
 
-_DATA_WAIT_SLEEP = 0.1                  # Sleep 0.1 sec before checking for data availability
 FETCH_ROWS = 100000
 
-def download(handle, format, db):
+def download(handle, format, db, query_id=None, compress=False):
   """
   download(query_model, format) -> HttpResponse
 
   Retrieve the query result in the format specified. Return an HttpResponse object.
+  With a `query_id', the rows are read through the result cache.
+  With `compress', the file is gzipped on the fly.
   """
   if format not in common.DL_FORMATS:
     LOG.error('Unknown download format "%s"' % (format,))
     return
 
-  if format == 'csv':
-    formatter = CSVformatter()
-    mimetype = 'application/csv'
-  elif format == 'xls':
-    # We 'fool' the user by sending back CSV as XSL as it supports streaming and won't freeze Hue
-    formatter = CSVformatter()
-    mimetype = 'application/xls'
+  formatter, mimetype, extension = get_formatter(format)
+
+  gen = data_generator(handle, formatter, db, query_id)
+  filename = 'query_result.%s' % (extension,)
+  if compress:
+    gen = gzip_generator(gen)
+    mimetype = 'application/x-gzip'
+    filename += '.gz'
 
-  gen = data_generator(handle, formatter, db)
   resp = HttpResponse(gen, mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=query_result.%s' % (format,)
+  resp['Content-Disposition'] = 'attachment; filename=%s' % (filename,)
 
   return resp
 
 
-def data_generator(handle, formatter, db):
+def data_generator(handle, formatter, db, query_id=None):
   """
   data_generator(query_model, formatter) -> generator object
 
-  Return a generator object for a csv. The first line is the column names.
+  Return a generator object for the formatted data. The first row is the column names.
+  Each fetched block of rows is formatted at once, and yielded in large chunks.
 
   This is similar to export_csvxls.generator, but has
   one or two extra complexities.
   """
-  _DATA_WAIT_SLEEP
-  is_first_row = True
-
   yield formatter.init_doc()
 
-  results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
+  if query_id is None:
+    columns, blocks = _iter_row_blocks(handle, db)
+  else:
+    columns, blocks = result_cache.iter_row_blocks(db, handle, query_id)
 
-  while results is not None:
-    while not results.ready:   # For Beeswax
-      time.sleep(_DATA_WAIT_SLEEP)
-      results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
+  yield formatter.format_header(columns)
 
-    # TODO Check for concurrent reading when HS2 supports start_row
-    if is_first_row:
-      is_first_row = False
-      yield formatter.format_header(results.cols())
+  try:
+    for rows in blocks:
+      for chunk in formatter.format_rows(rows):
+        yield chunk
+  except TooBigToDownloadException, ex:
+    LOG.error(ex)
 
-    for row in results.rows():
-      try:
-        yield formatter.format_row(row)
-      except TooBigToDownloadException, ex:
-        LOG.error(ex)
+  yield formatter.fini_doc()
 
-    if results.has_more:
-      results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
-    else:
-      results = None
 
-  yield formatter.fini_doc()
+def _iter_row_blocks(handle, db):
+  """
+  _iter_row_blocks(handle, db) -> (columns, generator of lists of rows)
+
+  Read all the rows from the server, FETCH_ROWS at a time.
+  """
+  columns, rows, has_more = result_cache.fetch_rows(db, handle, True, FETCH_ROWS)
+
+  def blocks(rows, has_more):
+    yield rows
+    while has_more and rows:
+      rows, has_more = result_cache.fetch_rows(db, handle, False, FETCH_ROWS)[1:]
+      yield rows
+
+  return columns, blocks(rows, has_more)
@@ -145,7 +145,10 @@ class HiveServerQueryHistory(QueryHistory):
                                  modified_row_count=self.modified_row_count)
 
   def save_state(self, new_state):
-    self.last_state = new_state.index
+    """Set the last_state from an enum, and save"""
+    if self.last_state != new_state.index:
+      self.last_state = new_state.index
+      self.save()
 
 
 class BeeswaxQueryHistory(QueryHistory):
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local cache of query results.
+
+The query servers only read results forward: going back to a previous page
+means fetching everything again from the start, and two viewers of the same
+query move the same cursor. Instead, the rows are kept on disk as they are
+fetched, and any page or download is served from there. The server is only
+asked for the rows that were never fetched.
+
+Each query gets three files in the cache directory, named after the
+QueryHistory id:
+  <id>.rows   Blocks of at most BLOCK_ROWS rows, each a zlib compressed
+              marshal of the list of rows.
+  <id>.idx    One INDEX_RECORD per block: first row, offset and length of
+              the block in the .rows file, and number of rows.
+  <id>.meta   The column names, and whether all the rows are there.
+
+The cache is bounded in total size, least recently used queries being
+evicted first, and per query: rows past the limit are read from the server
+without being kept. It is meant to be used by a single Hue process, and its
+directory must be private to the user running Hue: the results are read
+back with marshal.
+"""
+
+import bisect
+import errno
+import logging
+import marshal
+import os
+import stat
+import struct
+import threading
+import time
+import zlib
+
+from beeswax import conf
+from beeswax.server import query_monitor
+
+
+LOG = logging.getLogger(__name__)
+
+# Rows per block on disk
+BLOCK_ROWS = 1000
+
+# Rows asked to the server at once when filling the cache
+FETCH_ROWS = 5000
+
+# Sleep that long before asking again for results that are not ready
+_DATA_WAIT_SLEEP = 0.1
+# Give up on the results of a finished query that are not ready after that long
+_DATA_WAIT_TIMEOUT = 30
+
+INDEX_RECORD = struct.Struct('>QQII')   # first row, offset, length, row count
+
+
+class CachedResult(object):
+  """
+  The rows of one query fetched so far. Not thread-safe by itself: callers
+  hold `lock' while using it.
+  """
+  def __init__(self, directory, query_id):
+    self.query_id = query_id
+    self.lock = threading.RLock()
+    self.last_access = time.time()
+    self.evicted = False
+
+    base = os.path.join(directory, str(query_id))
+    self._rows_path = base + '.rows'
+    self._index_path = base + '.idx'
+    self._meta_path = base + '.meta'
+
+    self.columns = None
+    self.complete = False       # All the rows are cached
+    self.truncated = False      # Rows past row_count will never be cached
+    self.server_row = 0         # Position of the server cursor
+
+    self._first_rows = [ ]      # First row of each block, for bisect
+    self._blocks = [ ]          # (offset, length, count) of each block
+    self.row_count = 0
+    self.size = 0
+
+    self._load()
+
+  def _load(self):
+    if not os.path.exists(self._meta_path):
+      self.delete()
+      return
+    try:
+      meta = marshal.loads(_read_file(self._meta_path))
+      index = _read_file(self._index_path)
+      data_size = os.path.getsize(self._rows_path)
+    except (IOError, OSError, EOFError, ValueError), ex:
+      LOG.warn("Discarding the cached results of query %s: %s" % (self.query_id, ex))
+      self.delete()
+      return
+
+    index_size = 0
+    for pos in xrange(0, len(index) - INDEX_RECORD.size + 1, INDEX_RECORD.size):
+      first_row, offset, length, count = INDEX_RECORD.unpack_from(index, pos)
+      if first_row != self.row_count or offset + length > data_size:
+        break
+      self._add_block(first_row, offset, length, count)
+      index_size = pos + INDEX_RECORD.size
+
+    data_end = 0
+    if self._blocks:
+      data_end = self._blocks[-1][0] + self._blocks[-1][1]
+    if index_size < len(index) or data_end < data_size:
+      # Interrupted write, keep what's before it. The files are cut there, or
+      # the next blocks would be appended after the garbage and lost.
+      if index_size < len(index):
+        meta['complete'] = False
+      try:
+        _truncate(self._index_path, index_size)
+        _truncate(self._rows_path, data_end)
+      except (IOError, OSError), ex:
+        LOG.warn("Discarding the cached results of query %s: %s" % (self.query_id, ex))
+        self.delete()
+        return
+
+    self.columns = meta.get('columns')
+    self.complete = meta.get('complete', False)
+    self.truncated = meta.get('truncated', False)
+    self.server_row = self.row_count
+    self.size = data_end + index_size
+
+  def _add_block(self, first_row, offset, length, count):
+    self._first_rows.append(first_row)
+    self._blocks.append((offset, length, count))
+    self.row_count = first_row + count
+
+  def set_columns(self, columns):
+    self.columns = list(columns)
+    self._save_meta()
+
+  def mark_complete(self):
+    self.complete = True
+    self._save_meta()
+
+  def mark_truncated(self):
+    self.truncated = True
+    self._save_meta()
+
+  def append(self, rows):
+    """Append rows, in blocks. Returns the number of bytes written."""
+    written = 0
+    data = open(self._rows_path, 'ab')
+    try:
+      index = open(self._index_path, 'ab')
+      try:
+        offset = data.tell()
+        for start in xrange(0, len(rows), BLOCK_ROWS):
+          block = rows[start:start + BLOCK_ROWS]
+          buf = zlib.compress(marshal.dumps(block), 1)
+          data.write(buf)
+          index.write(INDEX_RECORD.pack(self.row_count, offset, len(buf), len(block)))
+          self._add_block(self.row_count, offset, len(buf), len(block))
+          offset += len(buf)
+          written += len(buf) + INDEX_RECORD.size
+      finally:
+        index.close()
+    finally:
+      data.close()
+    self.size += written
+    return written
+
+  def read_rows(self, first_row, count):
+    """The cached rows from `first_row', at most `count' of them."""
+    self.last_access = time.time()
+    end_row = min(first_row + count, self.row_count)
+    if first_row >= end_row:
+      return [ ]
+
+    rows = [ ]
+    i = bisect.bisect_right(self._first_rows, first_row) - 1
+    data = open(self._rows_path, 'rb')
+    try:
+      while i < len(self._blocks) and self._first_rows[i] < end_row:
+        offset, length, block_count = self._blocks[i]
+        data.seek(offset)
+        block = marshal.loads(zlib.decompress(data.read(length)))
+        block_first = self._first_rows[i]
+        rows.extend(block[max(0, first_row - block_first):end_row - block_first])
+        i += 1
+    finally:
+      data.close()
+    return rows
+
+  def delete(self):
+    _delete_files(self._rows_path, self._index_path, self._meta_path)
+    self.columns = None
+    self.complete = self.truncated = False
+    self._first_rows = [ ]
+    self._blocks = [ ]
+    self.row_count = self.server_row = self.size = 0
+
+  def _save_meta(self):
+    tmp_path = self._meta_path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+      f.write(marshal.dumps({'columns': self.columns, 'complete': self.complete, 'truncated': self.truncated}))
+    finally:
+      f.close()
+    os.rename(tmp_path, self._meta_path)
+
+
+class ResultCache(object):
+  """
+  The CachedResults of all the queries, bounded to `max_size' bytes in total
+  and `max_query_size' bytes per query.
+  """
+  def __init__(self, directory, max_size, max_query_size):
+    self.directory = directory
+    self.max_size = max_size
+    self.max_query_size = max_query_size
+    self._lock = threading.Lock()
+    self._entries = None          # query id -> CachedResult
+    self._sizes = None            # query id -> (size, last access) of the ones not loaded
+    self._usable = None           # Whether the directory is safe to use
+
+  @property
+  def enabled(self):
+    return self.max_size > 0 and self.max_query_size > 0 and self._check_directory()
+
+  def _check_directory(self):
+    """
+    Create the directory, or make sure that nobody else could have written
+    to it. The cache is disabled otherwise.
+    """
+    self._lock.acquire()
+    try:
+      if self._usable is None:
+        try:
+          os.makedirs(self.directory, 0700)
+        except OSError, ex:
+          if ex.errno != errno.EEXIST:
+            LOG.error("Query results are not cached: could not create %s: %s" % (self.directory, ex))
+            self._usable = False
+            return False
+        sb = os.lstat(self.directory)
+        self._usable = stat.S_ISDIR(sb.st_mode) and sb.st_uid == os.getuid() and not sb.st_mode & 077
+        if not self._usable:
+          LOG.error("Query results are not cached: %s must be a directory owned by the user running Hue "
+                    "and not accessible to others" % (self.directory,))
+      return self._usable
+    finally:
+      self._lock.release()
+
+  def get(self, query_id):
+    self._lock.acquire()
+    try:
+      self._scan()
+      entry = self._entries.get(query_id)
+      if entry is None:
+        entry = CachedResult(self.directory, query_id)
+        self._entries[query_id] = entry
+        self._sizes.pop(query_id, None)
+      entry.last_access = time.time()
+      return entry
+    finally:
+      self._lock.release()
+
+  def reserve(self, entry, nbytes):
+    """
+    Whether `entry' may grow by `nbytes'. Evicts the least recently used
+    queries to make room if needed.
+    """
+    if entry.size + nbytes > self.max_query_size:
+      return False
+    self._lock.acquire()
+    try:
+      total = sum([ e.size for e in self._entries.values() ]) + sum([ size for size, _ in self._sizes.values() ])
+      if total + nbytes <= self.max_size:
+        return True
+
+      candidates = [ (e.last_access, query_id) for query_id, e in self._entries.iteritems() if e is not entry ]
+      candidates.extend([ (last_access, query_id) for query_id, (size, last_access) in self._sizes.iteritems() ])
+      candidates.sort()
+      for last_access, query_id in candidates:
+        if total + nbytes <= self.max_size:
+          break
+        total -= self._evict(query_id)
+      return total + nbytes <= self.max_size
+    finally:
+      self._lock.release()
+
+  def _evict(self, query_id):
+    """Drop the cached results of a query, unless in use. Returns the bytes freed. Holds the lock."""
+    entry = self._entries.get(query_id)
+    if entry is None:
+      size, _ = self._sizes.pop(query_id)
+      base = os.path.join(self.directory, str(query_id))
+      _delete_files(base + '.rows', base + '.idx', base + '.meta')
+      return size
+
+    if not entry.lock.acquire(False):
+      return 0
+    try:
+      size = entry.size
+      entry.delete()
+      entry.evicted = True
+      del self._entries[query_id]
+      return size
+    finally:
+      entry.lock.release()
+
+  def _scan(self):
+    """Find out what's already on disk, the first time. Holds the lock."""
+    if self._entries is not None:
+      return
+    self._entries = { }
+    self._sizes = { }
+    for name in os.listdir(self.directory):
+      query_id, ext = os.path.splitext(name)
+      if ext not in ('.rows', '.idx', '.meta'):
+        continue
+      try:
+        query_id = long(query_id)
+        stat = os.stat(os.path.join(self.directory, name))
+      except (ValueError, OSError):
+        continue
+      size, last_access = self._sizes.get(query_id, (0, 0))
+      self._sizes[query_id] = (size + stat.st_size, max(last_access, stat.st_mtime))
+
+
+def _delete_files(*paths):
+  for path in paths:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+def _truncate(path, size):
+  f = open(path, 'r+b')
+  try:
+    f.truncate(size)
+  finally:
+    f.close()
+
+
+def _read_file(path):
+  f = open(path, 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+  global _cache
+  _cache_lock.acquire()
+  try:
+    if _cache is None:
+      _cache = ResultCache(conf.RESULT_CACHE_DIR.get(),
+                           conf.RESULT_CACHE_MAX_SIZE.get(),
+                           conf.RESULT_CACHE_MAX_QUERY_SIZE.get())
+    return _cache
+  finally:
+    _cache_lock.release()
+
+
+def get_rows(db, handle, query_id, first_row, count):
+  """
+  get_rows(db, handle, query_id, first_row, count) -> (columns, rows, has_more)
+
+  At most `count' rows of a query starting at `first_row', from the cache
+  when they are there, or else from the server, filling the cache.
+  """
+  cache = get_cache()
+  if not cache.enabled:
+    return _read_uncached(db, handle, first_row, count, first_row)[:3]
+
+  while True:
+    entry = cache.get(query_id)
+    entry.lock.acquire()
+    try:
+      if entry.evicted:
+        continue
+      while not entry.complete and not entry.truncated and entry.row_count < first_row + count:
+        _fill(cache, db, handle, entry)
+
+      rows = entry.read_rows(first_row, count)
+      if entry.complete or len(rows) == count:
+        return entry.columns, rows, not entry.complete or first_row + len(rows) < entry.row_count
+
+      # Past what the cache may hold
+      columns, more_rows, has_more, entry.server_row = _read_uncached(db, handle, first_row + len(rows),
+                                                                      count - len(rows), entry.server_row)
+      return entry.columns or columns, rows + more_rows, has_more
+    finally:
+      entry.lock.release()
+
+
+def iter_row_blocks(db, handle, query_id):
+  """
+  iter_row_blocks(db, handle, query_id) -> (columns, generator of lists of rows)
+
+  All the rows of a query, e.g. for a download.
+  """
+  columns, rows, has_more = get_rows(db, handle, query_id, 0, FETCH_ROWS)
+
+  def blocks(rows, has_more):
+    next_row = 0
+    while rows:
+      yield rows
+      next_row += len(rows)
+      if not has_more:
+        break
+      rows, has_more = get_rows(db, handle, query_id, next_row, FETCH_ROWS)[1:]
+
+  return columns, blocks(rows, has_more)
+
+
+def _fill(cache, db, handle, entry):
+  """Fetch the next rows from the server and add them to the cache."""
+  if entry.row_count > 0:
+    # Check the limits with the average size of the rows so far. This is an
+    # estimate: the cache can go over its limits by a fraction of a fetch.
+    estimate = entry.size * FETCH_ROWS / entry.row_count
+    if not cache.reserve(entry, estimate):
+      LOG.info("Results of query %s are too large to be cached past row %d" % (entry.query_id, entry.row_count))
+      entry.mark_truncated()
+      return
+
+  columns, rows, has_more = fetch_rows(db, handle, entry.row_count == 0, FETCH_ROWS)
+  if entry.columns is None:
+    entry.set_columns(columns)
+  entry.append(rows)
+  entry.server_row = entry.row_count
+  if not has_more or not rows:
+    entry.mark_complete()
+  cache.reserve(entry, 0)
+
+
+def _read_uncached(db, handle, first_row, count, server_row):
+  """
+  _read_uncached(...) -> (columns, rows, has_more, new server_row)
+
+  Read rows from the server without caching them. `server_row' is where
+  the server cursor is: it only moves forward, so reading behind it means
+  starting over. Only the rows needed are fetched, so that reading the
+  next page continues from there.
+  """
+  start_over = first_row == 0 or first_row < server_row
+  if start_over:
+    server_row = 0
+
+  columns, rows, has_more = None, [ ], True
+  while has_more and server_row < first_row + count:
+    columns, fetched, has_more = fetch_rows(db, handle, start_over, min(FETCH_ROWS, first_row + count - server_row))
+    start_over = False
+    if not fetched:
+      has_more = False
+    rows.extend(fetched[max(first_row - server_row, 0):])
+    server_row += len(fetched)
+  return columns, rows, has_more, server_row
+
+
+def fetch_rows(db, handle, start_over, rows):
+  """
+  fetch_rows(db, handle, start_over, rows) -> (columns, rows, has_more)
+
+  Fetch from the server, waiting for the results to be ready.
+  """
+  results = db.fetch(handle, start_over, rows)
+  if results is None or not getattr(results, 'ready', True):   # For Beeswax
+    # Let the query monitor tell when the query is done
+    status = query_monitor.wait_until_finished(db, handle, query_monitor.LONG_POLL_TIMEOUT)
+    while not status.finished:
+      if status.error is not None:
+        raise status.error
+      status = query_monitor.wait_until_finished(db, handle, query_monitor.LONG_POLL_TIMEOUT)
+    results = db.fetch(handle, start_over, rows)
+
+  # The results of a finished query should not be long
+  deadline = time.time() + _DATA_WAIT_TIMEOUT
+  while results is None or not getattr(results, 'ready', True):
+    if time.time() > deadline:
+      raise Exception("The results of query %s are still not ready" % (handle,))
+    time.sleep(_DATA_WAIT_SLEEP)
+    results = db.fetch(handle, start_over, rows)
+  return list(results.columns), list(results.rows()), results.has_more
@@ -166,6 +166,29 @@ class BeeswaxClient:
     return self.meta_client.get_partitions(db_name, tbl_name, max_parts)
 
 
+  def get_partition_names(self, db_name, tbl_name, part_vals=None, max_parts=None):
+    """
+    The names ("key1=value1/key2=value2") of the partitions, sorted by the
+    metastore. `part_vals' are the values of the leading partition keys to
+    match, '' matching any value.
+    """
+    if max_parts is None:
+      max_parts = -1
+    if part_vals:
+      return self.meta_client.get_partition_names_ps(db_name, tbl_name, part_vals, max_parts)
+    return self.meta_client.get_partition_names(db_name, tbl_name, max_parts)
+
+
+  def get_partition_by_name(self, db_name, tbl_name, part_name):
+    return self.meta_client.get_partition_by_name(db_name, tbl_name, part_name)
+
+
+  def get_partitions_by_filter(self, db_name, tbl_name, filter, max_parts=None):
+    if max_parts is None:
+      max_parts = -1
+    return self.meta_client.get_partitions_by_filter(db_name, tbl_name, filter, max_parts)
+
+
   def explain(self, statement):
     thrift_query = self.make_query(statement)
     return self.db_client.explain(thrift_query)
@@ -352,6 +375,24 @@ class BeeswaxClient:
           self._decode_partition(part)
         return part_list
 
+      def get_partition_by_name(self, db_name, tbl_name, part_name):
+        part = self._client.get_partition_by_name(db_name, tbl_name, smart_str(part_name))
+        return self._decode_partition(part)
+
+      def get_partitions_by_filter(self, db_name, tbl_name, filter, max_parts):
+        part_list = self._client.get_partitions_by_filter(db_name, tbl_name, smart_str(filter), max_parts)
+        for part in part_list:
+          self._decode_partition(part)
+        return part_list
+
+      def get_partition_names(self, *args, **kwargs):
+        return [ force_unicode(name, errors='replace') for name in self._client.get_partition_names(*args, **kwargs) ]
+
+      def get_partition_names_ps(self, db_name, tbl_name, part_vals, max_parts):
+        part_vals = [ smart_str(value) for value in part_vals ]
+        names = self._client.get_partition_names_ps(db_name, tbl_name, part_vals, max_parts)
+        return [ force_unicode(name, errors='replace') for name in names ]
+
       def alter_partition(self, db_name, tbl_name, new_part):
         self._encode_partition(new_part)
         return self._client.alter_partition(db_name, tbl_name, new_part)
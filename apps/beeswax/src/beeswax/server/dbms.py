@@ -16,26 +16,52 @@
 # limitations under the License.
 
 import logging
+import re
 import thrift
-import time
+import urllib
 
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
+from desktop.lib.ttl_cache import TTLCache
+from desktop.lib.worker_pool import WorkerPool
 from filebrowser.views import location_to_url
 
 from beeswaxd.ttypes import BeeswaxException
 
 from beeswax.conf import BEESWAX_SERVER_HOST, BEESWAX_SERVER_PORT,\
-  BROWSE_PARTITIONED_TABLE_LIMIT
+  BROWSE_PARTITIONED_TABLE_LIMIT, SERVER_CONFIG_CACHE_TTL, METADATA_CACHE_TTL
 from impala.conf import SERVER_HOST, SERVER_PORT
 from beeswax.design import hql_query
 from beeswax.models import QueryHistory, HIVE_SERVER2
 from beeswax.conf import SERVER_INTERFACE
+from beeswax.server import query_monitor
 
 
 LOG = logging.getLogger(__name__)
 
+# Default configuration of each query server, see Dbms.get_server_capabilities()
+_server_capabilities_cache = TTLCache(maxsize=100, ttl=3600)
+
+# (server key, kind, ...) -> table list, table, partitions, partition names or sample.
+# See Dbms._cached().
+_metadata_cache = TTLCache(maxsize=10000, ttl=3600)
+
+# How many partitions to get from the metastore at once, see
+# Dbms.get_partitions_by_names(). Half the thrift clients a server gets (see
+# desktop.lib.thrift_util.ConnectionPooler), so that one partitions page
+# leaves some to the other requests.
+PARTITION_LOAD_CONCURRENCY = 5
+
+# Characters escaped in the partition names, as by Hive's FileUtils.escapePathName()
+_PARTITION_NAME_SPECIAL_CHARS = frozenset([ chr(c) for c in range(1, 32) ] + list('"#%\'*/:=?\\\x7f{[]^'))
+
+# Name of the partition of the NULL or empty values
+DEFAULT_PARTITION_NAME = '__HIVE_DEFAULT_PARTITION__'
+
+# Statements that can't change tables or their data
+READ_ONLY_STATEMENT_RE = re.compile(r'^\s*(SELECT|EXPLAIN|SHOW|DESCRIBE|DESC|SET|ADD|LIST)\b', re.IGNORECASE)
+
 
 def get(user, query_server=None):
   # Avoid circular dependency
@@ -85,11 +111,13 @@ class Dbms:
 
 
   def get_table(self, database, table_name):
-    return self.client.get_table(database, table_name)
+    return self._cached(('table', self.client.user.username, database, table_name),
+                        lambda: self.client.get_table(database, table_name))
 
 
   def get_tables(self, database='default', table_names='.*'):
-    return self.client.get_tables(database, table_names)
+    return list(self._cached(('tables', self.client.user.username, database, table_names),
+                             lambda: self.client.get_tables(database, table_names)))
 
 
   def execute_query(self, query, design):
@@ -107,25 +135,32 @@ class Dbms:
 
 
   def fetch(self, query_handle, start_over=False, rows=None):
-    no_start_over_support = [config_variable for config_variable in self.get_default_configuration(False)
-                                             if config_variable.key == 'support_start_over'
-                                               and config_variable.value == 'false']
-    if no_start_over_support:
+    if not self.supports_start_over():
       start_over = False
 
     return self.client.fetch(query_handle, start_over, rows)
 
 
   def get_sample(self, table):
-    """No samples if it's a view (HUE-526)"""
+    """
+    No samples if it's a view (HUE-526)
+
+    Samples are cached per user, as they may not be allowed to read the same data.
+    """
     if not table.is_view:
-      limit = min(100, BROWSE_PARTITIONED_TABLE_LIMIT.get())
-      hql = "SELECT * FROM `%s` LIMIT %s" % (table.name, limit)
-      query = hql_query(hql)
-      handle = self.execute_and_wait(query, timeout_sec=5.0)
+      return self._cached(('sample', self.client.user.username, table.name), lambda: self._fetch_sample(table))
+
 
-      if handle:
-        return self.fetch(handle)
+  def _fetch_sample(self, table):
+    limit = min(100, BROWSE_PARTITIONED_TABLE_LIMIT.get())
+    hql = "SELECT * FROM `%s` LIMIT %s" % (table.name, limit)
+    query = hql_query(hql)
+    handle = self.execute_and_wait(query, timeout_sec=5.0)
+
+    if handle:
+      result = self.fetch(handle)
+      if result is not None:
+        return SampleDataTable(list(result.rows()))
 
 
   def drop_table(self, table):
@@ -147,20 +182,23 @@ class Dbms:
 
   def execute_and_wait(self, query, timeout_sec=30.0):
     """
-    Run query and check status until it finishes or timeouts.
+    Run query and wait until it finishes or timeouts.
+    The state is watched by the query monitor of the server: an error while
+    polling it is raised.
     """
-    SLEEP_INTERVAL = 0.5
+    may_change_metadata = not READ_ONLY_STATEMENT_RE.match(query.query['query'])
+    if may_change_metadata:
+      self.invalidate_metadata()
 
     handle = self.client.query(query)
-    curr = time.time()
-    end = curr + timeout_sec
-
-    while curr <= end:
-      state = self.client.get_state(handle)
-      if state not in (QueryHistory.STATE.running, QueryHistory.STATE.submitted):
-        return handle
-      time.sleep(SLEEP_INTERVAL)
-      curr = time.time()
+    status = query_monitor.wait_until_finished(self, handle, timeout_sec)
+    if status.error is not None:
+      raise status.error
+
+    if status.finished:
+      if may_change_metadata:
+        self.invalidate_metadata()
+      return handle
     return None
 
 
@@ -169,6 +207,10 @@ class Dbms:
     Run query and return a QueryHistory object in order to see its progress on a Web page.
     """
     query_statement = query.query['query']
+    if not READ_ONLY_STATEMENT_RE.match(query_statement):
+      # Again once it is done, see invalidate_metadata_after()
+      self.invalidate_metadata()
+
     query_history = QueryHistory.build(
                                 owner=self.client.user,
                                 query=query_statement,
@@ -223,7 +265,75 @@ class Dbms:
     if max_parts is None or max_parts > BROWSE_PARTITIONED_TABLE_LIMIT.get():
       max_parts = BROWSE_PARTITIONED_TABLE_LIMIT.get()
 
-    return self.client.get_partitions(db_name, table.name, max_parts)
+    return list(self._cached(('partitions', self.client.user.username, db_name, table.name, max_parts),
+                             lambda: self.client.get_partitions(db_name, table.name, max_parts)))
+
+
+  def get_partition_names(self, db_name, table, partition_spec=None):
+    """
+    get_partition_names(db_name, table, partition_spec) -> [ partition name ]
+
+    The names of the partitions of `table', in the metastore order (by name).
+    Listing names stays cheap with many partitions: load the partitions that
+    are actually shown with get_partitions_by_names().
+
+    `partition_spec' maps partition keys to the values to match, which the
+    metastore does.
+    """
+    part_vals = _get_partition_values(table, partition_spec)
+    return list(self._cached(('partition_names', db_name, table.name, tuple(part_vals)),
+                             lambda: self.client.get_partition_names(db_name, table.name, part_vals)))
+
+
+  def get_partition_names_by_filter(self, db_name, table, filter):
+    """
+    get_partition_names_by_filter(db_name, table, filter) -> [ partition name ]
+
+    The names of the partitions matching the metastore `filter' expression,
+    e.g. 'ds > "2013-01-01" and hr = "00"', sorted like get_partition_names().
+
+    The metastore can only filter full partitions: they get cached, so that
+    loading a page of them with get_partitions_by_names() is free.
+    """
+    def load():
+      names = [ ]
+      for partition in self.client.get_partitions_by_filter(db_name, table.name, filter):
+        name = make_partition_name(table.partition_keys, partition.values)
+        self._cache_put(('partition', db_name, table.name, name), partition)
+        names.append(name)
+      names.sort()
+      return names
+
+    return list(self._cached(('partition_names_by_filter', db_name, table.name, filter), load))
+
+
+  def get_partitions_by_names(self, db_name, table, names):
+    """
+    get_partitions_by_names(db_name, table, names) -> [ partition ]
+
+    The partitions called `names', in the same order. They are fetched
+    concurrently. The ones that could not be fetched, e.g. dropped since
+    their names were listed, are left out.
+    """
+    if not names:
+      return [ ]
+
+    def load(name):
+      return self._cached(('partition', db_name, table.name, name),
+                          lambda: self.client.get_partition_by_name(db_name, table.name, name))
+
+    partitions = { }
+    pool = WorkerPool(min(len(names), PARTITION_LOAD_CONCURRENCY), name='beeswax-partitions')
+    try:
+      for name, partition, ex in pool.imap_unordered(load, names):
+        if ex is not None:
+          LOG.warn("Could not get partition %s of table %s: %s" % (name, table.name, ex))
+        else:
+          partitions[name] = partition
+    finally:
+      pool.shutdown()
+
+    return [ partitions[name] for name in names if name in partitions ]
 
 
   def explain(self, statement):
@@ -239,7 +349,80 @@ class Dbms:
 
 
   def get_default_configuration(self, include_hadoop):
-    return self.client.get_default_configuration(include_hadoop)
+    config = self.client.get_default_configuration(include_hadoop)
+    if not include_hadoop:
+      self._cache_server_capabilities(config)
+    return config
+
+
+  def get_server_capabilities(self):
+    """
+    get_server_capabilities() -> { config key: value }
+
+    The default configuration of the query server, cached for
+    SERVER_CONFIG_CACHE_TTL seconds as it rarely changes.
+    """
+    capabilities = _server_capabilities_cache.get(self._server_key())
+    if capabilities is None:
+      capabilities = self._cache_server_capabilities(self.client.get_default_configuration(False))
+    return capabilities
+
+
+  def invalidate_server_capabilities(self):
+    _server_capabilities_cache.invalidate(self._server_key())
+
+
+  def supports_start_over(self):
+    return self.get_server_capabilities().get('support_start_over') != 'false'
+
+
+  def _cache_server_capabilities(self, config):
+    capabilities = dict([(config_variable.key, config_variable.value) for config_variable in config])
+    ttl = SERVER_CONFIG_CACHE_TTL.get()
+    if ttl > 0:
+      _server_capabilities_cache.put(self._server_key(), capabilities, ttl=ttl)
+    return capabilities
+
+
+  def invalidate_metadata(self):
+    """Forget the cached tables, partitions and samples of the query server."""
+    server_key = self._server_key()
+    _metadata_cache.invalidate_if(lambda key: key[0] == server_key)
+
+
+  def invalidate_metadata_after(self, query_history):
+    """To call once the query of `query_history' has run."""
+    if not READ_ONLY_STATEMENT_RE.match(query_history.query):
+      self.invalidate_metadata()
+
+
+  def _cached(self, key, load):
+    """
+    _cached(key, load) -> The metadata cached under `key' for this server,
+    or the result of `load()', which gets cached for METADATA_CACHE_TTL seconds.
+    """
+    ttl = METADATA_CACHE_TTL.get()
+    if ttl <= 0:
+      return load()
+    key = (self._server_key(),) + key
+    value = _metadata_cache.get(key)
+    if value is None:
+      value = load()
+      if value is not None:
+        _metadata_cache.put(key, value, ttl=ttl)
+    return value
+
+
+  def _cache_put(self, key, value):
+    """Cache `value' like _cached() would have."""
+    ttl = METADATA_CACHE_TTL.get()
+    if ttl > 0:
+      _metadata_cache.put((self._server_key(),) + key, value, ttl=ttl)
+
+
+  def _server_key(self):
+    query_server = self.client.query_server
+    return (self.server_type, query_server['server_name'], query_server['server_host'], query_server['server_port'])
 
 
   def _get_browse_limit_clause(self, table):
@@ -251,6 +434,44 @@ class Dbms:
     return ""
 
 
+def make_partition_name(partition_keys, values):
+  """
+  make_partition_name(partition_keys, values) -> "key1=value1/key2=value2"
+
+  The name the metastore gives to the partition of `values'.
+  """
+  return '/'.join([ '%s=%s' % (_escape_partition_name(key.name), _escape_partition_name(value))
+                    for key, value in zip(partition_keys, values) ])
+
+
+def parse_partition_name(name):
+  """
+  parse_partition_name(name) -> [ value ]
+
+  The values of the partition called `name', in the order of the partition keys.
+  """
+  return [ urllib.unquote(part.split('=', 1)[-1]) for part in name.split('/') ]
+
+
+def _escape_partition_name(value):
+  if not value:
+    return DEFAULT_PARTITION_NAME
+  return ''.join([ char in _PARTITION_NAME_SPECIAL_CHARS and '%%%02X' % ord(char) or char for char in value ])
+
+
+def _get_partition_values(table, partition_spec):
+  """
+  The values of the leading partition keys of `table' set in `partition_spec',
+  '' standing for any value, as the metastore expects them.
+  """
+  if not partition_spec:
+    return [ ]
+  values = [ partition_spec.get(key.name) or '' for key in table.partition_keys ]
+  while values and not values[-1]:
+    values.pop()
+  return values
+
+
 class Table:
   """
   Represents the metadata of a Hive Table.
@@ -269,6 +490,18 @@ class DataTable:
   pass
 
 
+class SampleDataTable(DataTable):
+  """
+  The first rows of a table, which can be read several times.
+  """
+  def __init__(self, rows):
+    self._rows = rows
+    self.has_more = False
+
+  def rows(self):
+    return iter(self._rows)
+
+
 # TODO decorator?
 def expand_exception(exc, db):
   try:
@@ -16,9 +16,15 @@
 # limitations under the License.
 
 
+import datetime
+import logging
+import threading
+import time
+
 import thrift
 
 from desktop.lib import thrift_util
+from desktop.lib.ttl_cache import TTLCache
 
 from cli_service import TCLIService
 from cli_service.ttypes import TOpenSessionReq, TGetTablesReq, TFetchResultsReq,\
@@ -31,6 +37,17 @@ from beeswax.models import Session, HiveServerQueryHandle, HiveServerQueryHistor
 from beeswax.server.dbms import Table, NoSuchObjectException, DataTable
 
 
+LOG = logging.getLogger(__name__)
+
+# Result set schemas, keyed by server and operation handle
+_result_set_metadata_cache = TTLCache(maxsize=1000, ttl=3600)
+
+# Sessions unused for that long are reopened instead of reused
+SESSION_MAX_IDLE_SECONDS = 12 * 60 * 60
+# How often to record in the DB that a session is still in use
+SESSION_TOUCH_INTERVAL_SECONDS = 60
+
+
 class HiveServerTable(Table):
 
   def __init__(self, table_results, table_schema, desc_results, desc_schema):
@@ -82,38 +99,65 @@ class HiveServerTable(Table):
 class HiveServerTRowSet:
   def __init__(self, row_set, schema):
     self.row_set = row_set
-    self.rows = row_set.rows
+    self.rows = row_set.rows or []
     self.schema = schema
     self.startRowOffset = row_set.startRowOffset
+    self._getters = None
 
   def is_empty(self):
-    return len(self.rows) == 0
+    return not self.rows and not _columns_length(self.row_set.columns)
 
   def cols(self, col_names):
+    positions = [(col_name, _get_col_position(self.schema, col_name)) for col_name in col_names]
     cols_rows = []
-    for row in self.rows:
-      row = HiveServerTRow(row, self.schema)
-      cols = {}
-      for col_name in col_names:
-        cols[col_name] = row.col(col_name)
-      cols_rows.append(cols)
+    for fields in self.fields():
+      cols_rows.append(dict([(col_name, fields[pos]) for col_name, pos in positions]))
     return cols_rows
 
   def __iter__(self):
-    return self
+    getters = self.getters()
+    for row in self.rows:
+      yield HiveServerTRow(row, self.schema, getters)
 
-  def next(self):
-    if self.rows:
-      return HiveServerTRow(self.rows.pop(0), self.schema)
+  def fields(self):
+    """
+    fields() -> generator of lists of python values, one list per row.
+
+    Supports both row and column oriented results.
+    """
+    if not self.rows and self.row_set.columns:
+      for fields in zip(*[_column_values(column) for column in self.row_set.columns]):
+        yield list(fields)
     else:
-      raise StopIteration
+      getters = self.getters()
+      for row in self.rows:
+        yield _row_fields(row, getters)
+
+  def getters(self):
+    """One value getter per column, resolved from the schema types."""
+    if self._getters is None:
+      self._getters = _value_getters(self.schema)
+    return self._getters
+
 
+def _columns_length(columns):
+  if not columns:
+    return 0
+  return len(_column_values(columns[0]))
+
+
+def _column_values(tcolumn):
+  for field in ('boolColumn', 'byteColumn', 'i16Column', 'i32Column', 'i64Column', 'doubleColumn', 'stringColumn'):
+    values = getattr(tcolumn, field)
+    if values is not None:
+      return [value.value for value in values]
+  return []
 
 
 class HiveServerDataTable(DataTable):
   def __init__(self, results, schema):
     self.schema = schema and schema.schema
-    self.row_set = HiveServerTRowSet(results.results, schema)
+    self.row_set = HiveServerTRowSet(results.results, self.schema)
     self.has_more = not self.row_set.is_empty()    # Should be results.hasMoreRows but always True in HS2
     self.startRowOffset = self.row_set.startRowOffset    # Always 0 in HS2
 
@@ -128,8 +172,7 @@ class HiveServerDataTable(DataTable):
       return []
 
   def rows(self):
-    for row in self.row_set:
-      yield row.fields()
+    return self.row_set.fields()
 
 
 
@@ -146,23 +189,36 @@ class HiveServerTTableSchema:
     return HiveServerTColumnDesc(self.columns[pos]).val
 
   def _get_col_position(self, column_name):
-    return filter(lambda col: col.columnName == column_name, self.schema.columns)[0].position - 1
+    return _get_col_position(self.schema, column_name)
 
 
 class HiveServerTRow:
-  def __init__(self, row, schema):
+  def __init__(self, row, schema, getters=None):
     self.row = row
     self.schema = schema
+    self.getters = getters
 
   def col(self, colName):
     pos = self._get_col_position(colName)
     return HiveServerTColumnValue(self.row.colVals[pos]).val
 
   def _get_col_position(self, column_name):
-    return filter(lambda col: col.columnName == column_name, self.schema.columns)[0].position - 1
+    return _get_col_position(self.schema, column_name)
 
   def fields(self):
-    return [HiveServerTColumnValue(field).val for field in self.row.colVals]
+    if self.getters is None:
+      self.getters = _value_getters(self.schema)
+    return _row_fields(self.row, self.getters)
+
+
+def _row_fields(row, getters):
+  if getters is None:
+    return [HiveServerTColumnValue(col_val).val for col_val in row.colVals]
+  return [getter(col_val) for getter, col_val in zip(getters, row.colVals)]
+
+
+def _get_col_position(schema, column_name):
+  return filter(lambda col: col.columnName == column_name, schema.columns)[0].position - 1
 
 
 class HiveServerTColumnValue:
@@ -171,7 +227,6 @@ class HiveServerTColumnValue:
 
   @property
   def val(self):
-    # TODO get index from schema
     if self.column_value.boolVal is not None:
       return self.column_value.boolVal.value
     elif self.column_value.byteVal is not None:
@@ -188,6 +243,46 @@ class HiveServerTColumnValue:
       return self.column_value.stringVal.value
 
 
+# The TColumnValue field holding the values of each primitive type. Everything
+# else (strings, timestamps, complex types...) comes as a string.
+_VALUE_FIELDS = {
+  TType.BOOLEAN_TYPE: 'boolVal',
+  TType.TINYINT_TYPE: 'byteVal',
+  TType.SMALLINT_TYPE: 'i16Val',
+  TType.INT_TYPE: 'i32Val',
+  TType.BIGINT_TYPE: 'i64Val',
+  TType.FLOAT_TYPE: 'doubleVal',
+  TType.DOUBLE_TYPE: 'doubleVal',
+}
+
+def _value_getter(field):
+  def getter(column_value):
+    value = getattr(column_value, field)
+    if value is None:
+      # Not where the type says it should be: look for it
+      return HiveServerTColumnValue(column_value).val
+    return value.value
+  return getter
+
+def _value_getters(schema):
+  """
+  _value_getters(schema) -> [ function(TColumnValue) -> python value ]
+
+  Picks where to read each column from once, instead of probing all the
+  fields of every cell. Without a schema, returns None.
+  """
+  if schema is None:
+    return None
+  getters = []
+  for column in schema.columns:
+    field = 'stringVal'
+    for ttype in column.typeDesc.types[:1]:
+      if ttype.primitiveEntry is not None:
+        field = _VALUE_FIELDS.get(ttype.primitiveEntry.type, 'stringVal')
+    getters.append(_value_getter(field))
+  return getters
+
+
 class HiveServerTColumnDesc:
   def __init__(self, column):
     self.column = column
@@ -221,6 +316,116 @@ class HiveServerTColumnDesc:
         return ttype.userDefinedTypeEntry
 
 
+class SessionCache(object):
+  """
+  The HiveServer2 session of each user, kept in the process.
+
+  Sessions are persisted in the Session model: the DB is only read when
+  the process does not know the session of a user yet, and written to when
+  a session is opened or, at most every SESSION_TOUCH_INTERVAL_SECONDS,
+  to record that it is still in use.
+
+  Sessions unused for more than `max_idle' seconds are assumed expired on
+  the server and reopened, rather than waiting for a call to fail.
+  Concurrent opens for the same key are coalesced: one thread opens the
+  session while the others wait for it.
+  """
+  def __init__(self, max_idle=SESSION_MAX_IDLE_SECONDS):
+    self.max_idle = max_idle
+    self._lock = threading.Lock()
+    self._sessions = {}         # key -> _CachedSession
+    self._opening = {}          # key -> threading.Event
+
+  def get(self, key, load, create):
+    """
+    @param load    Returns the last known session from the DB, or None
+    @param create  Opens a new session
+    """
+    while True:
+      self._lock.acquire()
+      try:
+        now = time.time()
+        cached = self._sessions.get(key)
+        if cached is not None and now - cached.last_used < self.max_idle:
+          cached.last_used = now
+          touch = now - cached.touched > SESSION_TOUCH_INTERVAL_SECONDS
+          if touch:
+            cached.touched = now
+          session = cached.session
+          break
+        event = self._opening.get(key)
+        if event is None:
+          event = self._opening[key] = threading.Event()
+          opener = True
+        else:
+          opener = False
+      finally:
+        self._lock.release()
+
+      if opener:
+        return self._open(key, cached is None and load or None, create, event)
+      event.wait()
+
+    if touch:
+      _touch_session(session)
+    return session
+
+  def _open(self, key, load, create, event):
+    try:
+      session = None
+      if load is not None:
+        session = load()
+        if session is not None and _session_age(session) >= self.max_idle:
+          session = None
+      if session is None:
+        session = create()
+
+      self._lock.acquire()
+      try:
+        self._sessions[key] = _CachedSession(session)
+      finally:
+        self._lock.release()
+      return session
+    finally:
+      self._lock.acquire()
+      try:
+        del self._opening[key]
+      finally:
+        self._lock.release()
+      event.set()
+
+  def invalidate(self, key, session=None):
+    """Forget the session of `key', if it is still `session'."""
+    self._lock.acquire()
+    try:
+      cached = self._sessions.get(key)
+      if cached is not None and (session is None or cached.session.id == session.id):
+        del self._sessions[key]
+    finally:
+      self._lock.release()
+
+
+class _CachedSession(object):
+  def __init__(self, session):
+    self.session = session
+    self.last_used = self.touched = time.time()
+
+
+def _session_age(session):
+  delta = datetime.datetime.now() - session.last_used
+  return delta.days * 86400 + delta.seconds
+
+
+def _touch_session(session):
+  try:
+    Session.objects.filter(id=session.id).update(last_used=datetime.datetime.now())
+  except Exception, ex:
+    LOG.warn("Could not update the last use of session %s: %s" % (session.id, ex))
+
+
+_session_cache = SessionCache()
+
+
 class HiveServerClient:
   """Thrift service client."""
 
@@ -236,19 +441,20 @@ class HiveServerClient:
 
 
   def call(self, fn, req, status=TStatusCode.SUCCESS_STATUS):
-    session = Session.objects.get_session(self.user)
-    if session is None:
-      session = self.open_session(self.user)
+    # Only the requests on a session need one: operation requests (e.g.
+    # FetchResults, GetOperationStatus) don't touch the cache nor the DB.
+    session = None
     if hasattr(req, 'sessionHandle') and req.sessionHandle is None:
+      session = self.get_session()
       req.sessionHandle = session.get_handle()
 
     res = fn(req)
 
-    if res.status.statusCode == TStatusCode.ERROR_STATUS: #TODO should be TStatusCode.INVALID_HANDLE_STATUS
-      print 'HS2 Session has expired: %s' % res
-      print 'Retrying with a new sessions...'
+    if session is not None and res.status.statusCode == TStatusCode.ERROR_STATUS: #TODO should be TStatusCode.INVALID_HANDLE_STATUS
+      LOG.info('HS2 session has expired, retrying with a new session: %s' % res)
 
-      session = self.open_session(self.user)
+      _session_cache.invalidate(self._session_key(), session)
+      session = self.get_session()
       req.sessionHandle = session.get_handle()
 
       res = fn(req)
@@ -260,6 +466,17 @@ class HiveServerClient:
       return res
 
 
+  def get_session(self):
+    """The session of the user, opened if there is no usable one yet."""
+    return _session_cache.get(self._session_key(),
+                              load=lambda: Session.objects.get_session(self.user),
+                              create=lambda: self.open_session(self.user))
+
+
+  def _session_key(self):
+    return (self.query_server['server_host'], self.query_server['server_port'], self.user.username)
+
+
   def open_session(self, user):
     req = TOpenSessionReq(username=user.username)
     res = self._client.OpenSession(req)
@@ -275,9 +492,10 @@ class HiveServerClient:
                                   server_protocol_version=res.serverProtocolVersion)
 
   def close_session(self):
-    session = Session.objects.get_session(self.user).get_handle()
+    session = self.get_session()
+    _session_cache.invalidate(self._session_key(), session)
 
-    req = TCloseSessionReq(sessionHandle=session)
+    req = TCloseSessionReq(sessionHandle=session.get_handle())
     return self._client.CloseSession(req)
 
 
@@ -346,14 +564,25 @@ class HiveServerClient:
     res = self.call(self._client.FetchResults, fetch_req)
 
     if operation_handle.hasResultSet:
-      meta_req = TGetResultSetMetadataReq(operationHandle=operation_handle)
-      schema = self.call(self._client.GetResultSetMetadata, meta_req)
+      schema = self.get_result_set_metadata(operation_handle)
     else:
       schema = None
 
     return res, schema
 
 
+  def get_result_set_metadata(self, operation_handle):
+    """The schema of a result set does not change: only ask for it once per operation."""
+    key = (self.query_server['server_host'], self.query_server['server_port'],
+           operation_handle.operationId.guid, operation_handle.operationId.secret)
+    schema = _result_set_metadata_cache.get(key)
+    if schema is None:
+      meta_req = TGetResultSetMetadataReq(operationHandle=operation_handle)
+      schema = self.call(self._client.GetResultSetMetadata, meta_req)
+      _result_set_metadata_cache.put(key, schema)
+    return schema
+
+
   def get_operation_status(self, operation_handle):
     req = TGetOperationStatusReq(operationHandle=operation_handle)
     res = self.call(self._client.GetOperationStatus, req)
@@ -462,4 +691,13 @@ class HiveServerClientCompatible:
   def get_partitions(self, *args, **kwargs): raise NotImplementedError()
 
 
+  def get_partition_names(self, *args, **kwargs): raise NotImplementedError()
+
+
+  def get_partition_by_name(self, *args, **kwargs): raise NotImplementedError()
+
+
+  def get_partitions_by_filter(self, *args, **kwargs): raise NotImplementedError()
+
+
   def alter_partition(self, db_name, tbl_name, new_part): raise NotImplementedError()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Watches the progress of the running queries.
+
+There is one monitor per query server. Its thread polls the state (and, when
+someone is reading it, the log) of all the queries being waited on, backing
+off while nothing changes. Callers block until the query changes instead of
+polling the server themselves: several pages watching the same query cost a
+single poll.
+
+Under the spawning server, the monitors run on green threads, so that a
+request waiting on a query only parks a greenlet.
+"""
+
+import logging
+import os
+
+if os.getenv('HUE_SPAWNING', 'no') == 'yes':
+  from eventlet.green import threading
+  from eventlet.green import time
+else:
+  import threading
+  import time
+
+from beeswax.models import QueryHistory
+
+
+LOG = logging.getLogger(__name__)
+
+# Bounds of the delay between two polls of a query. The delay grows by
+# POLL_BACKOFF each time nothing changed.
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 5.0
+POLL_BACKOFF = 1.5
+
+# Queries nobody waited on for that long are not polled anymore
+WATCH_EXPIRY_SECONDS = 30
+
+# How long a request waits for some progress at once
+if os.getenv('HUE_SPAWNING', 'no') == 'yes':
+  LONG_POLL_TIMEOUT = 25.0
+else:
+  LONG_POLL_TIMEOUT = 5.0
+
+# How long the watch page's requests wait for some progress. Not at all with
+# a bounded pool of request threads: the page polls again a bit later.
+if os.getenv('HUE_SPAWNING', 'no') == 'yes':
+  WATCH_POLL_TIMEOUT = LONG_POLL_TIMEOUT
+else:
+  WATCH_POLL_TIMEOUT = 0
+
+_RUNNING_STATES = (QueryHistory.STATE.submitted, QueryHistory.STATE.running)
+
+
+class UnknownStateError(Exception):
+  """The query server could not tell the state of a query, e.g. it expired."""
+
+
+class QueryStatus(object):
+  """
+  What is known about a query. `version' increases with every change of the
+  state or of the log. `state' is None when the query was not polled yet, or
+  when the server could not tell: `error' is the exception of that poll.
+  `finished' is only set once the server said so.
+  """
+  def __init__(self, state, log, version, finished, error=None):
+    self.state = state
+    self.log = log
+    self.version = version
+    self.finished = finished
+    self.error = error
+
+
+class _WatchedQuery(object):
+  def __init__(self, db, handle):
+    self.db = db
+    self.handle = handle
+    self.state = None
+    self.log = None
+    self.version = 0
+    self.finished = False
+    self.error = None
+    self.want_log = False
+    self.interval = MIN_POLL_INTERVAL
+    self.next_poll = 0
+    self.last_interest = time.time()
+
+  def status(self):
+    return QueryStatus(self.state, self.log, self.version, self.finished, self.error)
+
+
+class QueryMonitor(object):
+  """
+  Polls the queries of one server, from a thread that runs while there are
+  unfinished queries to watch.
+  """
+  def __init__(self, name):
+    self._name = name
+    self._cond = threading.Condition()
+    self._queries = { }
+    self._thread = None
+
+  def wait(self, db, handle, version=0, timeout=LONG_POLL_TIMEOUT, want_log=False):
+    """
+    wait(db, handle, version, timeout, want_log) -> QueryStatus
+
+    Wait until the query gets past `version', finishes, fails to be polled
+    or `timeout' elapses. With `want_log', the status carries the log too.
+    """
+    now = time.time()
+    deadline = now + timeout
+    key = handle.get()
+
+    self._cond.acquire()
+    try:
+      self._expire(now)
+      query = self._queries.get(key)
+      if query is None:
+        query = self._queries[key] = _WatchedQuery(db, handle)
+      query.last_interest = now
+      if version > query.version:
+        # Seen by another process, or before a restart
+        version = 0
+
+      if want_log and not query.want_log:
+        query.want_log = True
+        if not query.finished or query.log is None:
+          # Fetch the log now, even for a finished query
+          query.finished = False
+          query.next_poll = 0
+          version = min(version, query.version)
+
+      if not query.finished:
+        self._start()
+        self._cond.notifyAll()
+
+      while not query.finished and query.error is None and query.version <= version:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._cond.wait(remaining)
+        query.last_interest = time.time()
+
+      return query.status()
+    finally:
+      self._cond.release()
+
+  def wait_until_finished(self, db, handle, timeout):
+    """
+    wait_until_finished(db, handle, timeout) -> QueryStatus
+
+    The status may still be a running one if the query did not finish in
+    time, or have an `error' if it could not be polled.
+    """
+    deadline = time.time() + timeout
+    status = self.wait(db, handle, 0, timeout)
+    while not status.finished and status.error is None and time.time() < deadline:
+      status = self.wait(db, handle, status.version, deadline - time.time())
+    return status
+
+  def _start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name='query-monitor %s' % (self._name,))
+      self._thread.setDaemon(True)
+      self._thread.start()
+
+  def _run(self):
+    self._cond.acquire()
+    try:
+      while True:
+        now = time.time()
+        self._expire(now)
+
+        active = [ query for query in self._queries.itervalues() if not query.finished ]
+        if not active:
+          self._thread = None
+          return
+
+        due = [ query for query in active if query.next_poll <= now ]
+        if not due:
+          self._cond.wait(min([ query.next_poll for query in active ]) - now)
+          continue
+
+        self._cond.release()
+        try:
+          results = [ (query, self._poll(query)) for query in due ]
+        finally:
+          self._cond.acquire()
+
+        for query, (state, log, error) in results:
+          self._update(query, state, log, error)
+        self._cond.notifyAll()
+    finally:
+      self._cond.release()
+
+  def _poll(self, query):
+    """Called without the lock. Returns (state, log, error)."""
+    state = log = None
+    try:
+      state = query.db.get_state(query.handle)
+      if state is None:
+        # Some clients tell errors this way
+        raise UnknownStateError("Could not get the state of the query")
+      if query.want_log:
+        log = query.db.get_log(query.handle)
+    except Exception, ex:
+      LOG.warn("Could not check query %s: %s" % (query.handle, ex))
+      return None, None, ex
+    return state, log, None
+
+  def _update(self, query, state, log, error):
+    if error is not None:
+      # The waiters get the error. The next ones poll again.
+      query.error = error
+      query.version += 1
+      self._queries.pop(query.handle.get(), None)
+      return
+
+    changed = state != query.state or (log is not None and log != query.log)
+    if changed:
+      query.version += 1
+      query.state = state
+      if log is not None:
+        query.log = log
+      query.interval = MIN_POLL_INTERVAL
+    else:
+      query.interval = min(query.interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+    query.next_poll = time.time() + query.interval
+
+    if state not in _RUNNING_STATES:
+      query.finished = True
+
+  def _expire(self, now):
+    for key, query in self._queries.items():
+      if query.last_interest < now - WATCH_EXPIRY_SECONDS:
+        del self._queries[key]
+
+
+_monitors = { }
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(db):
+  """The monitor of the query server of `db'."""
+  key = db._server_key()
+  _monitors_lock.acquire()
+  try:
+    monitor = _monitors.get(key)
+    if monitor is None:
+      monitor = _monitors[key] = QueryMonitor('%s:%s' % key[2:])
+    return monitor
+  finally:
+    _monitors_lock.release()
+
+
+def wait(db, handle, version=0, timeout=LONG_POLL_TIMEOUT, want_log=False):
+  return get_monitor(db).wait(db, handle, version, timeout, want_log)
+
+
+def wait_until_finished(db, handle, timeout):
+  return get_monitor(db).wait_until_finished(db, handle, timeout)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Refreshes the state of the outstanding (submitted or running) queries shown
+in the history pages.
+
+The servers are asked concurrently, through a bounded pool of threads, and
+the new states are written back with one UPDATE per state. States that were
+just fetched are shared between requests and users for a few seconds, as
+several people watching the same history page would otherwise poll the
+servers for each of them.
+"""
+
+import logging
+
+from desktop.lib.ttl_cache import TTLCache
+from desktop.lib.worker_pool import WorkerPool
+
+from beeswax import models
+from beeswax.server import dbms
+
+
+LOG = logging.getLogger(__name__)
+
+# How many servers calls to make at once
+STATE_REFRESH_CONCURRENCY = 10
+
+# How long the fetched states are reused
+STATE_CACHE_TTL_SECONDS = 5
+
+# QueryHistory id -> state enum
+_state_cache = TTLCache(maxsize=10000, ttl=STATE_CACHE_TTL_SECONDS)
+
+
+def refresh_query_states(query_histories):
+  """
+  refresh_query_states(query_histories) -> None
+
+  Update the last_state of the outstanding queries among `query_histories',
+  in the DB and on the objects themselves. The other states are stable,
+  more-or-less: the transition from available/failed to expired occurs
+  lazily when the user attempts to view results that have expired.
+
+  Queries whose state could not be retrieved are left as they are.
+  """
+  outstanding = [ history for history in query_histories
+                  if history.last_state <= models.QueryHistory.STATE.running.index ]
+  if not outstanding:
+    return
+
+  states = { }
+  to_fetch = [ ]
+  for history in outstanding:
+    state = _state_cache.get(history.id)
+    if state is None:
+      to_fetch.append(history)
+    else:
+      states[history.id] = state
+
+  if to_fetch:
+    states.update(_fetch_states(to_fetch))
+
+  _save_states(outstanding, states)
+
+
+def _fetch_states(query_histories):
+  """Ask the servers, concurrently. Returns { QueryHistory id: state enum }."""
+  full_objects = _get_full_objects(query_histories)
+  states = { }
+
+  pool = WorkerPool(min(len(full_objects), STATE_REFRESH_CONCURRENCY), name='beeswax-query-state')
+  try:
+    for history, state, ex in pool.imap_unordered(_fetch_state, full_objects):
+      if ex is not None:
+        LOG.warn("Could not get the state of query %s: %s" % (history.id, ex))
+      elif state is not None:     # Errors were logged at the source
+        states[history.id] = state
+        _state_cache.put(history.id, state)
+  finally:
+    pool.shutdown()
+
+  return states
+
+
+def _fetch_state(query_history):
+  handle = query_history.get_handle()
+  if handle is None:
+    return None
+  return dbms.get(query_history.owner, query_history.get_query_server_config()).get_state(handle)
+
+
+def _get_full_objects(query_histories):
+  """The server specific QueryHistory of each object, with one query per server type."""
+  by_type = { }
+  for history in query_histories:
+    by_type.setdefault(history.server_type, [ ]).append(history.id)
+
+  full_objects = [ ]
+  for klass in (models.BeeswaxQueryHistory, models.HiveServerQueryHistory):
+    ids = by_type.pop(klass.node_type, None)
+    if ids:
+      full_objects.extend(klass.objects.select_related('owner').filter(id__in=ids))
+  for server_type in by_type:
+    LOG.error('Unknown QueryHistory type: %s' % (server_type,))
+  return full_objects
+
+
+def _save_states(query_histories, states):
+  """
+  Update the queries whose state moved forward, with one UPDATE per new state.
+  States never move backward: the servers can be behind the DB.
+  """
+  to_update = { }
+  for history in query_histories:
+    state = states.get(history.id)
+    if state is None:
+      continue
+    if state.index < history.last_state:
+      LOG.error("Invalid query state transition: %s -> %s" % (models.QueryHistory.STATE[history.last_state], state))
+    elif state.index > history.last_state:
+      to_update.setdefault(state.index, [ ]).append(history.id)
+      history.last_state = state.index
+
+  for index, ids in to_update.iteritems():
+    models.QueryHistory.objects.filter(id__in=ids, last_state__lt=index).update(last_state=index)
@@ -20,6 +20,7 @@
 %>
 
 <%namespace name="layout" file="layout.mako" />
+<%namespace name="comps" file="beeswax_components.mako" />
 
 ${commonheader(_('Beeswax Table Partitions: %(tableName)s') % dict(tableName=table.name), app_name, user, '100px')}
 ${layout.menubar(section='tables')}
@@ -27,13 +28,27 @@ ${layout.menubar(section='tables')}
 <div class="container-fluid">
 <h1>${_('Partitions')}</h1>
 
-<table class="table table-striped table-condensed datatables">
+<form class="well form-inline" method="GET" action="${ url('beeswax:describe_partitions', table=table.name) }">
+  % for field in table.partition_keys:
+    <input type="text" name="partition_${field.name}" value="${partition_spec[field.name] | h}" class="input-small" placeholder="${field.name}" title="${_('Exact value of %(key)s') % dict(key=field.name)}"/>
+  % endfor
+  <input type="text" name="filter" value="${partition_filter | h}" class="input-xlarge" placeholder="${_('Filter, e.g. %(example)s') % dict(example='%s > "value"' % table.partition_keys[0].name) | h}"/>
+  <input type="hidden" name="sort" value="${sort | h}"/>
+  <button type="submit" class="btn">${_('Filter')}</button>
+</form>
+
+<%
+  sort_params = filter_params.copy()
+  sort_params['sort'] = sort == 'desc' and 'asc' or 'desc'
+%>
+<table class="table table-striped table-condensed">
   % if partitions:
     <tr>
       % for field in table.partition_keys:
         <th>${field.name}</th>
       % endfor
       <th>${_('Path')}</th>
+      <th><a href="?${sort_params.urlencode()}" title="${_('Reverse the order')}">${sort == 'desc' and '&darr;' or '&uarr;' | n}</a></th>
     </tr>
     % for partition in partitions:
       <tr>
@@ -48,12 +63,18 @@ ${layout.menubar(section='tables')}
             ${partition.sd.location}
           % endif
         </td>
+        <td></td>
       </tr>
     % endfor
+  % elif partition_filter or filter(None, partition_spec.values()):
+    <tr><td>${_('No partition matches.')}</td></tr>
   % else:
     <tr><td>${_('Table has no partitions.')}</td></tr>
   % endif
 </table>
+% if page.total_count():
+  ${comps.pagination(page)}
+% endif
 
 </div>
 
@@ -69,7 +69,9 @@ ${layout.menubar(section='query')}
 					% if download_urls:
 					<li class="nav-header">${_('Downloads')}</li>
 					<li><a target="_blank" href="${download_urls["csv"]}">${_('Download as CSV')}</a></li>
+					<li><a target="_blank" href="${download_urls["csv"]}?compress=gzip">${_('Download as compressed CSV')}</a></li>
 					<li><a target="_blank" href="${download_urls["xls"]}">${_('Download as XLS')}</a></li>
+					<li><a target="_blank" href="${download_urls["tsv"]}?compress=gzip">${_('Download as compressed TSV')}</a></li>
 					% endif
 					%if can_save:
 					<li><a data-toggle="modal" href="#saveAs">${_('Save')}</a></li>
@@ -147,6 +149,9 @@ ${layout.menubar(section='query')}
               % if start_row != 0:
                   <li class="prev"><a title="${_('Beginning of List')}" href="${ url(app_name + ':view_results', query.id, 0) }${'?context=' + context_param or '' | n}">&larr; ${_('Beginning of List')}</a></li>
               % endif
+              % if start_row >= 100:
+                  <li><a title="${_('Previous page')}" href="${ url(app_name + ':view_results', query.id, start_row - 100) }${'?context=' + context_param or '' | n}">&larr; ${_('Previous Page')}</a></li>
+              % endif
               % if has_more and len(results) == 100:
                   <li><a title="${_('Next page')}" href="${ url(app_name + ':view_results', query.id, next_row) }${'?context=' + context_param or '' | n}">${_('Next Page')} &rarr;</a></li>
               % endif
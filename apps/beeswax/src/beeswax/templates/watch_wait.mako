@@ -78,13 +78,17 @@ ${layout.menubar(section='query')}
     }
 
     resizeLogs();
-    refreshView();
     var logsAtEnd = true;
+    var version = 0;
+    var logOffset = ${len(log)};
+    refreshView();
 
     function refreshView() {
-      $.getJSON("${url(app_name + ':watch_query_refresh_json', query.id)}", function (data) {
+      // The server may wait for some progress before answering
+      $.getJSON("${url(app_name + ':watch_query_refresh_json', query.id)}", {version: version, log_offset: logOffset}, function (data) {
         if (data.isSuccess || data.isFailure) {
           location.href = fwdUrl;
+          return;
         }
         if (data.jobs && data.jobs.length > 0) {
           $(".jobLink").remove();
@@ -94,12 +98,20 @@ ${layout.menubar(section='query')}
           }
         }
         var _logsEl = $("#log pre");
-        var newLines = data.log.split("\n").slice(_logsEl.text().split("\n").length);
-        _logsEl.text(_logsEl.text() + newLines.join("\n"));
+        if (data.logReset) {
+          _logsEl.text(data.log);
+        }
+        else if (data.log) {
+          _logsEl.text(_logsEl.text() + data.log);
+        }
         if (logsAtEnd) {
           _logsEl.scrollTop(_logsEl[0].scrollHeight - _logsEl.height());
         }
+        version = data.version;
+        logOffset = data.logOffset;
         window.setTimeout(refreshView, 1000);
+      }).error(function () {
+        window.setTimeout(refreshView, 5000);
       });
     }
 
@@ -19,6 +19,7 @@
 # Tests for beeswax
 
 import cStringIO
+import datetime
 import gzip
 import logging
 import os
@@ -26,6 +27,8 @@ import re
 import shutil
 import tempfile
 import threading
+import time
+import zipfile
 
 from nose.tools import assert_true, assert_equal, assert_false
 from nose.plugins.skip import SkipTest
@@ -129,6 +132,15 @@ class TestBeeswaxWithHadoop(BeeswaxSampleProvider):
     response = self.client.get("/beeswax/table/test/partitions")
     assert_true("is not partitioned." in response.content)
 
+  def test_filter_partitions(self):
+    response = self.client.get("/beeswax/table/test_partitions/partitions?partition_boom=boom_two")
+    assert_true("baz_one" in response.content)
+    response = self.client.get("/beeswax/table/test_partitions/partitions?partition_boom=boom_three")
+    assert_false("baz_one" in response.content)
+    assert_true("No partition matches." in response.content)
+    response = self.client.get('/beeswax/table/test_partitions/partitions?filter=baz+%3D+%22baz_one%22')
+    assert_true("boom_two" in response.content)
+
   def test_browse_partitions_with_limit(self):
     # Limit to 90
     finish = beeswax.conf.BROWSE_PARTITIONED_TABLE_LIMIT.set_for_testing("90")
@@ -329,8 +341,11 @@ for x in sys.stdin:
   def test_fetch_configuration(self):
     class MockClient:
       """Check if sent fetch correctly supports start_over."""
-      def __init__(self, support_start_over):
+      def __init__(self, support_start_over, config, query_server):
         self.support_start_over = support_start_over
+        self.config = config
+        self.query_server = query_server
+        self.config_calls = 0
 
       def fetch(self, query_id, start_over, fetch_size):
         assert_equal(self.support_start_over, start_over)
@@ -339,34 +354,33 @@ for x in sys.stdin:
         res.ready = False
         return res
 
+      def get_default_configuration(self, include_hadoop):
+        self.config_calls += 1
+        return self.config
+
     class ConfigVariable:
       def __init__(self, **entries):
         self.__dict__.update(entries)
 
     client = self.db
-
-    prev_get_default_configuration = client.get_default_configuration
     prev_client = client.client
 
-    try:
-      client.client = MockClient(True)
-      client.get_default_configuration = lambda a: []
-      client.fetch(None, True, 5)
-
-      client.client = MockClient(False)
-      client.get_default_configuration = lambda a: []
-      client.fetch(None, False, 5)
-
-      client.client = MockClient(True)
-      client.get_default_configuration = lambda a: [ConfigVariable(key='support_start_over', value='true')]
-      client.fetch(None, True, 5)
+    def check(support_start_over, config, start_over):
+      client.client = MockClient(support_start_over, config, prev_client.query_server)
+      client.invalidate_server_capabilities()
+      client.fetch(None, start_over, 5)
+      client.fetch(None, start_over, 5)
+      # The configuration is only asked once
+      assert_equal(1, client.client.config_calls)
 
-      client.client = MockClient(False)
-      client.get_default_configuration = lambda a: [ConfigVariable(key='support_start_over', value='false')]
-      client.fetch(None, True, 5)
+    try:
+      check(True, [], True)
+      check(False, [], False)
+      check(True, [ConfigVariable(key='support_start_over', value='true')], True)
+      check(False, [ConfigVariable(key='support_start_over', value='false')], True)
     finally:
-      client.get_default_configuration = prev_get_default_configuration
       client.client = prev_client
+      client.invalidate_server_capabilities()
 
 
   def test_parameterization(self):
@@ -500,19 +514,26 @@ for x in sys.stdin:
     hql = 'SELECT * FROM test'
     query = hql_query(hql)
 
-    # Get the result in xls.
+    # Get the result in xls. It is a real spreadsheet.
     handle = self.db.execute_and_wait(query)
     xls_resp = download(handle, 'xls', self.db)
-    # Should be CSV since we simply change the file extension and MIME type from CSV to XLS.
-    translated_csv = xls_resp.content
-    # It should have 257 lines (256 + header)
-    assert_equal(len(translated_csv.strip('\r\n').split('\r\n')), 257)
+    assert_equal('attachment; filename=query_result.xlsx', xls_resp['Content-Disposition'])
+    sheet = zipfile.ZipFile(cStringIO.StringIO(xls_resp.content)).read('xl/worksheets/sheet1.xml')
+    # It should have 257 rows (256 + header)
+    assert_equal(257, sheet.count('<row>'))
 
     # Get the result in csv.
     query = hql_query(hql)
     handle = self.db.execute_and_wait(query)
     csv_resp = download(handle, 'csv', self.db)
-    assert_equal(csv_resp.content, translated_csv)
+    assert_equal(len(csv_resp.content.strip('\r\n').split('\r\n')), 257)
+
+    # Get the result in compressed tsv.
+    query = hql_query(hql)
+    handle = self.db.execute_and_wait(query)
+    tsv_resp = download(handle, 'tsv', self.db, compress=True)
+    tsv = gzip.GzipFile(fileobj=cStringIO.StringIO(tsv_resp.content)).read()
+    assert_equal(257, len(tsv.strip('\n').split('\n')))
 
   def test_designs(self):
     """Test design view and interaction"""
@@ -1098,14 +1119,75 @@ def test_import_gzip_reader():
   beeswax.create_table.IMPORT_PEEK_SIZE = len(data_gz) - 1024
   try:
     reader = beeswax.create_table.GzipFileReader
+    data_gz_sio.seek(0)
     lines = reader.readlines(data_gz_sio, 'utf-8')
-    assert_true(lines is not None)
+    assert_true(lines)
     lines_joined = '\n'.join(lines)
     assert_equal(data[:len(lines_joined)], lines_joined)
   finally:
     beeswax.create_table.IMPORT_PEEK_SIZE = old_peek_size
 
 
+def test_import_sniffer():
+  create_table = beeswax.create_table
+
+  # Delimiter
+  lines = [ 'a,b\tc,d', 'e,f\tg,h', '', 'i,j\tk,l' ]
+  delim, fields_list = create_table._readfields(lines, ['\\t', ',', ' '])
+  assert_equal(',', delim)
+  assert_equal([ ['a', 'b\tc', 'd'], ['e', 'f\tg', 'h'], ['i', 'j\tk', 'l'] ], fields_list)
+  delim, fields_list = create_table._readfields([ 'a b', 'c' ], [',', ' '])
+  assert_equal(',', delim)
+
+  # Types
+  fields_list = [
+    [ '1', '2147483648', '1.5', '2013-01-01 10:00:00', 'x', '' ],
+    [ '-2', '1', '2', '2013-01-02 10:00:00.123', '1', '' ],
+    [ '\\N', '3', '1e3', '\\N', '2013-01-01 10:00:00' ],
+  ]
+  assert_equal(['int', 'bigint', 'double', 'timestamp', 'string', 'string'],
+               create_table._infer_column_types(fields_list))
+
+  # Sampling several places of a file
+  class MockStat(object):
+    isDir = False
+    def __init__(self, path, size):
+      self.path = path
+      self.size = size
+
+  class MockFs(object):
+    user = 'test'
+    def __init__(self, data):
+      self.data = data
+    def setuser(self, user):
+      pass
+    def stats(self, path):
+      return MockStat(path, len(self.data))
+    def open(self, path):
+      return cStringIO.StringIO(self.data)
+
+  old_peek_size = create_table.IMPORT_PEEK_SIZE
+  create_table.IMPORT_PEEK_SIZE = 64
+  try:
+    data = '\n'.join([ '%d,a' % i for i in range(100) ] + [ '%d,b' % i for i in range(100) ])
+    fs = MockFs(data)
+    samples = create_table.TextFileReader.sample(fs, '/data', len(data), 'utf-8')
+    assert_equal(create_table.IMPORT_SAMPLE_OFFSETS, len(samples))
+    assert_equal('0,a', samples[0][0])
+    assert_equal('99,b', samples[-1][-1])
+    for lines in samples:
+      for line in lines:
+        assert_true(line in data.split('\n'), line)
+
+    delim, file_type, fields_list, column_types = create_table._parse_fields(fs, '/data', 'utf-8', ['gzip', 'text'], [',', ' '])
+    assert_equal(',', delim)
+    assert_equal('text', file_type)
+    assert_equal(create_table.IMPORT_PEEK_NLINES, len(fields_list))
+    assert_equal(['int', 'string'], column_types)
+  finally:
+    create_table.IMPORT_PEEK_SIZE = old_peek_size
+
+
 def test_parse_results():
   data = ["foo\tbar", "baz\tboom"]
   results = type('Result', (object,), {'has_more': False, 'start_row': False, 'columns': False, 'data': data})
@@ -1150,6 +1232,420 @@ def test_history_page():
   response = do_view('')
   assert_equal('beeswax', response.context['filter_params']['type'])
 
+def test_refresh_query_states():
+  from beeswax.server import query_state
+
+  user = User.objects.get_or_create(username='test_query_state')[0]
+  STATE = beeswax.models.QueryHistory.STATE
+  histories = [beeswax.models.BeeswaxQueryHistory.objects.create(owner=user, query='SELECT %d' % i,
+                                                                 last_state=STATE.running.index, server_id='id%d' % i)
+               for i in range(4)]
+  histories.append(beeswax.models.BeeswaxQueryHistory.objects.create(owner=user, query='SELECT 5',
+                                                                     last_state=STATE.available.index, server_id='id5'))
+  new_states = {
+    histories[0].id: STATE.available,
+    histories[1].id: STATE.failed,
+    histories[2].id: None,                # Could not get it
+    histories[3].id: STATE.submitted,     # Backward
+  }
+
+  calls = []
+  def fetch_state(history):
+    calls.append(history.id)
+    return new_states[history.id]
+
+  prev_fetch_state = query_state._fetch_state
+  query_state._fetch_state = fetch_state
+  query_state._state_cache.clear()
+  try:
+    query_state.refresh_query_states(histories)
+    assert_equal(sorted(new_states.keys()), sorted(calls))
+    expected = [STATE.available.index, STATE.failed.index, STATE.running.index, STATE.running.index, STATE.available.index]
+    assert_equal(expected, [history.last_state for history in histories])
+    assert_equal(expected, [beeswax.models.QueryHistory.objects.get(id=history.id).last_state for history in histories])
+
+    # Recent states come from the cache
+    calls = []
+    stale = beeswax.models.QueryHistory.objects.filter(id=histories[0].id)
+    stale.update(last_state=STATE.running.index)
+    query_state.refresh_query_states(stale)
+    assert_equal([], calls)
+    assert_equal(STATE.available.index, beeswax.models.QueryHistory.objects.get(id=histories[0].id).last_state)
+  finally:
+    query_state._fetch_state = prev_fetch_state
+    query_state._state_cache.clear()
+
+
+class MockResultsDb(object):
+  """Serves `n_rows' rows through a forward-only cursor, like the query servers."""
+  def __init__(self, n_rows):
+    self.n_rows = n_rows
+    self.cursor = 0
+    self.fetched = 0
+
+  def fetch(self, handle, start_over, rows):
+    if start_over:
+      self.cursor = 0
+    first = self.cursor
+    self.cursor = min(self.n_rows, self.cursor + rows)
+    self.fetched += self.cursor - first
+    class Result: pass
+    res = Result()
+    res.ready = True
+    res.columns = ['id', 'name']
+    res.rows = lambda: iter([[i, u'row %d' % i] for i in range(first, self.cursor)])
+    res.has_more = self.cursor < self.n_rows
+    return res
+
+
+def test_result_cache():
+  from beeswax import result_cache
+
+  tmpdir = tempfile.mkdtemp()
+  prev_cache = result_cache._cache
+  try:
+    result_cache._cache = result_cache.ResultCache(tmpdir, max_size=10 ** 8, max_query_size=10 ** 8)
+    db = MockResultsDb(12345)
+
+    columns, rows, has_more = result_cache.get_rows(db, None, 1, 100, 100)
+    assert_equal(['id', 'name'], columns)
+    assert_equal([[i, u'row %d' % i] for i in range(100, 200)], rows)
+    assert_true(has_more)
+
+    # Going back, or a second reader, does not ask the server again
+    fetched = db.fetched
+    assert_equal([0, u'row 0'], result_cache.get_rows(db, None, 1, 0, 100)[1][0])
+    assert_equal(fetched, db.fetched)
+
+    # Last page
+    columns, rows, has_more = result_cache.get_rows(db, None, 1, 12300, 100)
+    assert_equal(45, len(rows))
+    assert_false(has_more)
+    assert_equal(12345, db.fetched)
+
+    # Downloads read everything from the cache
+    columns, blocks = result_cache.iter_row_blocks(db, None, 1)
+    assert_equal(range(12345), [row[0] for rows in blocks for row in rows])
+    assert_equal(12345, db.fetched)
+
+    # Reloaded from disk
+    result_cache._cache = result_cache.ResultCache(tmpdir, max_size=10 ** 8, max_query_size=10 ** 8)
+    assert_equal([[12344, u'row 12344']], result_cache.get_rows(db, None, 1, 12344, 100)[1])
+    assert_equal(12345, db.fetched)
+
+    # Too large for the cache: the rest is read from the server
+    result_cache._cache = result_cache.ResultCache(tmpdir, max_size=10 ** 8, max_query_size=1)
+    db = MockResultsDb(20000)
+    columns, blocks = result_cache.iter_row_blocks(db, None, 2)
+    assert_equal(range(20000), [row[0] for rows in blocks for row in rows])
+    assert_equal([[15000, u'row 15000']], result_cache.get_rows(db, None, 2, 15000, 1)[1])
+
+    # Least recently used queries are evicted
+    cache = result_cache.ResultCache(tmpdir, max_size=1, max_query_size=10 ** 8)
+    result_cache._cache = cache
+    result_cache.get_rows(MockResultsDb(10), None, 3, 0, 100)
+    result_cache.get_rows(MockResultsDb(10), None, 4, 0, 100)
+    assert_false(os.path.exists(os.path.join(tmpdir, '1.rows')))
+    assert_false(os.path.exists(os.path.join(tmpdir, '3.rows')))
+    assert_true(os.path.exists(os.path.join(tmpdir, '4.rows')))
+  finally:
+    result_cache._cache = prev_cache
+    shutil.rmtree(tmpdir)
+
+
+def test_result_cache_interrupted_write():
+  from beeswax import result_cache
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    cache = result_cache.ResultCache(tmpdir, max_size=10 ** 8, max_query_size=10 ** 8)
+    assert_true(cache.enabled)
+    entry = cache.get(1)
+    entry.set_columns(['id'])
+    entry.append([[i] for i in range(10)])
+
+    # Interrupted in the middle of the next block
+    rows_path, index_path = os.path.join(tmpdir, '1.rows'), os.path.join(tmpdir, '1.idx')
+    f = open(rows_path, 'ab')
+    f.write('garbage')
+    f.close()
+    f = open(index_path, 'ab')
+    f.write('\0' * 5)
+    f.close()
+
+    entry = result_cache.CachedResult(tmpdir, 1)
+    assert_equal(10, entry.row_count)
+    assert_equal(os.path.getsize(rows_path) + os.path.getsize(index_path), entry.size)
+    entry.append([[i] for i in range(10, 20)])
+    entry = result_cache.CachedResult(tmpdir, 1)
+    assert_equal(range(20), [row[0] for row in entry.read_rows(0, 100)])
+
+    # Not in a directory others can write to
+    os.chmod(tmpdir, 0777)
+    assert_false(result_cache.ResultCache(tmpdir, max_size=10 ** 8, max_query_size=10 ** 8).enabled)
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+class MockMonitoredDb(object):
+  """Query running for `polls' calls of get_state(), with one more log line per call."""
+  def __init__(self, polls):
+    self.polls = polls
+    self.calls = 0
+    self.log_calls = 0
+
+  def get_state(self, handle):
+    self.calls += 1
+    if self.calls > self.polls:
+      return beeswax.models.QueryHistory.STATE.available
+    return beeswax.models.QueryHistory.STATE.running
+
+  def get_log(self, handle):
+    self.log_calls += 1
+    return ''.join([ 'line %d\n' % i for i in range(self.calls) ])
+
+
+def test_query_monitor():
+  from beeswax.server import query_monitor
+
+  handle = beeswax.models.BeeswaxQueryHandle(secret='1', has_result_set=True, log_context='1')
+  monitor = query_monitor.QueryMonitor('test')
+  db = MockMonitoredDb(3)
+
+  status = monitor.wait(db, handle, 0, timeout=5.0, want_log=True)
+  assert_equal(1, status.version)
+  assert_equal(beeswax.models.QueryHistory.STATE.running, status.state)
+  assert_equal('line 0\n', status.log)
+  assert_false(status.finished)
+
+  # Returns on progress
+  status = monitor.wait(db, handle, status.version, timeout=5.0, want_log=True)
+  assert_true(status.version > 1)
+  assert_true(status.log.startswith('line 0\nline 1\n'), status.log)
+
+  # Several waiters share the polls
+  results = [ ]
+  def wait():
+    results.append(monitor.wait_until_finished(db, handle, timeout=5.0))
+  threads = [ threading.Thread(target=wait) for i in range(5) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert_equal(5, len(results))
+  for status in results:
+    assert_true(status.finished)
+    assert_equal(beeswax.models.QueryHistory.STATE.available, status.state)
+  assert_equal(4, db.calls)
+
+  # Finished queries are not polled again
+  status = monitor.wait(db, handle, 0, timeout=5.0, want_log=True)
+  assert_true(status.finished)
+  assert_equal(4, db.calls)
+
+  # Nothing left to poll
+  for i in range(50):
+    if monitor._thread is None:
+      break
+    time.sleep(0.1)
+  assert_equal(None, monitor._thread)
+
+  # Times out
+  prev = query_monitor.MIN_POLL_INTERVAL
+  try:
+    query_monitor.MIN_POLL_INTERVAL = 0.5
+    handle = beeswax.models.BeeswaxQueryHandle(secret='2', has_result_set=True, log_context='2')
+    db = MockMonitoredDb(1000)
+    status = monitor.wait_until_finished(db, handle, timeout=0.2)
+    assert_false(status.finished)
+    db.polls = 0
+    assert_true(monitor.wait_until_finished(db, handle, timeout=5.0).finished)
+  finally:
+    query_monitor.MIN_POLL_INTERVAL = prev
+
+  # A failed poll does not finish the query
+  handle = beeswax.models.BeeswaxQueryHandle(secret='3', has_result_set=True, log_context='3')
+  db = MockMonitoredDb(1)
+  db.get_state = lambda handle: None
+  status = monitor.wait_until_finished(db, handle, timeout=5.0)
+  assert_false(status.finished)
+  assert_true(isinstance(status.error, query_monitor.UnknownStateError))
+
+  # The next waiters poll again
+  del db.get_state
+  status = monitor.wait(db, handle, 0, timeout=5.0)
+  assert_equal(None, status.error)
+  assert_equal(beeswax.models.QueryHistory.STATE.running, status.state)
+
+
+def test_metadata_cache():
+  class MockHandle(object):
+    def __init__(self, id):
+      self.id = id
+    def get(self):
+      return self.id, None
+
+  class MockTable(object):
+    is_view = False
+    def __init__(self, name):
+      self.name = name
+
+  class MockMetadataClient(object):
+    query_server = {'server_name': 'beeswax', 'server_host': 'localhost', 'server_port': -1}
+
+    def __init__(self, username):
+      self.user = User(username=username)
+      self.calls = [ ]
+      self.tables = ['a', 'b']
+
+    def get_tables(self, database, table_names):
+      self.calls.append('get_tables')
+      return self.tables
+
+    def get_table(self, database, table_name):
+      self.calls.append('get_table')
+      return MockTable(table_name)
+
+    def query(self, query):
+      self.calls.append(query.query['query'])
+      return MockHandle('%s %s' % (time.time(), query.query['query']))
+
+    def get_state(self, handle):
+      return beeswax.models.QueryHistory.STATE.available
+
+    def get_default_configuration(self, include_hadoop):
+      return [ ]
+
+    def fetch(self, handle, start_over, rows):
+      class Result(object):
+        ready = True
+        has_more = False
+        def rows(self):
+          return iter([['1'], ['2']])
+      return Result()
+
+  finish = conf.METADATA_CACHE_TTL.set_for_testing(60)
+  db = dbms.Dbms(MockMetadataClient('test'), beeswax.models.QueryHistory.SERVER_TYPE[0][0])
+  try:
+    db.invalidate_metadata()
+
+    assert_equal(['a', 'b'], db.get_tables())
+    assert_equal(['a', 'b'], db.get_tables())
+    table = db.get_table('default', 'a')
+    assert_true(table is db.get_table('default', 'a'))
+    assert_equal([['1'], ['2']], list(db.get_sample(table).rows()))
+    assert_equal([['1'], ['2']], list(db.get_sample(table).rows()))
+    assert_equal(['get_tables', 'get_table', 'SELECT * FROM `a` LIMIT 100'], db.client.calls)
+
+    # The server may authorize each user differently
+    other = dbms.Dbms(MockMetadataClient('other'), beeswax.models.QueryHistory.SERVER_TYPE[0][0])
+    assert_equal(['a', 'b'], other.get_tables())
+    other.get_sample(other.get_table('default', 'a'))
+    assert_equal(['get_tables', 'get_table', 'SELECT * FROM `a` LIMIT 100'], other.client.calls)
+
+    # Statements that may change the tables reset the cache
+    db.client.calls = [ ]
+    db.client.tables = ['a', 'b', 'c']
+    db.execute_and_wait(hql_query('SELECT * FROM a'))
+    assert_equal(['a', 'b'], db.get_tables())
+    db.execute_and_wait(hql_query('CREATE TABLE c (i int)'))
+    assert_equal(['a', 'b', 'c'], db.get_tables())
+    assert_equal(['SELECT * FROM a', 'CREATE TABLE c (i int)', 'get_tables'], db.client.calls)
+    db.execute_and_wait(hql_query('DFS -rm -r /user/hive/warehouse/c'))
+    db.get_tables()
+    assert_equal('get_tables', db.client.calls[-1])
+  finally:
+    db.invalidate_metadata()
+    finish()
+
+
+def test_partition_browsing():
+  class MockKey(object):
+    def __init__(self, name):
+      self.name = name
+
+  class MockTable(object):
+    name = 'logs'
+    partition_keys = [MockKey('ds'), MockKey('hr')]
+
+  class MockPartition(object):
+    def __init__(self, values):
+      self.values = values
+
+  class MockPartitionClient(object):
+    query_server = {'server_name': 'beeswax', 'server_host': 'localhost', 'server_port': -2}
+
+    def __init__(self):
+      self.user = User(username='test')
+      self.calls = [ ]
+      self.lock = threading.Lock()
+      self.values = [ ['2013-01-%02d' % day, '%02d' % hour] for day in range(1, 11) for hour in range(24) ]
+
+    def _record(self, call):
+      self.lock.acquire()
+      try:
+        self.calls.append(call)
+      finally:
+        self.lock.release()
+
+    def get_partition_names(self, db_name, tbl_name, part_vals=None, max_parts=None):
+      self._record(('names', tuple(part_vals or ())))
+      names = [ ]
+      for values in self.values:
+        if [ v for v, spec in zip(values, part_vals or [ ]) if spec and v != spec ]:
+          continue
+        names.append(dbms.make_partition_name(MockTable.partition_keys, values))
+      return names
+
+    def get_partition_by_name(self, db_name, tbl_name, part_name):
+      self._record('partition')
+      if part_name.endswith('hr=13'):
+        raise Exception('Dropped')
+      return MockPartition(dbms.parse_partition_name(part_name))
+
+    def get_partitions_by_filter(self, db_name, tbl_name, filter, max_parts=None):
+      self._record('filter')
+      return [ MockPartition(values) for values in self.values if values[1] == '23' ]
+
+  finish = conf.METADATA_CACHE_TTL.set_for_testing(60)
+  db = dbms.Dbms(MockPartitionClient(), beeswax.models.QueryHistory.SERVER_TYPE[0][0])
+  table = MockTable()
+  try:
+    db.invalidate_metadata()
+
+    # Names are listed once, partitions are loaded by page
+    names = db.get_partition_names('default', table)
+    assert_equal(240, len(names))
+    assert_equal('ds=2013-01-01/hr=00', names[0])
+    partitions = db.get_partitions_by_names('default', table, names[10:20])
+    assert_equal([ ['2013-01-01', '%02d' % hour] for hour in range(10, 20) if hour != 13 ],
+                 [ partition.values for partition in partitions ])
+    db.get_partitions_by_names('default', table, names[10:20])
+    assert_equal(1 + 10 + 1, len(db.client.calls))
+
+    # Values are matched by the metastore
+    db.client.calls = [ ]
+    names = db.get_partition_names('default', table, {'ds': '2013-01-02'})
+    assert_equal(24, len(names))
+    assert_equal(2, len(db.get_partition_names('default', table, {'hr': '05', 'ds': ''})[:2]))
+    assert_equal([('names', ('2013-01-02',)), ('names', ('', '05'))], db.client.calls)
+
+    # Partitions come along with filtered names
+    db.client.calls = [ ]
+    names = db.get_partition_names_by_filter('default', table, 'hr = "23"')
+    assert_equal(10, len(names))
+    assert_equal(10, len(db.get_partitions_by_names('default', table, names)))
+    assert_equal(['filter'], db.client.calls)
+
+    # Escaping
+    name = dbms.make_partition_name(table.partition_keys, ['2013-01-01 10:00', 'a/b'])
+    assert_equal('ds=2013-01-01 10%3A00/hr=a%2Fb', name)
+    assert_equal(['2013-01-01 10:00', 'a/b'], dbms.parse_partition_name(name))
+  finally:
+    db.invalidate_metadata()
+    finish()
+
+
 def test_strip_trailing_semicolon():
   # Note that there are two queries (both an execute and an explain) scattered
   # in this file that use semicolons all the way through.
@@ -1174,6 +1670,28 @@ Starting Job = job_201003191517_0003, Tracking URL = http://localhost:50030/jobd
   assert_equal([], beeswax.views._parse_out_hadoop_jobs("nothing to see here"))
 
 
+def test_get_hadoop_jobs():
+  class MockQueryHistory(object):
+    id = -1
+
+  query_history = MockQueryHistory()
+  line = "Starting Job = %s, Tracking URL = http://localhost:50030/jobdetails.jsp?jobid=%s\n"
+  log = "Running\n" + line % ('job_1', 'job_1')
+  job_2 = line % ('job_2', 'job_2')
+
+  assert_equal(['job_1'], beeswax.views._get_hadoop_jobs(query_history, log + job_2[:30]))
+  assert_equal(len(log), beeswax.views._hadoop_jobs_cache.get(query_history.id)[0])
+
+  # Only the rest is parsed. The last line is not complete yet.
+  log += job_2 + line % ('job_1', 'job_1') + (line % ('job_3', 'job_3')).strip()
+  assert_equal(['job_1', 'job_2', 'job_3'], beeswax.views._get_hadoop_jobs(query_history, log))
+  assert_equal(log.rfind('\n') + 1, beeswax.views._hadoop_jobs_cache.get(query_history.id)[0])
+
+  # Another log
+  assert_equal(['job_4'], beeswax.views._get_hadoop_jobs(query_history, line % ('job_4', 'job_4')))
+  beeswax.views._hadoop_jobs_cache.invalidate(query_history.id)
+
+
 def test_hive_site():
   """Test hive-site parsing"""
   HIVE_SITE = """
@@ -1250,6 +1768,82 @@ def test_search_log_line():
   assert_false(search_log_line('ql.Driver', 'FAILED: Parse Error', logs))
 
 
+def test_hive_server2_row_set():
+  from cli_service import ttypes as cli_ttypes
+  from beeswax.server.hive_server2_lib import HiveServerTRowSet
+
+  def column(name, position, ttype):
+    type_desc = cli_ttypes.TTypeDesc(types=[cli_ttypes.TTypeEntry(primitiveEntry=cli_ttypes.TPrimitiveTypeEntry(type=ttype))])
+    return cli_ttypes.TColumnDesc(columnName=name, position=position, typeDesc=type_desc)
+
+  schema = cli_ttypes.TTableSchema(columns=[column('id', 1, cli_ttypes.TType.INT_TYPE),
+                                            column('name', 2, cli_ttypes.TType.STRING_TYPE)])
+  rows = [cli_ttypes.TRow(colVals=[cli_ttypes.TColumnValue(i32Val=cli_ttypes.TI32Value(value=i)),
+                                   cli_ttypes.TColumnValue(stringVal=cli_ttypes.TStringValue(value='row%d' % i))])
+          for i in range(3)]
+  # NULLs
+  rows.append(cli_ttypes.TRow(colVals=[cli_ttypes.TColumnValue(), cli_ttypes.TColumnValue()]))
+
+  row_set = HiveServerTRowSet(cli_ttypes.TRowSet(startRowOffset=0, rows=rows), schema)
+  expected = [[0, 'row0'], [1, 'row1'], [2, 'row2'], [None, None]]
+  assert_equal(expected, list(row_set.fields()))
+  # Iterating does not consume the rows
+  assert_equal(expected, [row.fields() for row in row_set])
+  assert_equal(expected, [row.fields() for row in row_set])
+  assert_equal('row1', list(row_set)[1].col('name'))
+  assert_equal([{'name': 'row0'}, {'name': 'row1'}, {'name': 'row2'}, {'name': None}], row_set.cols(('name',)))
+
+  # Column oriented results
+  columns = [cli_ttypes.TColumn(i32Column=[cli_ttypes.TI32Value(value=i) for i in range(2)]),
+             cli_ttypes.TColumn(stringColumn=[cli_ttypes.TStringValue(value='row%d' % i) for i in range(2)])]
+  row_set = HiveServerTRowSet(cli_ttypes.TRowSet(startRowOffset=0, rows=[], columns=columns), schema)
+  assert_false(row_set.is_empty())
+  assert_equal([[0, 'row0'], [1, 'row1']], list(row_set.fields()))
+
+
+def test_hive_server2_session_cache():
+  from beeswax.server.hive_server2_lib import SessionCache
+
+  class MockSession:
+    def __init__(self, id, age=0):
+      self.id = id
+      self.last_used = datetime.datetime.now() - datetime.timedelta(seconds=age)
+
+  opened = []
+  def create():
+    time.sleep(0.05)
+    opened.append(MockSession(len(opened) + 10))
+    return opened[-1]
+
+  # Known in the DB: no need to open a session
+  cache = SessionCache(max_idle=60)
+  assert_equal(1, cache.get('key', lambda: MockSession(1), create).id)
+  assert_equal(1, cache.get('key', lambda: None, create).id)
+  assert_equal([], opened)
+
+  # Expired in the DB
+  assert_equal(10, cache.get('other', lambda: MockSession(2, age=120), create).id)
+
+  # Concurrent opens are coalesced
+  cache = SessionCache(max_idle=60)
+  opened = []
+  sessions = []
+  threads = [threading.Thread(target=lambda: sessions.append(cache.get('key', lambda: None, create)))
+             for i in range(5)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert_equal(1, len(opened))
+  assert_equal([10] * 5, [session.id for session in sessions])
+
+  # Invalidating another session than the cached one does nothing
+  cache.invalidate('key', MockSession(3))
+  assert_equal(10, cache.get('key', lambda: None, create).id)
+  cache.invalidate('key', sessions[0])
+  assert_equal(11, cache.get('key', lambda: None, create).id)
+
+
 def search_log_line(component, expected_log, all_logs):
   """Checks if 'expected_log' can be found in one line of 'all_logs' outputed by the logging component 'component'."""
   return re.compile('.+?%(component)s(.+?)%(expected_log)s' % {'component': component, 'expected_log': expected_log}).search(all_logs)
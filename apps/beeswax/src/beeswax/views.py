@@ -35,6 +35,7 @@ from desktop.lib.paginator import Paginator
 from desktop.lib.django_util import copy_query_dict, format_preserving_redirect, render
 from desktop.lib.django_util import login_notrequired, get_desktop_uri_prefix
 from desktop.lib.exceptions_renderable import PopupException
+from desktop.lib.ttl_cache import TTLCache
 
 from hadoop.fs.exceptions import WebHdfsException
 from jobsub.parameterization import find_variables, substitute_variables
@@ -44,11 +45,11 @@ import beeswax.forms
 import beeswax.design
 import beeswax.management.commands.beeswax_install_examples
 
-from beeswax import common, data_export, models, conf
+from beeswax import common, data_export, models, conf, result_cache
 from beeswax.forms import LoadDataForm, QueryForm
 from beeswax.design import HQLdesign, hql_query
 from beeswax.models import SavedQuery
-from beeswax.server import dbms
+from beeswax.server import dbms, query_monitor, query_state
 from beeswax.server.dbms import expand_exception, get_query_server_config
 
 
@@ -373,16 +374,25 @@ def load_table(request, table):
 
 
 def describe_partitions(request, table):
+  DEFAULT_PAGE_SIZE = 50
   db = dbms.get(request.user)
 
   table_obj = db.get_table('default', table)
   if not table_obj.partition_keys:
     raise PopupException(_("Table '%(table)s' is not partitioned.") % {'table': table})
 
-  partitions = db.get_partitions("default", table_obj, max_parts=None)
+  page, filter_params = _list_partitions(db, table_obj, request.GET, DEFAULT_PAGE_SIZE)
 
-  return render("describe_partitions.mako", request,
-                dict(table=table_obj, partitions=partitions, request=request))
+  return render("describe_partitions.mako", request, {
+    'table': table_obj,
+    'page': page,
+    'partitions': page.object_list,
+    'partition_spec': dict([ (key.name, request.GET.get('partition_' + key.name, '')) for key in table_obj.partition_keys ]),
+    'partition_filter': request.GET.get('filter', ''),
+    'sort': request.GET.get('sort', 'asc'),
+    'filter_params': filter_params,
+    'request': request,
+  })
 
 
 def download(request, id, format):
@@ -392,7 +402,8 @@ def download(request, id, format):
   db = dbms.get(request.user, query_history.get_query_server_config())
   LOG.debug('Download results for query %s: [ %s ]' % (query_history.server_id, query_history.query))
 
-  return data_export.download(query_history.get_handle(), format, db)
+  compress = request.GET.get('compress') == 'gzip'
+  return data_export.download(query_history.get_handle(), format, db, query_history.id, compress)
 
 
 
@@ -519,7 +530,10 @@ def watch_query(request, id):
 
   # Check query state
   handle, state = _get_query_handle_and_state(query_history)
+  was_running = query_history.is_running()
   query_history.save_state(state)
+  if was_running and not query_history.is_running():
+    dbms.get(request.user, query_history.get_query_server_config()).invalidate_metadata_after(query_history)
 
 
   # Query finished?
@@ -543,24 +557,68 @@ def watch_query(request, id):
                 'query': query_history,
                 'fwd_params': request.GET.urlencode(),
                 'log': log,
-                'hadoop_jobs': _parse_out_hadoop_jobs(log),
+                'hadoop_jobs': _get_hadoop_jobs(query_history, log),
                 'query_context': query_context,
               })
 
 def watch_query_refresh_json(request, id):
+  """
+  The progress of a query, as last polled by the query monitor.
+
+  It understands the optional GET params:
+
+    version
+      The version of the status last seen. Under the spawning server, the
+      request returns as soon as there is a newer one, or after a while.
+      Otherwise it returns right away.
+
+    log_offset
+      How much of the log was already seen. Only the rest is returned.
+  """
   query_history = authorized_get_history(request, id, must_exist=True)
-  handle, state = _get_query_handle_and_state(query_history)
-  query_history.save_state(state)
+  handle = query_history.get_handle()
+  if handle is None:
+    raise PopupException(_("Failed to retrieve query state from the Beeswax Server."))
 
-  log = dbms.get(request.user, query_history.get_query_server_config()).get_log(handle)
+  try:
+    version = int(request.GET.get('version', 0))
+    log_offset = int(request.GET.get('log_offset', 0))
+  except ValueError:
+    raise PopupException(_("Invalid version or log offset."), error_code=400)
+
+  db = dbms.get(query_history.owner, query_history.get_query_server_config())
+  status = query_monitor.wait(db, handle, version, timeout=query_monitor.WATCH_POLL_TIMEOUT, want_log=True)
+  if status.error is not None:
+    raise PopupException(_("Failed to contact Beeswax Server to check query status."), detail=status.error)
+  if status.state is not None:
+    # Not polled yet otherwise
+    was_running = query_history.is_running()
+    query_history.save_state(status.state)
+    if was_running and not query_history.is_running():
+      db.invalidate_metadata_after(query_history)
+
+  if status.log is None:
+    # Not fetched yet
+    log = ''
+    log_reset = False
+    next_offset = log_offset
+  else:
+    log = status.log
+    log_reset = not 0 <= log_offset <= len(log)
+    if log_reset:
+      log_offset = 0
+    next_offset = len(log)
 
-  jobs = _parse_out_hadoop_jobs(log)
+  jobs = _get_hadoop_jobs(query_history, log)
   job_urls = {}
   for job in jobs:
     job_urls[job] = reverse('jobbrowser.views.single_job', kwargs=dict(jobid=job))
 
   result = {
-    'log': log,
+    'log': log[log_offset:],
+    'logOffset': next_offset,
+    'logReset': log_reset,
+    'version': status.version,
     'jobs': jobs,
     'jobUrls': job_urls,
     'isSuccess': query_history.is_success(),
@@ -576,15 +634,12 @@ def view_results(request, id, first_row=0):
   The query results MUST be ready.
   To display query results, one should always go through the watch_query view.
 
-  If ``first_row`` is 0, restarts (if necessary) the query read.  Otherwise, just
-  spits out a warning if first_row doesn't match the servers conception.
-  Multiple readers will produce a confusing interaction here, and that's known.
+  The rows are read through the result cache, so any ``first_row`` can be
+  shown, and several readers don't interfere with each other.
 
   It understands the ``context`` GET parameter. (See watch_query().)
   """
   first_row = long(first_row)
-  start_over = (first_row == 0)
-  results = None
   data = None
   fetch_error = False
   error_message = ''
@@ -599,8 +654,7 @@ def view_results(request, id, first_row=0):
 
   # Retrieve query results
   try:
-    results = db.fetch(handle, start_over, 100)
-    data = list(results.rows()) # Materialize results
+    columns, data, has_more = result_cache.get_rows(db, handle, query_history.id, first_row, 100)
 
     # We display the "Download" button only when we know that there are results:
     downloadable = first_row > 0 or data
@@ -610,7 +664,7 @@ def view_results(request, id, first_row=0):
     error_message, log = expand_exception(ex, db)
 
   # Handle errors
-  error = fetch_error or results is None
+  error = fetch_error or data is None
 
   context = {
     'error': error,
@@ -619,30 +673,27 @@ def view_results(request, id, first_row=0):
     'results': data,
     'expected_first_row': first_row,
     'log': log,
-    'hadoop_jobs': _parse_out_hadoop_jobs(log),
+    'hadoop_jobs': _get_hadoop_jobs(query_history, log),
     'query_context': query_context,
     'can_save': False,
     'context_param': context_param,
   }
 
   if not error:
-    #data = list(results.rows()) # Materialize results
-
     download_urls = {}
     if downloadable:
       for format in common.DL_FORMATS:
         download_urls[format] = reverse(get_app_name(request) + ':download', kwargs=dict(id=str(id), format=format))
 
     save_form = beeswax.forms.SaveResultsForm()
-    results.start_row = first_row
 
     context.update({
       'results': data,
-      'has_more': results.has_more,
-      'next_row': results.start_row + len(data),
-      'start_row': results.start_row,
+      'has_more': has_more,
+      'next_row': first_row + len(data),
+      'start_row': first_row,
       'expected_first_row': first_row,
-      'columns': results.columns,
+      'columns': columns,
       'download_urls': download_urls,
       'save_form': save_form,
       'can_save': query_history.owner == request.user,
@@ -1210,6 +1261,32 @@ def _parse_query_context(context):
 
 
 HADOOP_JOBS_RE = re.compile("(http[^\s]*/jobdetails.jsp\?jobid=([a-z0-9_]*))")
+
+# QueryHistory id -> (length of the log parsed, hadoop job ids found)
+_hadoop_jobs_cache = TTLCache(maxsize=1000, ttl=3600)
+
+def _get_hadoop_jobs(query_history, log):
+  """
+  _get_hadoop_jobs(query_history, log) -> list of job ids
+
+  Like _parse_out_hadoop_jobs(), but only the part of the log that was not
+  parsed before is looked at. Logs only grow: the jobs found in complete
+  lines are remembered per query.
+  """
+  offset, jobs = _hadoop_jobs_cache.get(query_history.id, (0, [ ]))
+  if offset > len(log):
+    # Not the log we have seen
+    offset, jobs = 0, [ ]
+
+  end = max(offset, log.rfind('\n', offset) + 1)
+  if end > offset:
+    jobs = jobs + [ job for job in _parse_out_hadoop_jobs(log[offset:end]) if job not in jobs ]
+    _hadoop_jobs_cache.put(query_history.id, (end, jobs))
+
+  # The last line may not be complete yet
+  return jobs + [ job for job in _parse_out_hadoop_jobs(log[end:]) if job not in jobs ]
+
+
 def _parse_out_hadoop_jobs(log):
   """
   Ideally, Hive would tell us what jobs it has run directly
@@ -1311,8 +1388,7 @@ def _list_query_history(user, querydict, page_size, prefix=""):
 
   # We do slicing ourselves, rather than letting the Paginator handle it, in order to
   # update the last_state on the running queries
-  for history in page.object_list:
-    _update_query_state(history.get_full_object())
+  query_state.refresh_query_states(page.object_list)
 
   # We need to pass the parameters back to the template to generate links
   keys_to_copy = [ prefix + key for key in ('user', 'type', 'sort', 'design_id', 'auto_query') ]
@@ -1320,23 +1396,63 @@ def _list_query_history(user, querydict, page_size, prefix=""):
 
   return page, filter_params
 
-def _update_query_state(query_history):
+def _list_partitions(db, table, querydict, page_size):
   """
-  Update the last_state for a QueryHistory object. Returns success as True/False.
+  _list_partitions(db, table, querydict, page_size) -> (page, filter_param)
+
+  A helper to gather a page of the partitions of ``table``. Only the partition
+  names are listed in full; the partitions of the page are then loaded.
 
-  This only occurs iff the current last_state is submitted or running, since the other
-  states are stable, more-or-less.
-  Note that there is a transition from available/failed to expired. That occurs lazily
-  when the user attempts to view results that have expired.
+  GET params:
+    partition_<key> -> Exact value of the partition key <key>
+    filter          -> Metastore filter expression, e.g. ds > "2013-01-01"
+    sort            -> 'asc' (default) or 'desc', by partition name
+    page            -> Page number
   """
-  if query_history.last_state <= models.QueryHistory.STATE.running.index:
-    state_enum = dbms.get(query_history.owner, query_history.get_query_server_config()).get_state(query_history.get_handle())
-    if state_enum is None:
-      # Error was logged at the source
+  partition_spec = { }
+  for key in table.partition_keys:
+    value = querydict.get('partition_' + key.name)
+    if value:
+      partition_spec[key.name] = value
+
+  partition_filter = querydict.get('filter', '').strip()
+  try:
+    if partition_filter:
+      names = db.get_partition_names_by_filter('default', table, partition_filter)
+      if partition_spec:
+        names = [ name for name in names if _partition_matches(table, name, partition_spec) ]
+    else:
+      names = db.get_partition_names('default', table, partition_spec)
+  except Exception, ex:
+    LOG.exception('Could not list the partitions of %s' % (table.name,))
+    raise PopupException(_('Could not list the partitions of table %(table)s.') % {'table': table.name}, detail=str(ex))
+
+  # The metastore lists the names in ascending order
+  if querydict.get('sort') == 'desc':
+    names.reverse()
+
+  pagenum = int(querydict.get('page', 1))
+  if pagenum < 1:
+    pagenum = 1
+  page_names = names[ page_size * (pagenum - 1) : page_size * pagenum ]
+
+  paginator = Paginator(db.get_partitions_by_names('default', table, page_names), page_size, total=len(names))
+  page = paginator.page(pagenum)
+
+  keys_to_copy = [ 'partition_' + key.name for key in table.partition_keys ] + [ 'filter', 'sort' ]
+  filter_params = copy_query_dict(querydict, keys_to_copy)
+
+  return page, filter_params
+
+
+def _partition_matches(table, name, partition_spec):
+  values = dict(zip([ key.name for key in table.partition_keys ], dbms.parse_partition_name(name)))
+  for key, value in partition_spec.iteritems():
+    if values.get(key) != value:
       return False
-    query_history.save_state(state_enum)
   return True
 
+
 WHITESPACE = re.compile("\s+", re.MULTILINE)
 def collapse_whitespace(s):
   return WHITESPACE.sub(" ", s).strip()
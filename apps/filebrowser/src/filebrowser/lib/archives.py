@@ -15,86 +15,268 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-# Utilities for dealing with file modes.
+# Utilities for dealing with archives.
 
+import errno
+import logging
 import os
 import posixpath
+import shutil
+import tarfile
 import tempfile
+import threading
+from cStringIO import StringIO
 from zipfile import ZipFile
 
+from django.utils.encoding import smart_str
 from django.utils.translation import ugettext as _
 
+from desktop.lib.worker_pool import WorkerPool
+from hadoop.fs.exceptions import PartialFailureException
 
-__all__ = ['archive_factory']
+
+__all__ = ['archive_factory', 'get_archive_type']
+
+LOG = logging.getLogger(__name__)
+
+# How much of a member to read at once. Members up to that size are read
+# whole and written by the pool, bigger ones are streamed.
+CHUNK_SIZE = 1024 * 1024 # 1MB
+
+# How many members to write at once
+UPLOAD_CONCURRENCY = 8
+
+# (extension, archive type), longest extensions first
+ARCHIVE_EXTENSIONS = (
+  ('.tar.bz2', 'tar'),
+  ('.tar.gz', 'tar'),
+  ('.tbz2', 'tar'),
+  ('.tgz', 'tar'),
+  ('.tar', 'tar'),
+  ('.zip', 'zip'),
+)
 
 
 class Archive(object):
   """
   Acrchive interface.
   """
-  def extract(self, path):
+  def members(self, invalid=None):
+    """
+    members(invalid) -> generator of (name, size, fileobj)
+
+    The directories and files of the archive, in archive order. Names are
+    normalized relative paths. `fileobj' is None for directories, and can
+    only be read until the next member.
+
+    Members whose name would land outside of the extracted directory raise
+    IOError, or are skipped after a call to `invalid(name, exception)' if
+    given.
+    """
+    raise NotImplementedError(_("Must implement 'members' method."))
+
+  def extract(self):
     """
     Extract an Archive.
-    Should return a directory where the extracted contents live.
+    Returns a directory where the extracted contents live.
+    """
+    # Store all extracted files in a temporary directory.
+    directory = tempfile.mkdtemp()
+
+    for name, size, fileobj in self.members():
+      path = os.path.join(directory, name)
+      if fileobj is None:
+        if not os.path.isdir(path):
+          os.makedirs(path)
+        continue
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      new_file = open(path, 'wb')
+      try:
+        shutil.copyfileobj(fileobj, new_file, CHUNK_SIZE)
+      finally:
+        new_file.close()
+
+    return directory
+
+  def upload(self, fs, dest, concurrency=UPLOAD_CONCURRENCY):
     """
-    raise NotImplemented(_("Must implement 'extract' method."))
+    upload(fs, dest, concurrency) -> None
+
+    Write the contents of the archive into the new directory `dest' of `fs',
+    as the current user of `fs'. Members are streamed from the archive
+    without a local copy: small files are written by up to `concurrency'
+    threads while the next members are read, bigger ones by the calling
+    thread.
+
+    Files that fail to be written, or whose name is invalid, do not stop
+    the others; PartialFailureException is raised at the end.
+    """
+    if fs.exists(dest):
+      raise IOError(errno.EEXIST, "Destination %s already exists" % (smart_str(dest),))
+
+    user = fs.user
+    lock = threading.Lock()
+    counts = {'done': 0}
+    failures = [ ]
+    # Bounds the members read but not written yet
+    pending = threading.Semaphore(concurrency * 2)
+
+    def record(path, ex=None):
+      lock.acquire()
+      try:
+        if ex is None:
+          counts['done'] += 1
+        else:
+          LOG.warn("Failed to write %s: %s" % (path, ex))
+          failures.append((path, ex))
+      finally:
+        lock.release()
+
+    def write(path, data):
+      try:
+        fs.setuser(user)
+        try:
+          _write_file(fs, path, StringIO(data))
+          record(path)
+        except Exception, ex:
+          record(path, ex)
+      finally:
+        pending.release()
+
+    created = set()
+    pool = WorkerPool(concurrency, name='filebrowser-archive-upload')
+    try:
+      fs.mkdir(dest)
+      for name, size, fileobj in self.members(invalid=record):
+        if fileobj is None:
+          _mkdirs(fs, dest, name, created)
+          continue
+        _mkdirs(fs, dest, posixpath.dirname(name), created)
+        path = fs.join(dest, name)
+        if size <= CHUNK_SIZE:
+          data = fileobj.read()
+          pending.acquire()
+          pool.submit(write, path, data)
+        else:
+          try:
+            _write_file(fs, path, fileobj)
+            record(path)
+          except Exception, ex:
+            record(path, ex)
+      pool.join()
+    finally:
+      pool.shutdown()
+
+    if failures:
+      raise PartialFailureException("Upload of archive to %s" % (smart_str(dest),), failures, counts['done'])
+
 
 class ZipArchive(Archive):
   """
   Acts on a zip file in memory or in a temporary location.
-  Python's ZipFile class inherently buffers all reading.
+  Members are decompressed as they are read.
   """
   def __init__(self, file):
-    self.file = isinstance(file, basestring) and open(file) or file
+    self.file = isinstance(file, basestring) and open(file, 'rb') or file
     self.zfh = ZipFile(self.file)
 
-  def extract(self):
+  def members(self, invalid=None):
     """
-    Extracts a zip file.
-    If a 'file' ends with '/', then it is a directory and we must create it.
-    Else, open a file for writing and meta pipe the contents zipfile to the new file.
+    If a 'file' ends with '/', then it is a directory.
     """
-    # Store all extracted files in a temporary directory.
-    directory = tempfile.mkdtemp()
+    for info in self.zfh.infolist():
+      name = _member_name(info.filename, invalid)
+      if not name:
+        continue
+      if info.filename.endswith(posixpath.sep):
+        yield name, 0, None
+      else:
+        yield name, info.file_size, self.zfh.open(info)
 
-    dirs, files = self._filenames()
-    self._create_dirs(directory, dirs)
-    self._create_files(directory, files)
 
-    return directory
+class TarArchive(Archive):
+  """
+  Acts on a tar file, possibly compressed with gzip or bzip2, read as a stream.
+  Links and special files are skipped.
+  """
+  def __init__(self, file):
+    self.file = isinstance(file, basestring) and open(file, 'rb') or file
+    self.tfh = tarfile.open(fileobj=self.file, mode='r|*')
 
-  def _filenames(self):
-    """
-    List all dirs and files by reading the table of contents of the Zipfile.
-    """
-    dirs = []
-    files = []
-    for name in self.zfh.namelist():
-      if name.endswith(posixpath.sep):
-        dirs.append(name)
+  def members(self, invalid=None):
+    for info in self.tfh:
+      name = _member_name(info.name, invalid)
+      if not name:
+        continue
+      if info.isdir():
+        yield name, 0, None
+      elif info.isfile():
+        yield name, info.size, self.tfh.extractfile(info)
       else:
-        files.append(name)
-    return (dirs, files)
+        LOG.info("Skipping archive member %s, which is not a regular file" % (info.name,))
 
-  def _create_dirs(self, basepath, dirs=[]):
-    """
-    Creates all directories passed at the given basepath.
-    """
-    for directory in dirs:
-      directory = os.path.join(basepath, directory)
-      os.mkdir(directory)
 
-  def _create_files(self, basepath, files=[]):
-    """
-    Extract files to their rightful place.
-    Files are written to a temporary directory immediately after being decompressed.
-    """
-    for f in files:
-      new_path = os.path.join(basepath, f)
-      new_file = open(new_path, 'w')
-      new_file.write(self.zfh.read(f))
-      new_file.close()
+def _member_name(name, invalid=None):
+  """
+  The normalized relative path of an archive member, '' for members to skip.
+  Members that would land outside of the extracted directory raise IOError,
+  or are passed to `invalid(name, exception)' and skipped.
+  """
+  normalized = posixpath.normpath(name).lstrip(posixpath.sep)
+  if normalized == '.':
+    return ''
+  if normalized == '..' or normalized.startswith('..' + posixpath.sep):
+    ex = IOError(errno.EINVAL, "Invalid archive member: %s" % (smart_str(normalized),))
+    if invalid is None:
+      raise ex
+    invalid(name, ex)
+    return ''
+  return normalized
+
+
+def _mkdirs(fs, dest, name, created):
+  """Create the directory `name' under `dest' and its parents, once."""
+  if not name or name in created:
+    return
+  fs.mkdir(fs.join(dest, name))
+  while name and name not in created:
+    created.add(name)
+    name = posixpath.dirname(name)
+
+
+def _write_file(fs, path, fileobj):
+  if hasattr(fs, 'create_stream'):
+    stream = fs.create_stream(path)
+  else:
+    stream = fs.open(path, 'w')
+  try:
+    while True:
+      data = fileobj.read(CHUNK_SIZE)
+      if not data:
+        break
+      stream.write(data)
+  except:
+    if hasattr(stream, 'abort'):
+      stream.abort()
+    raise
+  stream.close()
+
+
+def get_archive_type(filename):
+  """
+  get_archive_type(filename) -> (archive type, filename without the extension)
+
+  The archive type is None when the extension is not one of an archive.
+  """
+  lower = filename.lower()
+  for extension, archive_type in ARCHIVE_EXTENSIONS:
+    if lower.endswith(extension) and len(filename) > len(extension):
+      return archive_type, filename[:-len(extension)]
+  return None, filename
 
 
 def archive_factory(path, archive_type='zip'):
+  if archive_type == 'tar':
+    return TarArchive(path)
   return ZipArchive(path)
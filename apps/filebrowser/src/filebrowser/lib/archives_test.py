@@ -15,12 +15,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import unittest
+import errno
 import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from cStringIO import StringIO
 
-from nose.tools import assert_true, assert_equal
+from nose.tools import assert_true, assert_equal, assert_raises
 
 import archives
+from hadoop.fs.exceptions import PartialFailureException
+
+
+class FakeFs(object):
+  """Keeps the files written in memory."""
+  user = 'test'
+
+  def __init__(self):
+    self.files = { }
+    self.dirs = set()
+    self.lock = threading.Lock()
+
+  def setuser(self, user):
+    assert_equal('test', user)
+
+  def join(self, *paths):
+    return posixpath.join(*paths)
+
+  def exists(self, path):
+    return path in self.files or path in self.dirs
+
+  def mkdir(self, path):
+    self.dirs.add(path)
+
+  def create_stream(self, path):
+    assert_true(posixpath.dirname(path) in self.dirs, path)
+    if path.endswith('fail'):
+      raise IOError(errno.EACCES, "Permission denied: %s" % (path,))
+    return FakeStream(self, path)
+
+
+class FakeStream(object):
+  def __init__(self, fs, path):
+    self.fs = fs
+    self.path = path
+    self.data = StringIO()
+
+  def write(self, data):
+    assert_true(len(data) <= archives.CHUNK_SIZE)
+    self.data.write(data)
+
+  def close(self):
+    self.fs.lock.acquire()
+    try:
+      self.fs.files[self.path] = self.data.getvalue()
+    finally:
+      self.fs.lock.release()
+
+  def abort(self):
+    pass
+
+
+def _make_archive(archive_type, members, mode=''):
+  """An archive of the (name, data) members, data being None for directories."""
+  sio = StringIO()
+  if archive_type == 'zip':
+    zfh = zipfile.ZipFile(sio, 'w', zipfile.ZIP_DEFLATED)
+    for name, data in members:
+      zfh.writestr(name, data or '')
+    zfh.close()
+  else:
+    tfh = tarfile.open(fileobj=sio, mode='w' + mode)
+    for name, data in members:
+      info = tarfile.TarInfo(name)
+      if data is None:
+        info.type = tarfile.DIRTYPE
+        tfh.addfile(info)
+      else:
+        info.size = len(data)
+        tfh.addfile(info, StringIO(data))
+    tfh.close()
+  sio.seek(0)
+  return sio
 
 
 class ArchiveTest(unittest.TestCase):
@@ -35,6 +116,82 @@ class ArchiveTest(unittest.TestCase):
     assert_true(os.path.isdir(directory))
     assert_true(os.path.isfile(directory + '/test.txt'))
     assert_equal(os.path.getsize(directory + '/test.txt'), 4)
+    shutil.rmtree(directory)
+
+  def test_tar(self):
+    for mode in ('', ':gz', ':bz2'):
+      archive = archives.archive_factory(_make_archive('tar', [('a/', None), ('a/b.txt', 'hello'), ('c/d.txt', 'world')], mode), 'tar')
+      directory = archive.extract()
+      try:
+        assert_equal('hello', file(directory + '/a/b.txt').read())
+        assert_equal('world', file(directory + '/c/d.txt').read())
+      finally:
+        shutil.rmtree(directory)
+
+  def test_upload(self):
+    big = 'x' * (archives.CHUNK_SIZE * 2 + 1)
+    members = [ ('a/', None), ('a/big', big), ('/b/c.txt', 'hello'), ('./d.txt', ''), ('e/f/g.txt', 'world') ]
+    members += [ ('many/%d' % i, str(i)) for i in range(50) ]
+    for archive_type, mode in (('zip', ''), ('tar', ''), ('tar', ':gz'), ('tar', ':bz2')):
+      fs = FakeFs()
+      archives.archive_factory(_make_archive(archive_type, members, mode), archive_type).upload(fs, '/dest', concurrency=3)
+      assert_equal(big, fs.files['/dest/a/big'])
+      assert_equal('hello', fs.files['/dest/b/c.txt'])
+      assert_equal('', fs.files['/dest/d.txt'])
+      assert_equal('world', fs.files['/dest/e/f/g.txt'])
+      assert_equal(54, len(fs.files))
+      assert_true('/dest/e/f' in fs.dirs)
+
+      # The destination must be new
+      assert_raises(IOError, archives.archive_factory(_make_archive(archive_type, members, mode), archive_type).upload, fs, '/dest')
+
+    # Failures do not stop the other files
+    fs = FakeFs()
+    archive = archives.archive_factory(_make_archive('zip', [('a', 'a'), ('fail', 'b'), ('c', 'c')]), 'zip')
+    try:
+      archive.upload(fs, '/dest')
+      assert_true(False)
+    except PartialFailureException, ex:
+      assert_equal(2, ex.done)
+      assert_equal(['/dest/fail'], [ path for path, error in ex.failures ])
+
+    # Unexpected errors are failures too
+    fs = FakeFs()
+    def create_stream(path):
+      if path.endswith('b'):
+        raise ValueError("Unexpected")
+      return FakeStream(fs, path)
+    fs.create_stream = create_stream
+    archive = archives.archive_factory(_make_archive('zip', [('a', 'a'), ('b', 'b'), ('big', big)]), 'zip')
+    try:
+      archive.upload(fs, '/dest')
+      assert_true(False)
+    except PartialFailureException, ex:
+      assert_equal(2, ex.done)
+      assert_equal(['/dest/b'], [ path for path, error in ex.failures ])
+
+    # Members can not escape the destination. They are skipped, as the
+    # destination already has the members before them.
+    for archive_type in ('zip', 'tar'):
+      fs = FakeFs()
+      archive = archives.archive_factory(_make_archive(archive_type, [('a', 'a'), ('../b', 'b'), ('c/../../d', 'd'), ('e', 'e')]), archive_type)
+      try:
+        archive.upload(fs, '/dest')
+        assert_true(False)
+      except PartialFailureException, ex:
+        assert_equal(2, ex.done)
+        assert_equal(['../b', 'c/../../d'], [ path for path, error in ex.failures ])
+      assert_equal(['/dest/a', '/dest/e'], sorted(fs.files.keys()))
+      assert_raises(IOError, list, archives.archive_factory(_make_archive(archive_type, [('../b', 'b')]), archive_type).members())
+
+  def test_get_archive_type(self):
+    assert_equal(('zip', 'test'), archives.get_archive_type('test.zip'))
+    assert_equal(('tar', 'test'), archives.get_archive_type('test.tar'))
+    assert_equal(('tar', 'test'), archives.get_archive_type('test.TAR.GZ'))
+    assert_equal(('tar', 'test'), archives.get_archive_type('test.tgz'))
+    assert_equal(('tar', 'test'), archives.get_archive_type('test.tar.bz2'))
+    assert_equal((None, 'test.gz'), archives.get_archive_type('test.gz'))
+    assert_equal((None, '.zip'), archives.get_archive_type('.zip'))
 
 
 if __name__ == "__main__":
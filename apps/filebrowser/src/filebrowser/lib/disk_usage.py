@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Space consumed, file counts and quotas of the entries of a directory, for
+the disk usage page.
+
+The content summaries of the directories are fetched concurrently and
+returned as they come, so that the biggest trees do not hold back the
+others. They are cached by the mtime of the directory, which changes when
+its own entries are added or removed. Changes deeper in the tree do not
+change it: the cache also expires after a while.
+"""
+
+import logging
+
+from desktop.lib.ttl_cache import TTLCache
+from desktop.lib.worker_pool import WorkerPool
+
+
+__all__ = ['iter_usage', 'add_usage']
+
+LOG = logging.getLogger(__name__)
+
+# How many GETCONTENTSUMMARY calls to make at once
+CONTENT_SUMMARY_CONCURRENCY = 10
+
+SUMMARY_CACHE_TTL = 300
+SUMMARY_CACHE_SIZE = 10000
+
+# (fs uri, user, path, mtime) -> WebHdfsContentSummary
+_summaries = TTLCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+
+# Quota values when there is none
+_NO_QUOTA = (-1, 0, None)
+
+
+def iter_usage(fs, stats, concurrency=CONTENT_SUMMARY_CONCURRENCY):
+  """
+  iter_usage(fs, stats, concurrency) -> generator of usage dicts
+
+  The usage of each entry of `stats', as soon as it is known: files and
+  cached directories first, then the other directories as their summaries
+  come. A directory whose summary could not be fetched has an 'error'.
+
+  Summaries not fetched yet are not fetched anymore once the generator is
+  closed, e.g. when the browser went away.
+  """
+  to_fetch = [ ]
+  for sb in stats:
+    if not sb.isDir:
+      yield _file_usage(sb)
+    else:
+      summary = _summaries.get(_cache_key(fs, sb))
+      if summary is None:
+        to_fetch.append(sb)
+      else:
+        yield _dir_usage(sb, summary)
+
+  if not to_fetch:
+    return
+
+  user = fs.user
+  state = {'cancelled': False}
+
+  def fetch(sb):
+    if state['cancelled']:
+      return None
+    fs.setuser(user)
+    return fs.get_content_summary(sb.path)
+
+  pool = WorkerPool(min(len(to_fetch), concurrency), name='filebrowser-disk-usage')
+  try:
+    for sb, summary, ex in pool.imap_unordered(fetch, to_fetch):
+      if ex is not None:
+        LOG.warn("Could not get the content summary of %s: %s" % (sb.path, ex))
+        usage = _file_usage(sb)
+        usage.update(spaceConsumed=None, length=None, fileCount=None, directoryCount=None, error=unicode(ex))
+        yield usage
+      else:
+        _summaries.put(_cache_key(fs, sb), summary)
+        yield _dir_usage(sb, summary)
+  finally:
+    state['cancelled'] = True
+    pool.shutdown()
+
+
+def add_usage(total, usage):
+  """Add the space and counts of `usage' to the `total' usage dict."""
+  for key in ('spaceConsumed', 'length', 'fileCount', 'directoryCount'):
+    if usage[key] is not None:
+      total[key] = total.get(key, 0) + usage[key]
+  return total
+
+
+def _cache_key(fs, sb):
+  return (fs.uri, fs.user, sb.path, sb.mtime)
+
+
+def _file_usage(sb):
+  return {
+    'path': sb.path,
+    'name': sb.name,
+    'isDir': sb.isDir,
+    'length': sb.size,
+    'spaceConsumed': sb.size * sb.replication,
+    'fileCount': 1,
+    'directoryCount': 0,
+    'quota': None,
+    'spaceQuota': None,
+    'error': None,
+  }
+
+
+def _dir_usage(sb, summary):
+  return {
+    'path': sb.path,
+    'name': sb.name,
+    'isDir': sb.isDir,
+    'length': summary.length,
+    'spaceConsumed': summary.spaceConsumed,
+    'fileCount': summary.fileCount,
+    'directoryCount': summary.directoryCount,
+    'quota': summary.quota not in _NO_QUOTA and summary.quota or None,
+    'spaceQuota': summary.spaceQuota not in _NO_QUOTA and summary.spaceQuota or None,
+    'error': None,
+  }
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from nose.tools import assert_true, assert_equal
+
+import disk_usage
+
+
+class FakeStat(object):
+  def __init__(self, path, isDir, mtime=1, size=0, replication=3):
+    self.path = path
+    self.name = path.rsplit('/', 1)[-1]
+    self.isDir = isDir
+    self.mtime = mtime
+    self.size = size
+    self.replication = replication
+
+
+class FakeSummary(object):
+  def __init__(self, size, quota=-1, spaceQuota=-1):
+    self.length = size
+    self.spaceConsumed = size * 3
+    self.fileCount = 2
+    self.directoryCount = 1
+    self.quota = quota
+    self.spaceQuota = spaceQuota
+
+
+class FakeFs(object):
+  uri = 'hdfs://fake'
+  user = 'test'
+
+  def __init__(self):
+    self.calls = [ ]
+    self.lock = threading.Lock()
+    # When set, each call waits for a release of the gate
+    self.gate = None
+
+  def setuser(self, user):
+    assert_equal('test', user)
+
+  def get_content_summary(self, path):
+    if self.gate is not None:
+      self.gate.acquire()
+    self.lock.acquire()
+    try:
+      self.calls.append(path)
+    finally:
+      self.lock.release()
+    if path.endswith('denied'):
+      raise IOError("Permission denied")
+    return FakeSummary(len(path), quota=path == '/a' and 100 or -1)
+
+
+class DiskUsageTest(unittest.TestCase):
+
+  def setUp(self):
+    disk_usage._summaries.clear()
+
+  def test_iter_usage(self):
+    fs = FakeFs()
+    stats = [ FakeStat('/a', True), FakeStat('/a/file', False, size=10), FakeStat('/a/dir', True), FakeStat('/a/denied', True) ]
+    usages = dict([ (usage['path'], usage) for usage in disk_usage.iter_usage(fs, stats, concurrency=2) ])
+
+    assert_equal(30, usages['/a/file']['spaceConsumed'])
+    assert_equal(1, usages['/a/file']['fileCount'])
+    assert_equal(len('/a/dir') * 3, usages['/a/dir']['spaceConsumed'])
+    assert_equal(None, usages['/a/dir']['quota'])
+    assert_equal(100, usages['/a']['quota'])
+    assert_equal(None, usages['/a']['spaceQuota'])
+    assert_true('Permission denied' in usages['/a/denied']['error'])
+    assert_equal(None, usages['/a/denied']['spaceConsumed'])
+
+    total = { }
+    for usage in usages.values():
+      disk_usage.add_usage(total, usage)
+    assert_equal(30 + 3 * (len('/a') + len('/a/dir')), total['spaceConsumed'])
+
+    # Cached by mtime, unless they failed
+    list(disk_usage.iter_usage(fs, stats))
+    assert_equal(['/a', '/a/denied', '/a/denied', '/a/dir'], sorted(fs.calls))
+    list(disk_usage.iter_usage(fs, [ FakeStat('/a/dir', True, mtime=2) ]))
+    assert_equal(5, len(fs.calls))
+
+  def test_close(self):
+    fs = FakeFs()
+    fs.gate = threading.Semaphore(0)
+    stats = [ FakeStat('/file', False) ] + [ FakeStat('/dir%d' % i, True) for i in range(20) ]
+    usages = disk_usage.iter_usage(fs, stats, concurrency=2)
+
+    # Files come first, without waiting for the directories
+    assert_equal('/file', usages.next()['path'])
+
+    fs.gate.release()
+    assert_true(usages.next()['path'].startswith('/dir'))
+
+    # The directories not started yet are not asked for anymore. Those
+    # in flight are let through after a while.
+    def release():
+      fs.gate.release()
+      fs.gate.release()
+    threading.Timer(0.1, release).start()
+    usages.close()
+    assert_true(len(fs.calls) <= 3, fs.calls)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sorted, filtered and paginated listings of directories.
+
+The listing of a directory is kept for a little while as a snapshot, keyed
+by the mtime of the directory, which changes when entries are added or
+removed. A snapshot remembers the order of its entries for each sort (and
+filter) it was asked for, so that the next pages only cost slicing.
+"""
+
+import threading
+import time
+
+from desktop.lib.ttl_cache import TTLCache
+
+
+__all__ = ['SORTABLE_ATTRIBUTES', 'DirectorySnapshot', 'get_snapshot']
+
+SORTABLE_ATTRIBUTES = ('type', 'name', 'atime', 'mtime', 'user', 'group', 'size')
+
+# How long a listing is reused. Entries modified in place, e.g. a file being
+# written, do not change the mtime of their directory.
+LISTING_CACHE_TTL = 30
+LISTING_CACHE_SIZE = 10
+
+# Directory mtimes are in seconds: the listings of directories changed this
+# recently are not kept, as they could change again within the same second.
+MIN_STABLE_SECONDS = 2
+
+# How many orders a snapshot remembers
+MAX_ORDERS = 8
+
+# (fs uri, user, path, directory mtime) -> DirectorySnapshot
+_snapshots = TTLCache(maxsize=LISTING_CACHE_SIZE, ttl=LISTING_CACHE_TTL)
+
+
+class DirectorySnapshot(object):
+  """The stats of the entries of a directory, in listing order."""
+  def __init__(self, stats):
+    self._stats = stats
+    # (sortby, descending, filter) -> positions in self._stats
+    self._orders = { }
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._stats)
+
+  def page(self, start, count, sortby=None, descending=False, filter_str=None):
+    """
+    page(start, count, sortby, descending, filter_str) -> (total, [ stats ])
+
+    The `count' entries from the `start'th one, of the entries whose name
+    contains `filter_str', sorted on the `sortby' attribute. `total' is the
+    number of such entries.
+    """
+    order = self._order(sortby, descending, filter_str)
+    if order is None:
+      return len(self._stats), self._stats[start:start + count]
+    return len(order), [ self._stats[i] for i in order[start:start + count] ]
+
+  def _order(self, sortby, descending, filter_str):
+    """Positions of the entries to list, in order. None for all in listing order."""
+    if sortby is None and not descending and not filter_str:
+      return None
+    key = (sortby, bool(descending), filter_str or None)
+
+    self._lock.acquire()
+    try:
+      order = self._orders.get(key)
+    finally:
+      self._lock.release()
+    if order is not None:
+      return order
+
+    if filter_str:
+      order = [ i for i, sb in enumerate(self._stats) if filter_str in sb['name'] ]
+    else:
+      order = range(len(self._stats))
+    if sortby is not None:
+      keys = [ sb[sortby] for sb in self._stats ]
+      order.sort(key=keys.__getitem__, reverse=bool(descending))
+
+    self._lock.acquire()
+    try:
+      if len(self._orders) >= MAX_ORDERS:
+        self._orders.clear()
+      self._orders[key] = order
+    finally:
+      self._lock.release()
+    return order
+
+
+def get_snapshot(fs, path, mtime):
+  """
+  get_snapshot(fs, path, mtime) -> DirectorySnapshot
+
+  The listing of directory `path', as seen by the current user of `fs', while
+  the directory is at `mtime'.
+  """
+  key = (fs.uri, getattr(fs, 'user', None), path, mtime)
+  snapshot = _snapshots.get(key)
+  if snapshot is None:
+    snapshot = DirectorySnapshot(_listdir_stats(fs, path))
+    if mtime < time.time() - MIN_STABLE_SECONDS:
+      _snapshots.put(key, snapshot)
+  return snapshot
+
+
+def _listdir_stats(fs, path):
+  if hasattr(fs, 'listdir_stats_batches'):
+    stats = [ ]
+    for batch in fs.listdir_stats_batches(path):
+      stats.extend(batch)
+    return stats
+  return fs.listdir_stats(path)
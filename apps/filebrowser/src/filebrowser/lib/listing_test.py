@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+from nose.tools import assert_equal, assert_true
+
+import listing
+
+
+class FakeFs(object):
+  """Lists directories in batches, and counts the listings."""
+  uri = 'hdfs://fake'
+  user = 'test'
+
+  def __init__(self, entries, batch_size=3):
+    self.entries = entries
+    self.batch_size = batch_size
+    self.listings = 0
+
+  def listdir_stats_batches(self, path):
+    self.listings += 1
+    for i in range(0, len(self.entries), self.batch_size):
+      yield self.entries[i:i + self.batch_size]
+
+
+def _entries():
+  return [ {'name': str(i), 'size': i % 4, 'type': i % 3 and 'FILE' or 'DIRECTORY'} for i in range(1, 21) ]
+
+
+class ListingTest(unittest.TestCase):
+
+  def test_page(self):
+    entries = _entries()
+    snapshot = listing.DirectorySnapshot(entries)
+    assert_equal((20, entries[5:10]), snapshot.page(5, 5))
+    assert_equal((20, entries[15:]), snapshot.page(15, 10))
+    assert_equal((20, [ ]), snapshot.page(40, 10))
+
+    total, page = snapshot.page(0, 20, 'size')
+    assert_equal([ sb['size'] for sb in page ], sorted([ sb['size'] for sb in entries ]))
+    # Stable, like sorted()
+    assert_equal(sorted(entries, key=lambda sb: sb['size'], reverse=True), snapshot.page(0, 20, 'size', True)[1])
+
+    total, page = snapshot.page(1, 2, 'name', True, '1')
+    assert_equal(11, total)
+    assert_equal(['18', '17'], [ sb['name'] for sb in page ])
+
+    # Orders are remembered, up to a point
+    assert_true(snapshot._order('name', True, '1') is snapshot._order('name', True, '1'))
+    for i in range(listing.MAX_ORDERS + 1):
+      snapshot.page(0, 1, filter_str=str(i))
+    assert_true(len(snapshot._orders) <= listing.MAX_ORDERS)
+
+  def test_get_snapshot(self):
+    fs = FakeFs(_entries())
+    old = time.time() - 60
+    snapshot = listing.get_snapshot(fs, '/test-listing', old)
+    assert_equal(_entries(), snapshot.page(0, 100)[1])
+    assert_true(snapshot is listing.get_snapshot(fs, '/test-listing', old))
+    assert_equal(1, fs.listings)
+
+    # The directory changed
+    listing.get_snapshot(fs, '/test-listing', old + 1)
+    assert_equal(2, fs.listings)
+
+    # Too recent to be kept
+    listing.get_snapshot(fs, '/test-listing', time.time())
+    listing.get_snapshot(fs, '/test-listing', time.time())
+    assert_equal(4, fs.listings)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reads a window of the contents of gzip and Avro files, for the file viewer.
+
+Gzip files are decompressed as they are read, up to the end of the window.
+Checkpoints of the decompression are remembered while reading, so that the
+next windows of the same file resume from the closest one instead of from
+the start of the file.
+
+Avro files are read from the first block starting in the window, found by
+its sync marker, without decoding the data before it.
+"""
+
+import bisect
+import threading
+import zlib
+from cStringIO import StringIO
+
+from avro import datafile, io, schema
+
+from desktop.lib.ttl_cache import TTLCache
+
+
+__all__ = ['read_gzip', 'read_avro']
+
+# How much compressed data to read at once
+GZIP_READ_SIZE = 1024 * 1024
+# The most data to decompress at once, whatever the compression ratio
+GZIP_MAX_OUTPUT = 4 * 1024 * 1024
+
+# Uncompressed bytes between two checkpoints, at first. Each checkpoint holds
+# a copy of the zlib state (about 40KB). When a file has too many of them,
+# every other one is dropped and the interval doubles.
+GZIP_CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+GZIP_MAX_CHECKPOINTS = 32
+
+# (path, size, mtime) -> GzipIndex
+_gzip_indexes = TTLCache(maxsize=16, ttl=3600)
+
+GZIP_MAGIC = '\x1f\x8b'
+
+# How much of an Avro file to read at once
+AVRO_READ_SIZE = 64 * 1024
+
+
+class GzipIndex(object):
+  """
+  Checkpoints of the decompression of a gzip file. Each is (uncompressed
+  offset, compressed offset, zlib decompressor), the decompressor being None
+  at the start of a gzip member.
+  """
+  def __init__(self, interval=GZIP_CHECKPOINT_INTERVAL, max_checkpoints=GZIP_MAX_CHECKPOINTS):
+    self.interval = interval
+    self.max_checkpoints = max_checkpoints
+    self._offsets = [ 0 ]
+    self._checkpoints = [ (0, 0, None) ]
+    self._lock = threading.Lock()
+
+  def find(self, offset):
+    """
+    find(offset) -> (uncompressed offset, compressed offset, decompressor)
+
+    The last checkpoint at or before the uncompressed `offset', with a
+    decompressor of its own.
+    """
+    self._lock.acquire()
+    try:
+      uoffset, coffset, decompressor = self._checkpoints[bisect.bisect_right(self._offsets, offset) - 1]
+      if decompressor is None:
+        decompressor = _gzip_decompressor()
+      else:
+        decompressor = decompressor.copy()
+      return uoffset, coffset, decompressor
+    finally:
+      self._lock.release()
+
+  def add(self, uoffset, coffset, decompressor):
+    """Remember the state of `decompressor', if far enough from the last checkpoint."""
+    self._lock.acquire()
+    try:
+      if uoffset < self._offsets[-1] + self.interval:
+        return
+      if decompressor is not None:
+        decompressor = decompressor.copy()
+      self._offsets.append(uoffset)
+      self._checkpoints.append((uoffset, coffset, decompressor))
+      if len(self._checkpoints) > self.max_checkpoints:
+        self._offsets = self._offsets[::2]
+        self._checkpoints = self._checkpoints[::2]
+        self.interval *= 2
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._checkpoints)
+
+
+def get_gzip_index(key):
+  """The GzipIndex of the file `key', e.g. (path, size, mtime)."""
+  index = _gzip_indexes.get(key)
+  if index is None:
+    index = GzipIndex()
+    _gzip_indexes.put(key, index)
+  return index
+
+
+def _gzip_decompressor():
+  return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def read_gzip(fhandle, offset, length, index=None):
+  """
+  read_gzip(fhandle, offset, length, index) -> uncompressed data
+
+  Read `length' bytes at the uncompressed `offset' of the gzip file open as
+  `fhandle'. Reading starts from the closest checkpoint of `index', and adds
+  checkpoints to it. Concatenated gzip members are read through.
+
+  Raises zlib.error if the data is not gzip.
+  """
+  if index is None:
+    index = GzipIndex()
+  pos, coffset, decompressor = index.find(offset)
+  end = offset + length
+  contents = [ ]
+
+  fhandle.seek(coffset)
+  while pos < end:
+    data = fhandle.read(GZIP_READ_SIZE)
+    if not data:
+      break
+    coffset += len(data)
+
+    while data and pos < end:
+      chunk = decompressor.decompress(data, GZIP_MAX_OUTPUT)
+      data = decompressor.unconsumed_tail
+      if offset < pos + len(chunk):
+        contents.append(chunk[max(0, offset - pos):end - pos])
+      pos += len(chunk)
+
+      if decompressor.unused_data:
+        # Start of the next member, if it is not some trailing garbage
+        data = decompressor.unused_data
+        if data[:len(GZIP_MAGIC)] != GZIP_MAGIC[:len(data)]:
+          return ''.join(contents)
+        decompressor = _gzip_decompressor()
+        index.add(pos, coffset - len(data), None)
+      elif not data:
+        index.add(pos, coffset, decompressor)
+
+  return ''.join(contents)
+
+
+class _ReadAhead(object):
+  """Sequential reads of `fhandle' from `offset', in chunks of AVRO_READ_SIZE."""
+  def __init__(self, fhandle, offset):
+    self._fhandle = fhandle
+    self._buffer = ''
+    self._buffer_pos = 0
+    self._pos = offset
+    self._eof = False
+    fhandle.seek(offset)
+
+  def _fill(self, size):
+    chunks = [ self._buffer[self._buffer_pos:] ]
+    available = len(chunks[0])
+    while available < size and not self._eof:
+      data = self._fhandle.read(max(AVRO_READ_SIZE, size - available))
+      if not data:
+        self._eof = True
+      chunks.append(data)
+      available += len(data)
+    self._buffer = ''.join(chunks)
+    self._buffer_pos = 0
+
+  def peek(self, size):
+    if len(self._buffer) - self._buffer_pos < size:
+      self._fill(size)
+    return self._buffer[self._buffer_pos:self._buffer_pos + size]
+
+  def read(self, size):
+    data = self.peek(size)
+    self._buffer_pos += len(data)
+    self._pos += len(data)
+    return data
+
+  def skip(self, size):
+    self.read(size)
+
+  def tell(self):
+    return self._pos
+
+  def at_eof(self):
+    return not self.peek(1)
+
+  def find(self, marker):
+    """
+    Skip to right after the next occurrence of `marker', and return True.
+    Skip to the end and return False if there is none.
+    """
+    while True:
+      window = self.peek(AVRO_READ_SIZE)
+      i = window.find(marker)
+      if i != -1:
+        self.skip(i + len(marker))
+        return True
+      if len(window) < len(marker):
+        self.skip(len(window))
+        return False
+      # Keep what could be the start of a marker
+      self.skip(len(window) - len(marker) + 1)
+
+
+def read_avro(fhandle, offset, length, max_output):
+  """
+  read_avro(fhandle, offset, length, max_output) -> the text of the datums
+
+  Show the datums of the blocks of the Avro file open as `fhandle' that start
+  in the `offset'/`length' byte window, or of the first block after it. The
+  data before the window is skipped by looking for the sync marker that ends
+  each block. At most about `max_output' characters are returned.
+
+  Raises schema.AvroException if the data is not Avro.
+  """
+  reader = _ReadAhead(fhandle, 0)
+  if reader.peek(datafile.MAGIC_SIZE) != datafile.MAGIC:
+    raise schema.AvroException("Not an Avro data file")
+  decoder = io.BinaryDecoder(reader)
+  datum_reader = io.DatumReader()
+  header = datum_reader.read_data(datafile.META_SCHEMA, datafile.META_SCHEMA, decoder)
+  codec = header['meta'].get('avro.codec') or 'null'
+  if codec not in datafile.VALID_CODECS:
+    raise schema.AvroException("Unknown codec: %s" % (codec,))
+  datum_reader.writers_schema = schema.parse(header['meta'].get(datafile.SCHEMA_KEY))
+  sync_marker = header['sync']
+
+  if reader.tell() < offset:
+    # Go to the first block that starts at or after offset
+    reader = _ReadAhead(fhandle, max(0, offset - datafile.SYNC_SIZE))
+    if not reader.find(sync_marker):
+      return ''
+    decoder = io.BinaryDecoder(reader)
+
+  contents = [ ]
+  size = 0
+  while not reader.at_eof() and (not contents or reader.tell() < offset + length):
+    block_count = decoder.read_long()
+    block_data = decoder.read_bytes()
+    if codec == 'deflate':
+      block_data = zlib.decompress(block_data, -15)
+    if reader.read(datafile.SYNC_SIZE) != sync_marker:
+      raise schema.AvroException("Invalid sync marker at byte %d" % (reader.tell(),))
+
+    block_decoder = io.BinaryDecoder(StringIO(block_data))
+    for i in xrange(block_count):
+      datum_str = str(datum_reader.read(block_decoder)) + "\n"
+      contents.append(datum_str)
+      size += len(datum_str)
+      if size >= max_output:
+        return ''.join(contents)
+
+  return ''.join(contents)
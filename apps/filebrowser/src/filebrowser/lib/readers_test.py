@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import unittest
+import zlib
+from cStringIO import StringIO
+
+from avro import datafile, io, schema
+from nose.tools import assert_true, assert_equal, assert_raises
+
+import readers
+
+
+class CountingFile(object):
+  """A file that counts the bytes read from it."""
+  def __init__(self, data):
+    self._file = StringIO(data)
+    self.bytes_read = 0
+
+  def seek(self, offset, whence=0):
+    self._file.seek(offset, whence)
+
+  def tell(self):
+    return self._file.tell()
+
+  def read(self, length=-1):
+    data = self._file.read(length)
+    self.bytes_read += len(data)
+    return data
+
+
+def _gzip(data):
+  sio = StringIO()
+  gz = gzip.GzipFile(fileobj=sio, mode='wb')
+  gz.write(data)
+  gz.close()
+  return sio.getvalue()
+
+
+class ReadersTest(unittest.TestCase):
+
+  def setUp(self):
+    self._saved = (readers.GZIP_READ_SIZE, readers.AVRO_READ_SIZE)
+    readers.GZIP_READ_SIZE = 1024
+    readers.AVRO_READ_SIZE = 1024
+
+  def tearDown(self):
+    readers.GZIP_READ_SIZE, readers.AVRO_READ_SIZE = self._saved
+
+  def test_read_gzip(self):
+    data = ''.join([ '%08d\n' % i for i in range(100000) ])
+    index = readers.GzipIndex(interval=100000, max_checkpoints=4)
+    fhandle = CountingFile(_gzip(data))
+
+    assert_equal(data[:100], readers.read_gzip(fhandle, 0, 100, index))
+    assert_equal(data[500000:500100], readers.read_gzip(fhandle, 500000, 100, index))
+    # Checkpoints were thinned out
+    assert_true(len(index) <= 4)
+    assert_true(index.interval > 100000)
+
+    # Resumes from a checkpoint
+    fhandle.bytes_read = 0
+    assert_equal(data[600000:600100], readers.read_gzip(fhandle, 600000, 100, index))
+    assert_true(fhandle.bytes_read < len(fhandle._file.getvalue()) / 2, fhandle.bytes_read)
+
+    # Past the end
+    assert_equal(data[-10:], readers.read_gzip(fhandle, len(data) - 10, 100, index))
+    assert_equal('', readers.read_gzip(fhandle, len(data) + 10, 100, index))
+
+  def test_read_gzip_members(self):
+    fhandle = CountingFile(_gzip('abc\n') + _gzip('def\n') + '\0' * 10)
+    index = readers.GzipIndex(interval=1)
+    assert_equal('abc\ndef\n', readers.read_gzip(fhandle, 0, 100, index))
+    assert_equal('c\nde', readers.read_gzip(fhandle, 2, 4, index))
+    assert_equal('ef\n', readers.read_gzip(fhandle, 5, 100, index))
+
+    assert_raises(zlib.error, readers.read_gzip, CountingFile('hello'), 0, 100)
+
+  def test_read_avro(self):
+    test_schema = schema.parse("""
+      {
+        "name": "test",
+        "type": "record",
+        "fields": [
+          { "name": "name", "type": "string" },
+          { "name": "integer", "type": "int" }
+        ]
+      }
+    """)
+    for codec in ('null', 'deflate'):
+      sio = StringIO()
+      writer = datafile.DataFileWriter(sio, io.DatumWriter(), writers_schema=test_schema, codec=codec)
+      for i in range(2000):
+        writer.append({'name': 'Test %d' % i, 'integer': i})
+        if i % 100 == 99:
+          writer.sync()
+      writer.flush()
+      data = sio.getvalue()
+      writer.close()
+
+      first = readers.read_avro(CountingFile(data), 0, 1, 1024 * 1024)
+      assert_equal(100, len(first.splitlines()))
+      assert_equal({'name': 'Test 0', 'integer': 0}, eval(first.splitlines()[0]))
+
+      # Goes straight to the block after the offset, and reads through the window
+      fhandle = CountingFile(data)
+      middle = readers.read_avro(fhandle, len(data) / 2, len(data) / 10, 1024 * 1024)
+      datums = [ eval(line) for line in middle.splitlines() ]
+      assert_equal(0, datums[0]['integer'] % 100)
+      assert_true(datums[0]['integer'] > 0)
+      assert_equal(range(datums[0]['integer'], datums[-1]['integer'] + 1), [ datum['integer'] for datum in datums ])
+      assert_true(fhandle.bytes_read < len(data) * 3 / 4, fhandle.bytes_read)
+
+      # Consecutive windows neither overlap nor leave gaps
+      seen = [ ]
+      offset, length = 0, len(data) / 7
+      while offset < len(data):
+        seen.extend([ eval(line)['integer'] for line in readers.read_avro(CountingFile(data), offset, length, 1024 * 1024).splitlines() ])
+        offset += length
+      assert_equal(range(2000), seen)
+
+      assert_equal('', readers.read_avro(CountingFile(data), len(data) + 10, 100, 1024 * 1024))
+
+    assert_raises(schema.AvroException, readers.read_avro, CountingFile('Obj\x02hello'), 0, 100, 1024)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -17,6 +17,7 @@
 """
 Implements xxd-like functionality.
 """
+import binascii
 import string
 import sys
 
@@ -46,6 +47,9 @@ def mask_not_alphanumeric(data):
   """
   return mask_not_printable(data, NON_FANCY_PRINTABLE)
 
+# Maps the bytes that mask_not_alphanumeric() masks out to "."
+_ALPHANUMERIC_TABLE = "".join([ NON_FANCY_PRINTABLE.match(chr(i)) and "." or chr(i) for i in range(256) ])
+
 def xxd(shift, data, bytes_per_line, bytes_per_sentence):
   """
   A generator of (offset, [[byte ordinal]], printable) strings,
@@ -59,15 +63,35 @@ def xxd(shift, data, bytes_per_line, bytes_per_sentence):
 
   @param shift: Shifts the returned offsets by this amount.
   """
-  current = 0
+  printable = data.translate(_ALPHANUMERIC_TABLE)
   for current in xrange(0, len(data), bytes_per_line):
-    line = data[current:current+bytes_per_line]
-    line_printable = mask_not_alphanumeric(line)[1]
-    line_ordinals = map(ord, line)
+    line_ordinals = map(ord, data[current:current+bytes_per_line])
     offsets = range(0, len(line_ordinals), bytes_per_sentence)
     line_ordinal_words = [ line_ordinals[x:x+bytes_per_sentence] for x in offsets ]
 
-    yield (shift + current, line_ordinal_words, line_printable)
+    yield (shift + current, line_ordinal_words, printable[current:current+bytes_per_line])
+
+def hexdump(shift, data, bytes_per_line, bytes_per_sentence):
+  """
+  hexdump(shift, data, bytes_per_line, bytes_per_sentence) -> [(offset, hex_digits, printable)]
+
+  Same as xxd(), but with the hex digits of each line already formatted,
+  sentences separated by spaces. The whole of `data' is converted at once,
+  lines are only sliced out of the results.
+
+  @param shift: Shifts the returned offsets by this amount.
+  """
+  hex_digits = binascii.hexlify(data)
+  printable = data.translate(_ALPHANUMERIC_TABLE)
+
+  sentence_digits = bytes_per_sentence * 2
+  sentences = [ hex_digits[i:i+sentence_digits] for i in xrange(0, len(hex_digits), sentence_digits) ]
+  sentences_per_line = bytes_per_line / bytes_per_sentence
+  hex_lines = [ " ".join(sentences[i:i+sentences_per_line]) for i in xrange(0, len(sentences), sentences_per_line) ]
+
+  offsets = xrange(0, len(data), bytes_per_line)
+  return [ (shift + current, hex_line, printable[current:current+bytes_per_line])
+           for current, hex_line in zip(offsets, hex_lines) ]
 
 def main(input, output):
   """
@@ -78,20 +102,18 @@ def main(input, output):
   bytes_per_sentence = 2
 
   # Must be multiple of bytes_per_line
-  input_chunk = bytes_per_line * 10
+  input_chunk = bytes_per_line * 4096
+
+  # 2 characters per byte, 1 extra for spacing, and 1 extra at the end.
+  hex_width = bytes_per_line*2 + (bytes_per_line/bytes_per_sentence) - 1
 
   while True:
-    data = input.read(bytes_per_line)
+    data = input.read(input_chunk)
     if data == '':
       return
 
-    for off, ordinals, printable in xxd(offset, data, bytes_per_line, bytes_per_sentence):
-      def ashex(ord):
-        return "%02x" % ord
-      hex = " ".join([ "".join(map(ashex, sentence)) for sentence in ordinals])
-      # 2 characters per byte, 1 extra for spacing, and 1 extra at the end.
-      hex = hex.ljust(bytes_per_line*2 + (bytes_per_line/bytes_per_sentence) - 1)
-      output.write("%07x: %s  %s\n" % (off, hex, printable))
+    output.write("".join([ "%07x: %s  %s\n" % (off, hex_digits.ljust(hex_width), printable)
+                           for off, hex_digits, printable in hexdump(offset, data, bytes_per_line, bytes_per_sentence) ]))
 
     offset += len(data)
 
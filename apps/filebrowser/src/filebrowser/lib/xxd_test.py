@@ -36,6 +36,19 @@ class XxdTest(unittest.TestCase):
     self.assertEquals( (2, "..@"), xxd.mask_not_alphanumeric("\xff\x90\x40"))
 
 
+  def test_hexdump(self):
+    random_text = "".join(chr(random.getrandbits(8)) for _ in range(1000 + 7))
+    dump = xxd.hexdump(100, random_text, 16, 2)
+    lines = list(xxd.xxd(100, random_text, 16, 2))
+    self.assertEquals(len(lines), len(dump))
+    for (offset, words, masked), expected in zip(lines, dump):
+      hex_digits = " ".join([ "".join([ "%02x" % byte for byte in word ]) for word in words ])
+      self.assertEquals(expected, (offset, hex_digits, masked))
+      self.assertEquals(xxd.mask_not_alphanumeric(random_text[offset-100:offset-100+16])[1], masked)
+
+    self.assertEquals([ (0, "0a20 58", ". X") ], xxd.hexdump(0, "\n X", 16, 2))
+    self.assertEquals([ ], xxd.hexdump(0, "", 16, 2))
+
   def test_compare_to_xxd(self):
     """
     Runs xxd on some random text, and compares output with our xxd.
@@ -0,0 +1,114 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+## Rendered one def at a time by filebrowser.views.disk_usage, which streams
+## the rows as the content summaries come.
+<%!
+  from django.template.defaultfilters import urlencode, filesizeformat
+  from desktop.views import commonheader, commonfooter
+  from django.utils.translation import ugettext as _
+%>
+<%namespace name="fb_components" file="fb_components.mako" />
+
+<%def name="quota_usage(used, quota, size=False)">
+  % if quota is None:
+    -
+  % elif size:
+    ${_('%(used)s of %(quota)s') % {'used': filesizeformat(used or 0), 'quota': filesizeformat(quota)}} (${'%d%%' % (100 * (used or 0) / quota)})
+  % else:
+    ${_('%(used)s of %(quota)s') % {'used': used or 0, 'quota': quota}} (${'%d%%' % (100 * (used or 0) / quota)})
+  % endif
+</%def>
+
+<%def name="header(path, breadcrumbs, user)">
+${commonheader(_('Disk Usage'), 'filebrowser', user)}
+
+<div class="container-fluid">
+  <h1>${_('Disk Usage of %(path)s') % {'path': path} | h}</h1>
+  ${fb_components.breadcrumbs(path, breadcrumbs)}
+
+  <table id="diskUsageTable" class="table table-striped table-condensed">
+    <thead>
+      <tr>
+        <th>${_('Name')}</th>
+        <th>${_('Space Consumed')}</th>
+        <th>${_('Size')}</th>
+        <th>${_('Files')}</th>
+        <th>${_('Directories')}</th>
+        <th>${_('Name Quota')}</th>
+        <th>${_('Space Quota')}</th>
+      </tr>
+    </thead>
+    <tbody>
+</%def>
+
+<%def name="row(usage)">
+      <tr data-space="${usage['spaceConsumed'] or 0}">
+        <td>
+        % if usage['isDir']:
+          <i class="icon-folder-close"></i> <a href="${url('filebrowser.views.disk_usage', path=urlencode(usage['path']))}">${usage['name'] | h}</a>
+        % else:
+          <i class="icon-file"></i> <a href="${url('filebrowser.views.view', path=urlencode(usage['path']))}">${usage['name'] | h}</a>
+        % endif
+        </td>
+      % if usage['error']:
+        <td colspan="6"><span class="label label-important">${_('Error')}</span> ${usage['error'] | h}</td>
+      % else:
+        <td>${usage['spaceConsumed'] | filesizeformat}</td>
+        <td>${usage['length'] | filesizeformat}</td>
+        <td>${usage['fileCount']}</td>
+        <td>${usage['directoryCount']}</td>
+        <td>${quota_usage(usage['fileCount'] + usage['directoryCount'], usage['quota'])}</td>
+        <td>${quota_usage(usage['spaceConsumed'], usage['spaceQuota'], size=True)}</td>
+      % endif
+      </tr>
+</%def>
+
+<%def name="footer(path, total, directory, count)">
+    </tbody>
+    <tfoot>
+      <tr>
+        <th>${_('Total (%(count)s entries)') % {'count': count}}</th>
+        <th>${total.get('spaceConsumed', 0) | filesizeformat}</th>
+        <th>${total.get('length', 0) | filesizeformat}</th>
+        <th>${total.get('fileCount', 0)}</th>
+        <th>${total.get('directoryCount', 0)}</th>
+      % if directory is None or directory['error']:
+        <th colspan="2"></th>
+      % else:
+        <th>${quota_usage(directory['fileCount'] + directory['directoryCount'], directory['quota'])}</th>
+        <th>${quota_usage(directory['spaceConsumed'], directory['spaceQuota'], size=True)}</th>
+      % endif
+      </tr>
+    </tfoot>
+  </table>
+
+  <a class="btn" href="${url('filebrowser.views.view', path=urlencode(path))}">${_('Back to the directory')}</a>
+</div>
+
+<script type="text/javascript" charset="utf-8">
+  $(document).ready(function () {
+    // Biggest first, now that all the rows are there
+    var rows = $("#diskUsageTable tbody tr").get();
+    rows.sort(function (a, b) {
+      return $(b).data("space") - $(a).data("space");
+    });
+    $("#diskUsageTable tbody").append(rows);
+  });
+</script>
+
+${commonfooter()}
+</%def>
@@ -28,6 +28,47 @@
 %>
 <%namespace name="fb_components" file="fb_components.mako" />
 
+<%def name="navigation()">
+  <%
+    base_url = url('filebrowser.views.view', path=urlencode(path))
+    # None while the end of a gzip file has not been seen
+    size = view['size']
+    offset, length = view['offset'], view['length']
+    href = "href=%s?offset=%%d&length=%d&compression=%s title=%%d - %%d" % (base_url, length, view['compression'])
+    if offset == 0:
+        first_class = "prev disabled"
+        prev_class = "disabled"
+        first_href = ""
+        prev_href = ""
+    else:
+        first_class = "prev"
+        prev_class = ""
+        first_href = href % (0, 1, size is None and length or min(length, size))
+        prev_start = max(0, offset - length)
+        prev_href = href % (prev_start, prev_start + 1, size is None and prev_start + length or min(prev_start + length, size))
+    if size is not None and offset + length >= size:
+        next_class = "disabled"
+        last_class = "next disabled"
+        next_href = ""
+        last_href = ""
+    else:
+        next_class = ""
+        next_href = href % (offset + length, offset + length + 1, offset + (2 * length))
+        if size is None:
+            last_class = "next disabled"
+            last_href = ""
+        else:
+            last_class = "next"
+            last_href = href % (size - (size % length), size - (size % length) + 1, size)
+  %>
+  <ul>
+      <li class="${first_class}"><a ${first_href}>${_('First Block')}</a></li>
+      <li class="${prev_class}"><a ${prev_href}>${_('Previous Block')}</a></li>
+      <li class="${next_class}"><a ${next_href}>${_('Next Block')}</a></li>
+      <li class="${last_class}"><a ${last_href}>${_('Last Block')}</a></li>
+  </ul>
+</%def>
+
 ${commonheader(_('%(filename)s - File Viewer') % dict(filename=truncate(filename)), 'filebrowser', user)}
 
 
@@ -89,49 +130,21 @@ ${commonheader(_('%(filename)s - File Viewer') % dict(filename=truncate(filename
 			</div>
 		</div>
 		<div class="span10">
-			% if not view['compression'] or view['compression'] in ("none", "avro"):
+			% if not view['compression'] or view['compression'] in ("none", "avro", "gzip"):
 			      <div class="pagination">
-			        <%
-			          base_url = url('filebrowser.views.view', path=path_enc)
-			          if view['offset'] == 0:
-			              first_class = "prev disabled"
-			              prev_class = "disabled"
-			              first_href = ""
-			              prev_href = ""
-			          else:
-			              first_class = "prev"
-			              prev_class = ""
-			              first_href = "href=%s?offset=0&length=%d&compression=none title=1 - %d" %(base_url, view['length'], min(view['length'], stats['size']))
-			              prev_href =  "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, max(0, view['offset']-view['length']), view['length'], max(0, view['offset']-view['length']) + 1, min(max(0, view['offset'] - view['length']) + view['length'], stats['size']))
-			          if view['offset'] + view['length'] >= stats['size']:
-			              next_class = "disabled"
-			              last_class = "next disabled"
-			              next_href = ""
-			              last_href = ""
-			          else:
-			              next_class = ""
-			              last_class = "next"
-			              next_href = "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, view['offset'] + view['length'], view['length'], view['offset'] + view['length'] + 1, view['offset'] + (2 * view['length']))
-			              last_href =  "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, stats['size']-(stats['size'] % view['length']), view['length'], stats['size']-(stats['size'] % view['length']) + 1, stats['size'])
-			        %>
-			        ###DEFINE REL
-			        <ul>
-			            <li class="${first_class}"><a ${first_href}>${_('First Block')}</a></li>
-			            <li class="${prev_class}"><a ${prev_href}>${_('Previous Block')}</a></li>
-			            <li class="${next_class}"><a ${next_href}>${_('Next Block')}</a></li>
-			            <li class="${last_class}"><a ${last_href}>${_('Last Block')}</a></li>
-			        </ul>
+			        ${navigation()}
 
 					<form action="${url('filebrowser.views.view', path=path_enc)}" method="GET" class="form-inline pull-right">
 						<span>${_('Viewing Bytes:')}</span>
 						<input type="text" name="begin" value="${view['offset'] + 1}" class="input-mini" />
 						-
 						<input type="text" value="${view['end']}" name="end" class="input-mini" /> of
-						<span>${stats['size']}</span>
+						<span>${view['size'] is None and '?' or view['size']}</span>
 						<span>${_('(%(length)s B block size)' % dict(length=view['length']))}</span>
 						% if view['mode']:
 							<input type="hidden" name="mode" value="${view['mode']}"/>
 						% endif
+						<input type="hidden" name="compression" value="${view['compression']}"/>
 			        </form>
 
 			      </div>
@@ -147,60 +160,19 @@ ${commonheader(_('%(filename)s - File Viewer') % dict(filename=truncate(filename
 		             <div><pre>${view['contents']|h}</pre></div>
 		      % else:
 		        <table>
-		          % for offset, words, masked in view['xxd']:
+		          % for offset, hex_digits, masked in view['xxd']:
 		            <tr>
-		              <td><tt>${stringformat(offset, "07x")}:&nbsp;</tt></td>
-		            <td>
-		              <tt>
-		                % for word in words:
-		                  % for byte in word:
-		                    ${stringformat(byte, "02x")}
-		                  % endfor
-		                % endfor
-		              </tt>
-		            </td>
-		            <td>
-		              <tt>
-		                &nbsp;&nbsp;${masked}
-		              </tt>
-		            </td>
+		              <td><tt>${"%07x" % offset}:&nbsp;</tt></td>
+		              <td><tt>${hex_digits}</tt></td>
+		              <td><tt>&nbsp;&nbsp;${masked|h}</tt></td>
 		            </tr>
 		          % endfor
 		        </table>
 		      % endif
 		      </div>
-			  % if not view['compression'] or view['compression'] in ("none", "avro"):
+			  % if not view['compression'] or view['compression'] in ("none", "avro", "gzip"):
 			      <div class="pagination">
-			        <%
-			          base_url = url('filebrowser.views.view', path=path_enc)
-			          if view['offset'] == 0:
-			              first_class = "prev disabled"
-			              prev_class = "disabled"
-			              first_href = ""
-			              prev_href = ""
-			          else:
-			              first_class = "prev"
-			              prev_class = ""
-			              first_href = "href=%s?offset=0&length=%d&compression=none title=1 - %d" %(base_url, view['length'], min(view['length'], stats['size']))
-			              prev_href =  "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, max(0, view['offset']-view['length']), view['length'], max(0, view['offset']-view['length']) + 1, min(max(0, view['offset'] - view['length']) + view['length'], stats['size']))
-			          if view['offset'] + view['length'] >= stats['size']:
-			              next_class = "disabled"
-			              last_class = "next disabled"
-			              next_href = ""
-			              last_href = ""
-			          else:
-			              next_class = ""
-			              last_class = "next"
-			              next_href = "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, view['offset'] + view['length'], view['length'], view['offset'] + view['length'] + 1, view['offset'] + (2 * view['length']))
-			              last_href =  "href=%s?offset=%d&length=%d&compression=none title=%d - %d" %(base_url, stats['size']-(stats['size'] % view['length']), view['length'], stats['size']-(stats['size'] % view['length']) + 1, stats['size'])
-			        %>
-			        ###DEFINE REL
-			        <ul>
-			            <li class="${first_class}"><a ${first_href}>${_('First Block')}</a></li>
-			            <li class="${prev_class}"><a ${prev_href}>${_('Previous Block')}</a></li>
-			            <li class="${next_class}"><a ${next_href}>${_('Next Block')}</a></li>
-			            <li class="${last_class}"><a ${last_href}>${_('Last Block')}</a></li>
-			        </ul>
+			        ${navigation()}
 			      </div>
 			    % endif
 		</div>
@@ -64,6 +64,7 @@ ${commonheader(_('File Browser'), 'filebrowser', user)}
 	            <li><a href="#" class="create-directory-link" title="${_('Directory')}"><i class="icon-folder-close"></i> ${_('Directory')}</a></li>
 	          </ul>
 	        </div>
+	        <a href="#" class="btn pull-right" title="${_('Disk Usage')}" data-bind="attr: { href: '/filebrowser/du' + currentPath() }"><i class="icon-hdd"></i> ${_('Disk Usage')}</a>
         </%def>
     </%actionbar:render>
 
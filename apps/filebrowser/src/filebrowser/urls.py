@@ -26,6 +26,7 @@ urlpatterns = patterns('filebrowser.views',
   url(r'display(?P<path>/.*)', 'display', name='display'),
   url(r'stat(?P<path>/.*)', 'stat', name='stat'),
   url(r'download(?P<path>/.*)', 'download', name='download'),
+  url(r'^du(?P<path>/.*)', 'disk_usage', name='disk_usage'),
   url(r'status', 'status', name='status'),
   url(r'home_relative_view(?P<path>/.*)', 'home_relative_view', name='home_relative_view'),
   # Catch-all for viewing a file (display) or a directory (listdir)
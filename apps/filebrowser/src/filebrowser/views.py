@@ -23,11 +23,11 @@
 import errno
 import logging
 import mimetypes
-import operator
 import posixpath
-import shutil
 import stat as stat_module
 import os
+import tarfile
+import zipfile
 
 try:
   import json
@@ -44,27 +44,28 @@ from django.views.static import was_modified_since
 from django.utils.functional import curry
 from django.utils.http import http_date, urlquote
 from django.utils.html import escape
-from cStringIO import StringIO
-from gzip import GzipFile
-from avro import datafile, io
 
-from desktop.lib import i18n, paginator
+from desktop.lib import django_mako, i18n, paginator
 from desktop.lib.conf import coerce_bool
 from desktop.lib.django_util import make_absolute, render, render_json, format_preserving_redirect
 from desktop.lib.exceptions_renderable import PopupException
-from filebrowser.lib.archives import archive_factory
+from filebrowser.lib import disk_usage as disk_usage_lib
+from filebrowser.lib import listing, readers
+from filebrowser.lib.archives import archive_factory, get_archive_type
 from filebrowser.lib.rwx import filetype, rwx
 from filebrowser.lib import xxd
 from filebrowser.forms import RenameForm, UploadFileForm, UploadArchiveForm, MkDirForm, EditorForm, TouchForm,\
     RenameFormSet, RmTreeFormSet, ChmodFormSet,ChownFormSet
 from hadoop.fs.hadoopfs import Hdfs
-from hadoop.fs.exceptions import WebHdfsException
+from hadoop.fs.exceptions import WebHdfsException, PartialFailureException
 
 from django.utils.translation import ugettext as _
 
 
 DEFAULT_CHUNK_SIZE_BYTES = 1024 * 4 # 4KB
 MAX_CHUNK_SIZE_BYTES = 1024 * 1024 # 1MB
+# Hex dumps are not decoded nor decompressed, and formatted in bulk
+MAX_BINARY_CHUNK_SIZE_BYTES = 4 * 1024 * 1024 # 4MB
 DOWNLOAD_CHUNK_SIZE = 32 * 1024 # 32KB
 
 # Defaults for "xxd"-style output.
@@ -86,14 +87,69 @@ def index(request):
   return view(request, path)
 
 
-def _file_reader(fh):
-    """Generator that reads a file, chunk-by-chunk."""
-    while True:
-        chunk = fh.read(DOWNLOAD_CHUNK_SIZE)
-        if chunk == '':
-            fh.close()
-            break
-        yield chunk
+def _file_reader(fh, length=None):
+    """Generator that reads a file, chunk-by-chunk, up to `length' bytes if given."""
+    try:
+        while length is None or length > 0:
+            size = DOWNLOAD_CHUNK_SIZE
+            if length is not None:
+                size = min(size, length)
+            chunk = fh.read(size)
+            if chunk == '':
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def _parse_range_header(header, size):
+    """
+    _parse_range_header(header, size) -> (first, last) or None
+
+    Parses an HTTP Range header against a file of `size' bytes, and returns the
+    inclusive byte positions to send. Only a single byte range is honoured;
+    anything else returns None, meaning the whole file.
+    Raises ValueError if the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+
+    first, last = [ part.strip() for part in spec.split('-', 1) ]
+    if not (first.isdigit() or last.isdigit()) or not (first + last).isdigit():
+        # Malformed, ignore it
+        return None
+
+    if first == '':
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError('Unsatisfiable range: %s' % (header,))
+        return max(0, size - suffix), size - 1
+
+    first = int(first)
+    if last != '' and first > int(last):
+        return None
+    if first >= size:
+        raise ValueError('Unsatisfiable range: %s' % (header,))
+    if last == '':
+        return first, size - 1
+    return first, min(int(last), size - 1)
+
+
+def _open_for_download(fs, path, offset, length):
+    """Returns a file-like object positioned at `offset'."""
+    if hasattr(fs, 'read_stream'):
+        # One request for the whole range, streamed from the DataNode.
+        return fs.read_stream(path, offset, length)
+    fh = fs.open(path)
+    if offset:
+        fh.seek(offset)
+    return fh
 
 
 def download(request, path):
@@ -101,6 +157,7 @@ def download(request, path):
     Downloads a file.
 
     This is inspired by django.views.static.serve.
+    Honours single byte ranges (Range and If-Range headers), so downloads can be resumed.
     """
     if not request.fs.exists(path):
         raise Http404(_("File not found: %(path)s") % {'path': escape(path)})
@@ -113,13 +170,32 @@ def download(request, path):
     size = stats['size']
     if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime, size):
         return HttpResponseNotModified()
-        # TODO(philip): Ideally a with statement would protect from leaks,
-    # but tricky to do here.
-    fh = request.fs.open(path)
 
-    response = HttpResponse(_file_reader(fh), mimetype=mimetype)
-    response["Last-Modified"] = http_date(stats['mtime'])
-    response["Content-Length"] = stats['size']
+    last_modified = http_date(mtime)
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range == last_modified:
+        try:
+            byte_range = _parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % (size,)
+            return response
+
+    if byte_range is None:
+        offset, length = 0, size
+    else:
+        offset, length = byte_range[0], byte_range[1] - byte_range[0] + 1
+
+    fh = _open_for_download(request.fs, path, offset, length)
+
+    response = HttpResponse(_file_reader(fh, length), mimetype=mimetype)
+    if byte_range is not None:
+        response.status_code = 206
+        response["Content-Range"] = "bytes %d-%d/%d" % (byte_range[0], byte_range[1], size)
+    response["Accept-Ranges"] = "bytes"
+    response["Last-Modified"] = last_modified
+    response["Content-Length"] = length
     response["Content-Disposition"] = "attachment"
     return response
 
@@ -406,31 +482,22 @@ def listdir_paged(request, path):
     home_dir_path = request.user.get_home_directory()
     breadcrumbs = parse_breadcrumbs(path)
 
-    all_stats = request.fs.listdir_stats(path)
-
-
-    # Filter first
+    # Filter, sort and paginate a snapshot of the listing
     filter_str = request.GET.get('filter', None)
-    if filter_str:
-        filtered_stats = filter(lambda sb: filter_str in sb['name'], all_stats)
-        all_stats = filtered_stats
-
-    # Sort next
     sortby = request.GET.get('sortby', None)
     descending_param = request.GET.get('descending', None)
-    if sortby is not None:
-        if sortby not in ('type', 'name', 'atime', 'mtime', 'user', 'group', 'size'):
-            logger.info("Invalid sort attribute '%s' for listdir." %
-                        (sortby,))
-        else:
-            all_stats = sorted(all_stats,
-                               key=operator.attrgetter(sortby),
-                               reverse=coerce_bool(descending_param))
-
-
-    # Do pagination
-    page = paginator.Paginator(all_stats, pagesize).page(pagenum)
+    if sortby is not None and sortby not in listing.SORTABLE_ATTRIBUTES:
+        logger.info("Invalid sort attribute '%s' for listdir." %
+                    (sortby,))
+        sortby = None
+    descending = sortby is not None and coerce_bool(descending_param)
+
+    snapshot = listing.get_snapshot(request.fs, Hdfs.normpath(path), request.fs.stats(path)['mtime'])
+    start = max(0, (pagenum - 1) * pagesize)
+    total, stats = snapshot.page(start, pagesize, sortby, descending, filter_str)
+    page = paginator.Paginator(stats, pagesize, total=total).page(pagenum)
     shown_stats = page.object_list
+
     # Include parent dir always as first option, unless at filesystem root.
     if Hdfs.normpath(path) != posixpath.sep:
         parent_path = request.fs.join(path, "..")
@@ -518,6 +585,46 @@ def stat(request, path):
     return render_json(_massage_stats(request, stats))
 
 
+def disk_usage(request, path):
+    """
+    Shows the space consumed, the file counts and the quotas of each entry
+    of a directory.
+
+    The page is streamed: the entries are shown as their content summaries
+    come, the directory totals at the end. With format=json, returns it all
+    at once instead.
+    """
+    if not request.fs.isdir(path):
+        raise PopupException(_("Not a directory: %(path)s") % {'path': path})
+
+    dir_stat = request.fs.stats(path)
+    stats = request.fs.listdir_stats(path)
+    # The quotas of the directory come with its own summary
+    usages = disk_usage_lib.iter_usage(request.fs, [ dir_stat ] + stats)
+
+    if request.GET.get('format') == 'json':
+        usages = list(usages)
+        directory = [ usage for usage in usages if usage['path'] == dir_stat.path ][0]
+        usages.remove(directory)
+        return render_json({'path': path, 'directory': directory, 'usage': usages})
+
+    template = django_mako.lookup.get_template('disk_usage.mako')
+
+    def render_page():
+        directory = None
+        total = {}
+        yield template.get_def('header').render(path=path, breadcrumbs=parse_breadcrumbs(path), user=request.user)
+        for usage in usages:
+            if usage['path'] == dir_stat.path:
+                directory = usage
+            else:
+                disk_usage_lib.add_usage(total, usage)
+                yield template.get_def('row').render(usage=usage)
+        yield template.get_def('footer').render(path=path, total=total, directory=directory, count=len(stats))
+
+    return HttpResponse(render_page())
+
+
 def display(request, path):
     """
     Implements displaying part of a file.
@@ -571,8 +678,9 @@ def display(request, path):
         raise PopupException(_("Offset may not be less than zero."))
     if length < 0:
         raise PopupException(_("Length may not be less than zero."))
-    if length > MAX_CHUNK_SIZE_BYTES:
-        raise PopupException(_("Cannot request chunks greater than %(bytes)d bytes") % {'bytes': MAX_CHUNK_SIZE_BYTES})
+    max_length = mode == 'binary' and MAX_BINARY_CHUNK_SIZE_BYTES or MAX_CHUNK_SIZE_BYTES
+    if length > max_length:
+        raise PopupException(_("Cannot request chunks greater than %(bytes)d bytes") % {'bytes': max_length})
 
     # Do not decompress in binary mode.
     if mode == 'binary':
@@ -592,7 +700,15 @@ def display(request, path):
 
     # Get contents as bytes
     if mode == "binary":
-        xxd_out = list(xxd.xxd(offset, contents, BYTES_PER_LINE, BYTES_PER_SENTENCE))
+        xxd_out = xxd.hexdump(offset, contents, BYTES_PER_LINE, BYTES_PER_SENTENCE)
+
+    # The uncompressed size of a gzip file is only known at its end, when
+    # reading from before it. Past the end, it is still unknown.
+    size = stats['size']
+    if compression == 'gzip':
+        size = None
+        if len(contents) < length and (contents or offset == 0):
+            size = offset + len(contents)
 
     dirname = posixpath.dirname(path)
     # Start with index-like data:
@@ -606,7 +722,7 @@ def display(request, path):
         'dirname': dirname,
         'mode': mode,
         'compression': compression,
-        'size': stats['size']
+        'size': size
     }
     data["filename"] = os.path.basename(path)
     data["editable"] = stats['size'] < MAX_FILEEDITOR_SIZE
@@ -614,7 +730,6 @@ def display(request, path):
         # This might be the wrong thing for ?format=json; doing the
         # xxd'ing in javascript might be more compact, or sending a less
         # intermediate representation...
-        logger.debug("xxd: " + str(xxd_out))
         data['view']['xxd'] = xxd_out
         data['view']['masked_binary_data'] = False
     else:
@@ -633,91 +748,65 @@ def read_contents(codec_type, path, fs, offset, length):
        codec_type - The type of codec to use to decode. (Auto-detected if None).
        path - The path of the file to read.
        fs - The FileSystem instance to use to read.
-       offset - Offset to seek to before read begins.
+       offset - Offset to seek to before read begins. For gzip, an offset in
+                the uncompressed data.
        length - Amount of bytes to read after offset.
        Returns: A tuple of codec_type, offset, length and contents read.
+
+    The file is opened once.
     """
-    # Auto codec detection for [gzip, avro, none]
-    # Only done when codec_type is unset
-    if not codec_type:
-        if path.endswith('.gz') and detect_gzip(fs.open(path).read(2)):
-            codec_type = 'gzip'
-            offset = 0
-        elif path.endswith('.avro') and detect_avro(fs.open(path).read(3)):
-            codec_type = 'avro'
-        else:
+    fhandle = fs.open(path)
+    try:
+        # Auto codec detection for [gzip, avro, none]
+        # Only done when codec_type is unset
+        if not codec_type:
             codec_type = 'none'
-
-    f = fs.open(path)
-    contents = ''
-
-    if codec_type == 'gzip':
-        contents = _read_gzip(fs, path, offset, length)
-    elif codec_type == 'avro':
-        contents = _read_avro(fs, path, offset, length)
-    else:
-        # for 'none' type.
-        contents = _read_simple(fs, path, offset, length)
+            if path.endswith('.gz') or path.endswith('.avro'):
+                magic = fhandle.read(3)
+                if path.endswith('.gz') and detect_gzip(magic):
+                    codec_type = 'gzip'
+                elif path.endswith('.avro') and detect_avro(magic):
+                    codec_type = 'avro'
+
+        if codec_type == 'gzip':
+            # Checkpoints are kept as long as the file does not change
+            stats = fs.stats(path)
+            index = readers.get_gzip_index((path, stats['size'], stats['mtime']))
+            contents = _read_gzip(fhandle, path, offset, length, index)
+        elif codec_type == 'avro':
+            contents = _read_avro(fhandle, path, offset, length)
+        else:
+            # for 'none' type.
+            contents = _read_simple(fhandle, path, offset, length)
+    finally:
+        fhandle.close()
 
     return (codec_type, offset, length, contents)
 
 
-def _read_avro(fs, path, offset, length):
-    contents = ''
+def _read_avro(fhandle, path, offset, length):
     try:
-        fhandle = fs.open(path)
-        try:
-            fhandle.seek(offset)
-            data_file_reader = datafile.DataFileReader(fhandle, io.DatumReader())
-            contents_list = []
-            read_start = fhandle.tell()
-            # Iterate over the entire sought file.
-            for datum in data_file_reader:
-                read_length = fhandle.tell() - read_start
-                if read_length > length and len(contents_list) > 0:
-                    break
-                else:
-                    datum_str = str(datum) + "\n"
-                    contents_list.append(datum_str)
-            data_file_reader.close()
-            contents = "".join(contents_list)
-        except:
-            logging.warn("Could not read avro file at %s" % path, exc_info=True)
-            raise PopupException(_("Failed to read Avro file."))
-    finally:
-        fhandle.close()
-    return contents
+        return readers.read_avro(fhandle, offset, length, MAX_CHUNK_SIZE_BYTES)
+    except:
+        logging.warn("Could not read avro file at %s" % path, exc_info=True)
+        raise PopupException(_("Failed to read Avro file."))
 
 
-def _read_gzip(fs, path, offset, length):
-    contents = ''
-    if offset and offset != 0:
-        raise PopupException(_("Offsets are not supported with Gzip compression."))
+def _read_gzip(fhandle, path, offset, length, index=None):
     try:
-        fhandle = fs.open(path)
-        try:
-            contents = GzipFile('', 'r', 0, StringIO(fhandle.read())).read(length)
-        except:
-            logging.warn("Could not decompress file at %s" % path, exc_info=True)
-            raise PopupException(_("Failed to decompress file."))
-    finally:
-        fhandle.close()
-    return contents
+        return readers.read_gzip(fhandle, offset, length, index)
+    except:
+        logging.warn("Could not decompress file at %s" % path, exc_info=True)
+        raise PopupException(_("Failed to decompress file."))
 
 
-def _read_simple(fs, path, offset, length):
-    contents = ''
+def _read_simple(fhandle, path, offset, length):
     try:
-        fhandle = fs.open(path)
-        try:
-            fhandle.seek(offset)
-            contents = fhandle.read(length)
-        except:
-            logging.warn("Could not read file at %s" % path, exc_info=True)
-            raise PopupException(_("Failed to read file."))
-    finally:
-        fhandle.close()
-    return contents
+        fhandle.seek(offset)
+        return fhandle.read(length)
+    except:
+        logging.warn("Could not read file at %s" % path, exc_info=True)
+        raise PopupException(_("Failed to read file."))
 
 
 def detect_gzip(contents):
@@ -1121,8 +1210,8 @@ def upload_archive(request):
 def _upload_archive(request):
     """
     Handles archive upload.
-    The uploaded file is stored in memory.
-    We need to extract it and rename it.
+    The uploaded file is stored in memory or in a local temporary file.
+    Its contents are streamed into a directory named after it.
     """
     form = UploadArchiveForm(request.POST, request.FILES)
 
@@ -1133,28 +1222,20 @@ def _upload_archive(request):
         if request.fs.isdir(form.cleaned_data['dest']) and posixpath.sep in uploaded_file.name:
             raise PopupException(_('Sorry, no "%(sep)s" in the filename %(name)s.' % {'sep': posixpath.sep, 'name': uploaded_file.name}))
 
-        dest = request.fs.join(form.cleaned_data['dest'], uploaded_file.name)
+        # Make sure dest path is without the archive extension
+        archive_type, dirname = get_archive_type(uploaded_file.name)
+        dest = request.fs.join(form.cleaned_data['dest'], dirname)
         try:
-            # Extract if necessary
-            # Make sure dest path is without '.zip' extension
-            if dest.endswith('.zip'):
-                temp_path = archive_factory(uploaded_file).extract()
-                if not temp_path:
-                    raise PopupException(_('Could not extract contents of file.'))
-                # Move the file to where it belongs
-                dest = dest[:-4]
-                request.fs.copyFromLocal(temp_path, dest)
-                shutil.rmtree(temp_path)
-            else:
+            if archive_type is None:
                 raise PopupException(_('Could not interpret archive type.'))
-
+            archive_factory(uploaded_file, archive_type).upload(request.fs, dest)
+        except PartialFailureException, ex:
+            raise PopupException(_('Could not extract all the contents of %(name)s: %(error)s') % {'name': uploaded_file.name, 'error': ex})
+        except (tarfile.TarError, zipfile.BadZipfile), ex:
+            logger.warn("Could not read the archive %s: %s" % (uploaded_file.name, ex))
+            raise PopupException(_('Could not interpret archive type.'))
         except IOError, ex:
-            already_exists = False
-            try:
-                already_exists = request.fs.exists(dest)
-            except Exception:
-              pass
-            if already_exists:
+            if ex.errno == errno.EEXIST:
                 msg = _('Destination %(name)s already exists.' % {'name': dest})
             else:
                 msg = _('Copy to "%(name)s failed: %(error)s') % {'name': dest, 'error': ex}
@@ -26,6 +26,9 @@ except ImportError:
 import logging
 import os
 import re
+import shutil
+import tarfile
+import tempfile
 import urlparse
 
 from django.utils.encoding import smart_str
@@ -502,6 +505,39 @@ def test_listdir_sort_and_filter():
       pass      # Don't let cleanup errors mask earlier failures
 
 
+@attr('requires_hadoop')
+def test_disk_usage():
+  cluster = pseudo_hdfs4.shared_cluster()
+  c = make_logged_in_client(cluster.superuser)
+  cluster.fs.setuser(cluster.superuser)
+
+  BASE = '/test_disk_usage'
+  try:
+    cluster.fs.mkdir(BASE + '/dir/subdir')
+    cluster.fs.create(BASE + '/dir/a', data="foo")
+    cluster.fs.create(BASE + '/dir/subdir/b', data="foobar")
+    cluster.fs.create(BASE + '/c<d>', data="f")
+
+    response = json.loads(c.get('/filebrowser/du' + BASE + '?format=json').content)
+    usage = dict([ (entry['name'], entry) for entry in response['usage'] ])
+    assert_equal(['c<d>', 'dir'], sorted(usage.keys()))
+    assert_equal(9, usage['dir']['length'])
+    assert_equal(2, usage['dir']['fileCount'])
+    assert_equal(2, usage['dir']['directoryCount'])
+    assert_equal(1, usage['c<d>']['length'])
+    assert_equal(10, response['directory']['length'])
+
+    # Streamed page
+    content = c.get('/filebrowser/du' + BASE).content
+    assert_true('c&lt;d&gt;' in content, content)
+    assert_true('/filebrowser/du' + BASE + '/dir' in content, content)
+  finally:
+    try:
+      cluster.fs.rmtree(BASE)
+    except:
+      pass      # Don't let cleanup errors mask earlier failures
+
+
 @attr('requires_hadoop')
 def test_chooser():
   cluster = pseudo_hdfs4.shared_cluster()
@@ -599,9 +635,21 @@ def test_view_gz():
     response = c.get('/filebrowser/view/test-gz-filebrowser/test-view.gz')
     assert_equal(response.context['view']['contents'], "sdf\n")
 
-    # offset should do nothing
+    # offsets are in the uncompressed data
     response = c.get('/filebrowser/view/test-gz-filebrowser/test-view.gz?compression=gzip&offset=1')
-    assert_true("Offsets are not supported" in response.context['message'], response.context['message'])
+    assert_equal(response.context['view']['contents'], "df\n")
+    assert_equal(response.context['view']['size'], 4)
+
+    # past the end, the size is not known
+    response = c.get('/filebrowser/view/test-gz-filebrowser/test-view.gz?compression=gzip&offset=10')
+    assert_equal(response.context['view']['contents'], "")
+    assert_equal(response.context['view']['size'], None)
+
+    f = cluster.fs.open('/test-gz-filebrowser/test-empty.gz', "w")
+    f.write('\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+    f.close()
+    response = c.get('/filebrowser/view/test-gz-filebrowser/test-empty.gz?compression=gzip')
+    assert_equal(response.context['view']['size'], 0)
 
     f = cluster.fs.open('/test-gz-filebrowser/test-view2.gz', "w")
     f.write("hello")
@@ -622,6 +670,46 @@ def test_view_gz():
       pass      # Don't let cleanup errors mask earlier failures
 
 
+@attr('requires_hadoop')
+def test_download():
+  cluster = pseudo_hdfs4.shared_cluster()
+  try:
+    c = make_logged_in_client()
+    cluster.fs.setuser(cluster.superuser)
+    cluster.fs.mkdir('/test-download-filebrowser/')
+    cluster.fs.create('/test-download-filebrowser/data.txt', data='0123456789')
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/data.txt')
+    assert_equal(200, response.status_code)
+    assert_equal('0123456789', response.content)
+    assert_equal('bytes', response['Accept-Ranges'])
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/data.txt', HTTP_RANGE='bytes=2-5')
+    assert_equal(206, response.status_code)
+    assert_equal('2345', response.content)
+    assert_equal('bytes 2-5/10', response['Content-Range'])
+    assert_equal('4', response['Content-Length'])
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/data.txt', HTTP_RANGE='bytes=-3')
+    assert_equal(206, response.status_code)
+    assert_equal('789', response.content)
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/data.txt', HTTP_RANGE='bytes=20-')
+    assert_equal(416, response.status_code)
+    assert_equal('bytes */10', response['Content-Range'])
+
+    # A stale If-Range gets the whole file
+    response = c.get('/filebrowser/download/test-download-filebrowser/data.txt',
+                     HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+    assert_equal(200, response.status_code)
+    assert_equal('0123456789', response.content)
+  finally:
+    try:
+      cluster.fs.rmtree('/test-download-filebrowser/')
+    except:
+      pass      # Don't let cleanup errors mask earlier failures
+
+
 @attr('requires_hadoop')
 def test_view_i18n():
   cluster = pseudo_hdfs4.shared_cluster()
@@ -906,6 +994,35 @@ def test_upload_archive():
     response = json.loads(resp.content)
     assert_equal(0, response['status'], response)
     assert_true(cluster.fs.exists(HDFS_ZIP_FILE))
+
+    # Upload and extract a tar.gz archive
+    tmp_dir = tempfile.mkdtemp()
+    TGZ_FILE = os.path.join(tmp_dir, 'test-tgz.tar.gz')
+    tfh = tarfile.open(TGZ_FILE, 'w:gz')
+    tfh.add(ZIP_FILE, 'dir/test.zip')
+    tfh.close()
+    try:
+      resp = client.post('/filebrowser/upload/archive',
+                         dict(dest=HDFS_DEST_DIR, archive=file(TGZ_FILE)))
+    finally:
+      shutil.rmtree(tmp_dir)
+    response = json.loads(resp.content)
+    assert_equal(0, response['status'], response)
+    assert_equal(os.path.getsize(ZIP_FILE), cluster.fs.stats(HDFS_DEST_DIR + '/test-tgz/dir/test.zip').size)
+
+    # A corrupt archive is reported as such
+    tmp_dir = tempfile.mkdtemp()
+    CORRUPT_FILE = os.path.join(tmp_dir, 'corrupt.zip')
+    file(CORRUPT_FILE, 'w').write('not a zip file')
+    try:
+      resp = client.post('/filebrowser/upload/archive',
+                         dict(dest=HDFS_DEST_DIR, archive=file(CORRUPT_FILE)))
+    finally:
+      shutil.rmtree(tmp_dir)
+    response = json.loads(resp.content)
+    assert_equal(-1, response['status'], response)
+    assert_true('Could not interpret archive' in response['data'], response)
+    assert_false(cluster.fs.exists(HDFS_DEST_DIR + '/corrupt'))
   finally:
     try:
       cluster.fs.remove(HDFS_DEST_DIR)
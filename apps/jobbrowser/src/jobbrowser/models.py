@@ -21,6 +21,7 @@ from hadoop import job_tracker
 from hadoop import confparse
 from urlparse import urlparse, urlunparse
 
+import codecs
 import datetime
 import logging
 import lxml.html
@@ -37,6 +38,9 @@ from desktop.lib.exceptions_renderable import PopupException
 
 LOGGER = logging.getLogger(__name__)
 
+# The logs of a task attempt, in the order of TaskAttempt.get_task_log()
+TASK_LOG_SOURCES = ('stdout', 'stderr', 'syslog')
+
 class JobLinkage(object):
   """
   A thin representation of a job, without much of the details.
@@ -453,6 +457,37 @@ class TaskAttempt(object):
       return (err, err, err)
     return [ section.text for section in log_sections ]
 
+  def get_task_log_tail(self, offsets=(0, 0, 0)):
+    """
+    get_task_log_tail(offsets) -> ([stdout_text, stderr_text, syslog_text], new offsets)
+
+    Retrieve only what was added to the task logs since `offsets', the byte
+    offsets returned by a previous call, as plain text:
+      http://<tracker_host>:<port>/tasklog?attemptid=<attempt_id>&filter=<source>&start=<offset>&plaintext=true
+
+    A character cut by the end of the logs is left to the next call.
+    """
+    tracker = self.get_tracker()
+    texts = [ ]
+    new_offsets = [ ]
+    for source, offset in zip(TASK_LOG_SOURCES, offsets):
+      url = urlunparse(('http',
+                        '%s:%s' % (tracker.host, tracker.httpPort),
+                        'tasklog',
+                        None,
+                        'attemptid=%s&filter=%s&start=%d&plaintext=true' % (self.attemptId, source, offset),
+                        None))
+      LOGGER.debug('Retrieving %s' % (url,))
+      try:
+        data = urllib2.urlopen(url).read()
+      except urllib2.URLError:
+        raise urllib2.URLError(_("Cannot retrieve logs from TaskTracker %(id)s.") % {'id': self.taskTrackerId})
+      decoder = codecs.getincrementaldecoder(i18n.get_site_encoding())(errors='replace')
+      texts.append(decoder.decode(data))
+      pending = decoder.getstate()[0]
+      new_offsets.append(offset + len(data) - len(pending))
+    return texts, new_offsets
+
 
 class Tracker(object):
 
@@ -79,21 +79,21 @@ ${commonheader(_('Task Attempt: %(attemptId)s - Job Browser') % dict(attemptId=a
                     % endif
                     <h2>${_('stdout')}</h2>
                     % if not log_stdout:
-                            <pre>-- empty --</pre>
+                            <pre id="log_stdout">-- empty --</pre>
                     % else:
-                            <pre>${format_log(log_stdout)}</pre>
+                            <pre id="log_stdout">${format_log(log_stdout)}</pre>
                     % endif
                     <h2>${_('stderr')}</h2>
                     % if not log_stderr:
-                            <pre>-- empty --</pre>
+                            <pre id="log_stderr">-- empty --</pre>
                     % else:
-                            <pre>${format_log(log_stderr)}</pre>
+                            <pre id="log_stderr">${format_log(log_stderr)}</pre>
                     % endif
                     <h2>${_('syslog')}</h2>
                     % if not log_syslog:
-                            <pre>-- empty --</pre>
+                            <pre id="log_syslog">-- empty --</pre>
                     % else:
-                            <pre>${format_log(log_syslog)}</pre>
+                            <pre id="log_syslog">${format_log(log_syslog)}</pre>
                     % endif
                 </div>
             </div>
@@ -126,6 +126,29 @@ ${commonheader(_('Task Attempt: %(attemptId)s - Job Browser') % dict(attemptId=a
                 { "sWidth": "70%" }
             ]
         });
+
+        % if attempt.state == 'running':
+        // Append to the logs what the task writes
+        var logOffsets = {stdout: ${log_offsets['stdout']}, stderr: ${log_offsets['stderr']}, syslog: ${log_offsets['syslog']}};
+
+        function tailLogs() {
+            $.getJSON("${ url('jobbrowser.views.single_task_attempt_logs', jobid=joblnk.jobId, taskid=task.taskId, attemptid=attempt.attemptId) }",
+                {format: "json", stdout_offset: logOffsets.stdout, stderr_offset: logOffsets.stderr, syslog_offset: logOffsets.syslog},
+                function (data) {
+                    $.each(data.logs, function (source, text) {
+                        if (text) {
+                            var _logEl = $("#log_" + source);
+                            _logEl.text((logOffsets[source] > 0 ? _logEl.text() : "") + text);
+                        }
+                    });
+                    logOffsets = data.offsets;
+                    if (data.isRunning) {
+                        window.setTimeout(tailLogs, 5000);
+                    }
+                });
+        }
+        window.setTimeout(tailLogs, 5000);
+        % endif
     });
 </script>
 ${commonfooter(messages)}
@@ -19,6 +19,7 @@ try:
     import json
 except ImportError:
     import simplejson as json
+import cStringIO
 import logging
 import time
 import unittest
@@ -53,6 +54,49 @@ def test_format_counter_name():
   assert_equal("Foo.", views.format_counter_name("foo."))
   assert_equal("A Bbb Ccc", views.format_counter_name("A_BBB_CCC"))\
 
+def test_get_task_log_tail():
+  logs = { 'stdout': 'out\n', 'stderr': '', 'syslog': 'line 1\nline 2\n' }
+  urls = [ ]
+
+  def urlopen(url):
+    urls.append(url)
+    params = dict([ param.split('=') for param in url.split('?')[1].split('&') ])
+    return cStringIO.StringIO(logs[params['filter']][int(params['start']):])
+
+  class MockTracker(object):
+    host = 'tracker'
+    httpPort = 50060
+
+  attempt = models.TaskAttempt.__new__(models.TaskAttempt)
+  attempt.attemptId = 'attempt_201302141541_0001_m_000000_0'
+  attempt.get_tracker = lambda: MockTracker()
+
+  prev_urlopen = models.urllib2.urlopen
+  try:
+    models.urllib2.urlopen = urlopen
+    texts, offsets = attempt.get_task_log_tail()
+    assert_equal([ 'out\n', '', 'line 1\nline 2\n' ], texts)
+    assert_equal([ 4, 0, 14 ], offsets)
+    assert_equal('http://tracker:50060/tasklog?attemptid=attempt_201302141541_0001_m_000000_0'
+                 '&filter=stdout&start=0&plaintext=true', urls[0])
+
+    logs['syslog'] += 'line 3\n'
+    texts, offsets = attempt.get_task_log_tail(offsets)
+    assert_equal([ '', '', 'line 3\n' ], texts)
+    assert_equal([ 4, 0, 21 ], offsets)
+
+    # A character cut by the end of the log comes whole with the next poll
+    logs['stdout'] += 'caf\xc3'
+    texts, offsets = attempt.get_task_log_tail(offsets)
+    assert_equal(u'caf', texts[0])
+    assert_equal(7, offsets[0])
+    logs['stdout'] += '\xa9\n'
+    texts, offsets = attempt.get_task_log_tail(offsets)
+    assert_equal(u'\xe9\n', texts[0])
+    assert_equal(10, offsets[0])
+  finally:
+    models.urllib2.urlopen = prev_urlopen
+
 def get_hadoop_job_id(oozie_api, oozie_jobid, action_index=1, timeout=60, step=5):
   hadoop_job_id = None
   start = time.time()
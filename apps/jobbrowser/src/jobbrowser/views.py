@@ -38,7 +38,7 @@ from hadoop.api.jobtracker.ttypes import ThriftJobPriority, TaskTrackerNotFoundE
 
 
 from jobbrowser import conf
-from jobbrowser.models import Job, JobLinkage, TaskList, Tracker, Cluster
+from jobbrowser.models import Job, JobLinkage, TaskList, Tracker, Cluster, TASK_LOG_SOURCES
 
 from django.utils.translation import ugettext as _
 
@@ -276,6 +276,10 @@ def single_task_attempt(request, jobid, taskid, attemptid):
 def single_task_attempt_logs(request, jobid, taskid, attemptid):
   """
   We get here from /jobs/jobid/tasks/taskid/attempts/attemptid/logs
+
+  With format=json, only returns what was appended to the stdout, stderr
+  and syslog logs since the byte offsets stdout_offset, stderr_offset and
+  syslog_offset, along with the new offsets.
   """
   job_link = JobLinkage(request.jt, jobid)
   task = job_link.get_task(taskid)
@@ -284,12 +288,31 @@ def single_task_attempt_logs(request, jobid, taskid, attemptid):
   except KeyError:
     raise KeyError(_("Cannot find attempt '%(id)s' in task") % dict(id=attemptid))
 
+  if request.GET.get('format') == 'json':
+    try:
+      offsets = [ int(request.GET.get('%s_offset' % source, 0)) for source in TASK_LOG_SOURCES ]
+    except ValueError:
+      raise PopupException(_("Invalid log offset."), error_code=400)
+    try:
+      logs, offsets = attempt.get_task_log_tail(offsets)
+    except TaskTrackerNotFoundException:
+      raise PopupException(_("Failed to retrieve log. TaskTracker not found."))
+    return render_json({
+      'logs': dict(zip(TASK_LOG_SOURCES, logs)),
+      'offsets': dict(zip(TASK_LOG_SOURCES, offsets)),
+      'isRunning': attempt.state == 'running',
+    })
+
+  log_offsets = dict([ (source, 0) for source in TASK_LOG_SOURCES ])
   try:
     # Add a diagnostic log
     diagnostic_log = ", ".join(task.diagnosticMap[attempt.attemptId])
     logs = [ diagnostic_log ]
-    # Add remaining logs
-    logs += [ section.strip() for section in attempt.get_task_log() ]
+    # Add remaining logs, as plain text: their byte offsets are where the
+    # page asks for more from
+    task_logs, offsets = attempt.get_task_log_tail()
+    logs += [ section.strip() for section in task_logs ]
+    log_offsets = dict(zip(TASK_LOG_SOURCES, offsets))
   except TaskTrackerNotFoundException:
     # Four entries,
     # for diagnostic, stdout, stderr and syslog
@@ -300,7 +323,8 @@ def single_task_attempt_logs(request, jobid, taskid, attemptid):
       "taskid":taskid,
       "joblnk": job_link,
       "task": task,
-      "logs": logs
+      "logs": logs,
+      "log_offsets": log_offsets,
     })
 
 @check_job_permission
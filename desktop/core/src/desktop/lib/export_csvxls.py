@@ -15,18 +15,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-Common library to export either CSV or XLS.
+Common library to export either CSV, TSV or XLS.
+
+XLS downloads are real spreadsheets (XLSX), streamed as a zip archive as the
+rows come, so that no format needs the whole result in memory.
 """
 import cStringIO
 import csv
+import decimal
+import itertools
 import logging
+import re
+import struct
+import time
+import zlib
+
+from xml.sax.saxutils import escape
 
 from django.http import HttpResponse
-from django.utils.encoding import smart_str
+from django.utils.encoding import smart_str, smart_unicode
 from desktop.lib import i18n
 
 LOG = logging.getLogger(__name__)
-XLS_SIZE_LIMIT = 200 * 1024 * 1024      # 200MB
+
+# Caps on the sheet of XLS downloads. Excel can't open more rows.
+XLS_SIZE_LIMIT = 200 * 1024 * 1024      # 200MB of uncompressed sheet
+XLS_ROW_LIMIT = 1048576
+XLS_CELL_LIMIT = 32767                  # Characters in a cell
+
+# Size of the chunks handed back to the web server by format_rows()
+CHUNK_SIZE = 1024 * 1024                # 1MB
+
+# Rows encoded and written at once
+BATCH_ROWS = 1000
+
+# Favour speed: CSV compresses well even at the lowest level
+GZIP_LEVEL = 1
 
 class TooBigToDownloadException(Exception):
   pass
@@ -59,6 +83,16 @@ class Formatter(object):
     """
     raise NotImplementedError()
 
+  def format_rows(self, rows):
+    """
+    format_rows(rows) -> generator of data
+
+    Format many rows at once. Implementations should buffer the output and
+    yield it in large chunks. Same error behaviour as format_row().
+    """
+    for row in rows:
+      yield self.format_row(row)
+
   def fini_doc(self):
     """
     fini_doc() -> final data to appear after all rows
@@ -80,47 +114,86 @@ def _force_string(x):
 def generator(header, data, formatter):
   yield formatter.init_doc()
   yield formatter.format_header(header)
-  for datum in data:
-    try:
-      yield formatter.format_row(map(_force_string, datum))
-    except TooBigToDownloadException, ex:
-      # Truncate the results
-      LOG.exception(ex)
-      pass
+  try:
+    for chunk in formatter.format_rows(map(_force_string, datum) for datum in data):
+      yield chunk
+  except TooBigToDownloadException, ex:
+    # Truncate the results
+    LOG.exception(ex)
   yield formatter.fini_doc()
 
-def make_response(header, data, format, name, encoding=None):
+def gzip_generator(data, level=GZIP_LEVEL):
   """
-  @param header List of strings to form the header
-  @param data An iterator of rows, where every row is a list of strings
-  @param format Either "csv" or "xls"
-  @param name Base name for output file
-  @param encoding Unicode encoding for data
+  gzip_generator(data) -> generator of gzip compressed data
+
+  Compress the strings yielded by `data' into a single gzip stream, as they come.
+  """
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in data:
+    compressed = compressor.compress(chunk)
+    if compressed:
+      yield compressed
+  yield compressor.flush()
+
+def get_formatter(format, encoding=None):
+  """
+  get_formatter(format, encoding) -> (formatter, mimetype, file extension)
+
+  @param format One of "csv", "tsv" or "xls"
   """
   if format == 'csv':
-    formatter = CSVformatter(encoding)
-    mimetype = 'application/csv'
+    return CSVformatter(encoding), 'application/csv', 'csv'
+  elif format == 'tsv':
+    return TSVformatter(encoding), 'text/tab-separated-values', 'tsv'
   elif format == 'xls':
-    formatter = CSVformatter(encoding)
-    mimetype = 'application/xls'
+    return XLSXformatter(), XLSX_MIMETYPE, 'xlsx'
   else:
     raise Exception("Unknown format: %s" % (format,))
 
-  resp = HttpResponse(generator(header, data, formatter), mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, format)
+def make_response(header, data, format, name, encoding=None, compress=False):
+  """
+  @param header List of strings to form the header
+  @param data An iterator of rows, where every row is a list of strings
+  @param format One of "csv", "tsv" or "xls"
+  @param name Base name for output file
+  @param encoding Unicode encoding for data
+  @param compress Whether to gzip the output
+  """
+  formatter, mimetype, extension = get_formatter(format, encoding)
+
+  gen = generator(header, data, formatter)
+  filename = '%s.%s' % (name, extension)
+  if compress:
+    gen = gzip_generator(gen)
+    mimetype = 'application/x-gzip'
+    filename += '.gz'
+
+  resp = HttpResponse(gen, mimetype=mimetype)
+  resp['Content-Disposition'] = 'attachment; filename=%s' % (filename,)
   return resp
 
 class CSVformatter(Formatter):
-  def __init__(self, encoding=None):
+  """
+  Writes quoted, `delimiter' separated values.
+
+  format_rows() encodes the cells column by column: a column holding only
+  numbers (or only byte strings, with a UTF-8 encoding) is left alone, and a
+  column of unicode strings is encoded in one go. Only columns of mixed types
+  go through smart_str() cell by cell.
+  """
+  def __init__(self, encoding=None, delimiter=','):
     super(CSVformatter, self).__init__()
     dialect = csv.excel()
     dialect.quoting = csv.QUOTE_ALL
+    dialect.delimiter = delimiter
     self._encoding = encoding or i18n.get_site_encoding()
-    self._csv_writer = csv.writer(self, dialect=dialect)
-    self._line = None
+    self._buffer = cStringIO.StringIO()
+    self._csv_writer = csv.writer(self._buffer, dialect=dialect)
 
-  def write(self, line):
-    self._line = line
+    # Types smart_str() would leave as they are
+    self._unchanged_types = set([int, long, float, bool, type(None)])
+    if self._encoding == 'utf-8':
+      self._unchanged_types.add(str)
 
   def init_doc(self):
     return ""
@@ -129,10 +202,287 @@ class CSVformatter(Formatter):
     return self.format_row(header)
 
   def format_row(self, row):
-    # writerow will call our write() method
     row = [smart_str(cell, self._encoding, strings_only=True, errors='replace') for cell in row]
     self._csv_writer.writerow(row)
-    return self._line
+    return self._flush()
+
+  def format_rows(self, rows):
+    rows = iter(rows)
+    while True:
+      batch = list(itertools.islice(rows, BATCH_ROWS))
+      if not batch:
+        break
+      self._csv_writer.writerows(self._encode_rows(batch))
+      if self._buffer.tell() >= CHUNK_SIZE:
+        yield self._flush()
+    if self._buffer.tell():
+      yield self._flush()
+
+  def _encode_rows(self, rows):
+    if not rows[0] or len(set(map(len, rows))) != 1:
+      # Empty or ragged rows can't be handled as columns
+      return [ [ smart_str(cell, self._encoding, strings_only=True, errors='replace') for cell in row ]
+               for row in rows ]
+    columns = zip(*rows)
+    for i, column in enumerate(columns):
+      types = set(map(type, column))
+      if types <= self._unchanged_types:
+        continue
+      elif types == set([unicode]):
+        columns[i] = [ cell.encode(self._encoding, 'replace') for cell in column ]
+      else:
+        columns[i] = [ smart_str(cell, self._encoding, strings_only=True, errors='replace') for cell in column ]
+    return zip(*columns)
+
+  def _flush(self):
+    data = self._buffer.getvalue()
+    self._buffer.seek(0)
+    self._buffer.truncate()
+    return data
 
   def fini_doc(self):
     return ""
+
+
+class TSVformatter(Formatter):
+  """
+  Writes tab separated values, the way Hive does: no quoting, with
+  backslash, tab and line breaks escaped, and NULL written as \\N.
+  Meant for programs rather than spreadsheets.
+  """
+  def __init__(self, encoding=None):
+    super(TSVformatter, self).__init__()
+    self._encoding = encoding or i18n.get_site_encoding()
+
+  def init_doc(self):
+    return ""
+
+  def format_header(self, header):
+    return self.format_row(header)
+
+  def format_row(self, row):
+    return '\t'.join([ self._format_cell(cell) for cell in row ]) + '\n'
+
+  def format_rows(self, rows):
+    return _chunks(self.format_row(row) for row in rows)
+
+  def _format_cell(self, cell):
+    if cell is None:
+      return '\\N'
+    elif isinstance(cell, float):
+      return repr(cell)
+    cell = smart_str(cell, self._encoding, errors='replace')
+    if '\\' in cell or '\t' in cell or '\n' in cell or '\r' in cell:
+      cell = cell.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return cell
+
+  def fini_doc(self):
+    return ""
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_XLSX_PARTS = (
+  ('[Content_Types].xml',
+   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+   '<Default Extension="xml" ContentType="application/xml"/>'
+   '<Override PartName="/xl/workbook.xml" '
+   'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+   '<Override PartName="/xl/worksheets/sheet1.xml" '
+   'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+   '</Types>'),
+  ('_rels/.rels',
+   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+   '<Relationship Id="rId1" Target="xl/workbook.xml" '
+   'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+   '</Relationships>'),
+  ('xl/workbook.xml',
+   '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+   'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+   '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+   '</workbook>'),
+  ('xl/_rels/workbook.xml.rels',
+   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+   '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+   'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+   '</Relationships>'),
+)
+
+_XLSX_SHEET = 'xl/worksheets/sheet1.xml'
+_XLSX_SHEET_START = '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+_XLSX_SHEET_END = '</sheetData></worksheet>'
+
+# Characters that are not allowed in XML 1.0
+_XML_ILLEGAL_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# Larger integers lose precision as Excel numbers, e.g. ids
+_XLSX_MAX_EXACT_INT = 10 ** 15
+
+
+class XLSXformatter(Formatter):
+  """
+  Writes an XLSX workbook with a single sheet, in constant memory: the sheet
+  is compressed into a zip archive as the rows come.
+
+  Numbers are written as numbers, everything else as text. The sheet is
+  capped at XLS_ROW_LIMIT rows and XLS_SIZE_LIMIT bytes: past that,
+  format_row() raises TooBigToDownloadException and fini_doc() closes the
+  workbook with the rows so far.
+  """
+  def __init__(self, size_limit=None, row_limit=None):
+    super(XLSXformatter, self).__init__()
+    self._size_limit = size_limit or XLS_SIZE_LIMIT
+    self._row_limit = row_limit or XLS_ROW_LIMIT
+    self._zip = _ZipStream()
+    self._size = 0
+    self._row_count = 0
+
+  def init_doc(self):
+    data = [ ]
+    for name, xml in _XLSX_PARTS:
+      data.append(self._zip.start_entry(name))
+      data.append(self._zip.write(_XML_DECLARATION + xml))
+      data.append(self._zip.end_entry())
+    data.append(self._zip.start_entry(_XLSX_SHEET))
+    data.append(self._zip.write(_XML_DECLARATION + _XLSX_SHEET_START))
+    return ''.join(data)
+
+  def format_header(self, header):
+    return self.format_row(header)
+
+  def format_row(self, row):
+    self._check_limits()
+    xml = self._row_xml(row)
+    self._size += len(xml)
+    self._row_count += 1
+    return self._zip.write(xml)
+
+  def format_rows(self, rows):
+    rows = iter(rows)
+    while True:
+      xml = [ ]
+      error = None
+      try:
+        for row in itertools.islice(rows, BATCH_ROWS):
+          self._check_limits()
+          xml.append(self._row_xml(row))
+          self._size += len(xml[-1])
+          self._row_count += 1
+      except TooBigToDownloadException, ex:
+        error = ex
+      # Hand out what was formatted, even when a limit was reached
+      data = self._zip.write(''.join(xml))
+      if data:
+        yield data
+      if error is not None:
+        raise error
+      if not xml:
+        break
+
+  def fini_doc(self):
+    return ''.join([ self._zip.write(_XLSX_SHEET_END), self._zip.end_entry(), self._zip.close() ])
+
+  def _check_limits(self):
+    if self._row_count >= self._row_limit or self._size >= self._size_limit:
+      raise TooBigToDownloadException(
+          "Spreadsheet capped at %d rows (%d bytes)" % (self._row_count, self._size))
+
+  def _row_xml(self, row):
+    cells = [ '<row>' ]
+    for cell in row:
+      if cell is None:
+        cells.append('<c/>')
+      elif isinstance(cell, bool):
+        cells.append('<c t="b"><v>%d</v></c>' % (cell,))
+      elif isinstance(cell, (int, long)) and abs(cell) < _XLSX_MAX_EXACT_INT or \
+           isinstance(cell, decimal.Decimal) and cell.is_finite():
+        cells.append('<c><v>%s</v></c>' % (cell,))
+      elif isinstance(cell, float) and cell - cell == 0:   # Not inf or nan
+        cells.append('<c><v>%r</v></c>' % (cell,))
+      else:
+        text = smart_unicode(cell, errors='replace')[:XLS_CELL_LIMIT]
+        text = escape(_XML_ILLEGAL_CHARS.sub(u'', text)).encode('utf-8')
+        cells.append('<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % (text,))
+    cells.append('</row>')
+    return ''.join(cells)
+
+
+class _ZipStream(object):
+  """
+  Writes a zip archive sequentially, without seeking: the sizes and CRC of
+  each entry follow its data, in a data descriptor. Entries are deflated.
+  Every method returns the bytes to append to the archive.
+  """
+  def __init__(self):
+    self._offset = 0
+    self._entries = [ ]
+    self._current = None
+    self._compressor = None
+    t = time.localtime()
+    self._dos_time = t[3] << 11 | t[4] << 5 | t[5] // 2
+    self._dos_date = (t[0] - 1980) << 9 | t[1] << 5 | t[2]
+
+  def start_entry(self, name):
+    assert self._current is None
+    self._current = { 'name': name, 'offset': self._offset, 'crc': 0, 'size': 0, 'compressed_size': 0 }
+    self._compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08, 8, self._dos_time, self._dos_date,
+                         0, 0, 0, len(name), 0)
+    return self._emit(header + name)
+
+  def write(self, data):
+    if not data:
+      return ''
+    self._current['crc'] = zlib.crc32(data, self._current['crc'])
+    self._current['size'] += len(data)
+    return self._emit_compressed(self._compressor.compress(data))
+
+  def end_entry(self):
+    data = self._emit_compressed(self._compressor.flush())
+    entry = self._current
+    self._entries.append(entry)
+    self._current = self._compressor = None
+    descriptor = struct.pack('<IIII', 0x08074b50, entry['crc'] & 0xffffffff,
+                             entry['compressed_size'], entry['size'])
+    return data + self._emit(descriptor)
+
+  def close(self):
+    assert self._current is None
+    start = self._offset
+    directory = [ ]
+    for entry in self._entries:
+      directory.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x08, 8,
+                                   self._dos_time, self._dos_date, entry['crc'] & 0xffffffff,
+                                   entry['compressed_size'], entry['size'], len(entry['name']),
+                                   0, 0, 0, 0, 0, entry['offset']))
+      directory.append(entry['name'])
+    directory = self._emit(''.join(directory))
+    end = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self._entries), len(self._entries),
+                      self._offset - start, start, 0)
+    return directory + self._emit(end)
+
+  def _emit_compressed(self, data):
+    self._current['compressed_size'] += len(data)
+    return self._emit(data)
+
+  def _emit(self, data):
+    self._offset += len(data)
+    return data
+
+
+def _chunks(strings):
+  """Join the `strings' into chunks of about CHUNK_SIZE."""
+  buf = [ ]
+  size = 0
+  for string in strings:
+    buf.append(string)
+    size += len(string)
+    if size >= CHUNK_SIZE:
+      yield ''.join(buf)
+      buf = [ ]
+      size = 0
+  if buf:
+    yield ''.join(buf)
@@ -23,6 +23,8 @@ import urllib2
 
 from urllib2_kerberos import HTTPKerberosAuthHandler
 
+from desktop.lib.rest.keepalive import KeepAliveHandler, KeepAliveHTTPSHandler
+
 __docformat__ = "epytext"
 
 LOG = logging.getLogger(__name__)
@@ -70,10 +72,11 @@ class HttpClient(object):
   """
   Basic HTTP client tailored for rest APIs.
   """
-  def __init__(self, base_url, exc_class=None, logger=None):
+  def __init__(self, base_url, exc_class=None, logger=None, pool=None):
     """
     @param base_url: The base url to the API.
     @param exc_class: An exception class to handle non-200 results.
+    @param pool: A keepalive.ConnectionPool. Defaults to the process-wide pool.
 
     Creates an HTTP(S) client to connect to the Cloudera Manager API.
     """
@@ -85,9 +88,12 @@ class HttpClient(object):
     # Make a cookie processor
     cookiejar = cookielib.CookieJar()
 
+    # Connections are kept alive and shared with other clients of the same host
     self._opener = urllib2.build_opener(
         HTTPErrorProcessor(),
-        urllib2.HTTPCookieProcessor(cookiejar))
+        urllib2.HTTPCookieProcessor(cookiejar),
+        KeepAliveHandler(pool),
+        KeepAliveHTTPSHandler(pool))
 
 
   def set_basic_auth(self, username, password, realm):
@@ -0,0 +1,312 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+HTTP/1.1 keep-alive support for urllib2.
+
+urllib2 sends every request with "Connection: close", so each REST call
+pays for a new TCP connection. The handlers in this module keep finished
+connections in a process-wide pool and hand them out again to the next
+request going to the same host. A connection only goes back to the pool once
+its response has been read to the end; a response closed early takes its
+connection down with it.
+"""
+
+import httplib
+import logging
+import socket
+import threading
+import time
+import urllib2
+
+__docformat__ = "epytext"
+
+LOG = logging.getLogger(__name__)
+
+# Number of idle connections kept per (scheme, host:port)
+DEFAULT_MAX_PER_HOST = 10
+# Idle connections older than this (in seconds) are closed instead of reused
+DEFAULT_IDLE_TIMEOUT = 30
+
+# Requests that can be sent again when a reused connection fails after the
+# request went out. The others, e.g. a WebHDFS APPEND, could be applied twice.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ConnectionPool(object):
+  """
+  Thread-safe pool of idle httplib connections, keyed by (scheme, host).
+
+  Connections are checked out exclusively by one request at a time. The pool
+  never blocks: when no idle connection is available a new one is created,
+  and at most `max_per_host' of them are kept around once released. Idle
+  connections of every host are closed once they expire, so that hosts not
+  talked to anymore do not keep their sockets open.
+  """
+  def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    self._max_per_host = max_per_host
+    self._idle_timeout = idle_timeout
+    self._lock = threading.Lock()
+    # key -> [ (connection, released_at) ], most recently released last
+    self._idle = { }
+    self._last_eviction = time.time()
+
+  def get(self, key):
+    """
+    get(key) -> connection or None
+
+    Check out the most recently used idle connection for `key'. Connections
+    that have been idle for too long are closed on the way.
+    """
+    expired = [ ]
+    conn = None
+    now = time.time()
+
+    self._lock.acquire()
+    try:
+      idle = self._idle.get(key, [ ])
+      while idle:
+        candidate, released_at = idle.pop()
+        if now - released_at > self._idle_timeout:
+          expired.append(candidate)
+        else:
+          conn = candidate
+          break
+      # Everything left is even older
+      expired.extend([ c for c, _ in idle ])
+      del idle[:]
+    finally:
+      self._lock.release()
+
+    for stale in expired:
+      stale.close()
+    return conn
+
+  def put(self, key, conn):
+    """
+    Return a connection whose last response has been fully read.
+
+    The expired connections of all hosts are closed on the way, at most once
+    per idle timeout.
+    """
+    expired = [ ]
+    now = time.time()
+
+    self._lock.acquire()
+    try:
+      if now - self._last_eviction > self._idle_timeout:
+        expired = self._pop_expired(now)
+      idle = self._idle.setdefault(key, [ ])
+      if len(idle) < self._max_per_host:
+        idle.append((conn, now))
+        conn = None
+    finally:
+      self._lock.release()
+
+    for stale in expired:
+      stale.close()
+    if conn is not None:
+      conn.close()
+
+  def evict_idle(self):
+    """Close all connections that have been idle for longer than the timeout."""
+    self._lock.acquire()
+    try:
+      expired = self._pop_expired(time.time())
+    finally:
+      self._lock.release()
+
+    for conn in expired:
+      conn.close()
+
+  def _pop_expired(self, now):
+    """Remove and return the expired connections. Must hold the lock."""
+    expired = [ ]
+    for key, idle in self._idle.items():
+      keep = [ ]
+      for conn, released_at in idle:
+        if now - released_at > self._idle_timeout:
+          expired.append(conn)
+        else:
+          keep.append((conn, released_at))
+      if keep:
+        self._idle[key] = keep
+      else:
+        del self._idle[key]
+    self._last_eviction = now
+    return expired
+
+  def close_all(self):
+    self._lock.acquire()
+    try:
+      idle, self._idle = self._idle, { }
+    finally:
+      self._lock.release()
+
+    for conns in idle.values():
+      for conn, _ in conns:
+        conn.close()
+
+  def size(self, key=None):
+    """Number of idle connections, for `key' or overall."""
+    self._lock.acquire()
+    try:
+      if key is not None:
+        return len(self._idle.get(key, [ ]))
+      return sum([ len(idle) for idle in self._idle.values() ])
+    finally:
+      self._lock.release()
+
+
+_DEFAULT_POOL = ConnectionPool()
+
+def get_default_pool():
+  """The pool shared by every HttpClient in this process."""
+  return _DEFAULT_POOL
+
+
+class _PooledResponse(httplib.HTTPResponse):
+  """
+  An HTTPResponse that hands its connection back to the pool once the body
+  has been read to the end.
+  """
+  def __init__(self, *args, **kwargs):
+    httplib.HTTPResponse.__init__(self, *args, **kwargs)
+    self._on_done = None
+    self._reading = False
+
+  def read(self, amt=None):
+    self._reading = True
+    try:
+      data = httplib.HTTPResponse.read(self, amt)
+    except:
+      self._reading = False
+      self._finish(reusable=False)
+      raise
+    self._reading = False
+    if self.fp is None:
+      self._finish(reusable=not self.will_close)
+    return data
+
+  def close(self):
+    # httplib closes the response itself when it reaches the end of the body.
+    # Any other close leaves unread data on the wire.
+    eof = self._reading or self.length == 0
+    httplib.HTTPResponse.close(self)
+    if not self._reading:
+      self._finish(reusable=eof and not self.will_close)
+
+  def _finish(self, reusable):
+    on_done, self._on_done = self._on_done, None
+    if on_done is not None:
+      on_done(reusable)
+
+
+class KeepAliveMixin(object):
+  """
+  Replacement for urllib2.AbstractHTTPHandler.do_open that talks HTTP/1.1
+  over pooled connections.
+  """
+  def __init__(self, pool=None):
+    self._pool = pool or get_default_pool()
+
+  def _do_keepalive_open(self, scheme, conn_factory, req):
+    host = req.get_host()
+    if not host:
+      raise urllib2.URLError('no host given')
+    if getattr(req, '_tunnel_host', None):
+      # Proxy tunnels are rare here. Let urllib2 deal with them.
+      return self.do_open(conn_factory, req)
+
+    key = (scheme, host)
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict([ (k, v) for k, v in req.headers.items() if k not in headers ]))
+    headers['Connection'] = 'keep-alive'
+    headers = dict([ (name.title(), val) for name, val in headers.items() ])
+
+    conn = self._pool.get(key)
+    if conn is not None:
+      written = False
+      try:
+        self._request(conn, req, headers)
+        written = True
+        return self._response(key, conn, req)
+      except (socket.error, httplib.HTTPException), ex:
+        conn.close()
+        # The server most likely dropped the idle connection. Try once more
+        # on a brand new one, unless the request may have been acted upon:
+        # it went out and it is not safe to send twice, or the server was
+        # merely slow to answer.
+        if isinstance(ex, socket.timeout) or \
+            (written and req.get_method() not in IDEMPOTENT_METHODS):
+          raise urllib2.URLError(ex)
+        LOG.debug("Reused connection to %s failed (%s). Reconnecting." % (host, ex))
+
+    conn = conn_factory(host, timeout=req.timeout)
+    try:
+      self._request(conn, req, headers)
+      return self._response(key, conn, req)
+    except (socket.error, httplib.HTTPException), ex:
+      conn.close()
+      raise urllib2.URLError(ex)
+
+  def _request(self, conn, req, headers):
+    conn.response_class = _PooledResponse
+    if conn.sock is not None:
+      timeout = req.timeout
+      if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+      conn.sock.settimeout(timeout)
+    conn.request(req.get_method(), req.get_selector(), req.data, headers)
+
+  def _response(self, key, conn, req):
+    resp = conn.getresponse()
+
+    def on_done(reusable):
+      if reusable:
+        self._pool.put(key, conn)
+      else:
+        conn.close()
+    resp._on_done = on_done
+    if resp.length == 0:
+      # No body at all (e.g. HEAD or 204)
+      resp.close()
+
+    # Same wrapping as urllib2.AbstractHTTPHandler.do_open
+    resp.recv = resp.read
+    fp = socket._fileobject(resp, close=True)
+    res = urllib2.addinfourl(fp, resp.msg, req.get_full_url())
+    res.code = resp.status
+    res.msg = resp.reason
+    return res
+
+
+class KeepAliveHandler(KeepAliveMixin, urllib2.HTTPHandler):
+  def __init__(self, pool=None):
+    urllib2.HTTPHandler.__init__(self)
+    KeepAliveMixin.__init__(self, pool)
+
+  def http_open(self, req):
+    return self._do_keepalive_open('http', httplib.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, urllib2.HTTPSHandler):
+  def __init__(self, pool=None):
+    urllib2.HTTPSHandler.__init__(self)
+    KeepAliveMixin.__init__(self, pool)
+
+  def https_open(self, req):
+    return self._do_keepalive_open('https', httplib.HTTPSConnection, req)
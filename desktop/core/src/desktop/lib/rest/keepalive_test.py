@@ -0,0 +1,141 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import urllib2
+
+from nose.tools import assert_equal, assert_raises
+
+from desktop.lib.rest.keepalive import ConnectionPool, KeepAliveHandler
+
+
+class KeepAliveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  connections = 0
+  posts = 0
+
+  def process_request(self, request, client_address):
+    self.connections += 1
+    return SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    code = self.path == '/missing' and 404 or 200
+    body = 'x' * 100
+    self.send_response(code)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_POST(self):
+    self.server.posts += 1
+    # Drop the connection as if the server went away after the request
+    self.close_connection = 1
+
+  def log_message(self, *args):
+    pass
+
+
+class TestKeepAlive(object):
+  def setUp(self):
+    self.server = KeepAliveServer(('localhost', 0), Handler)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.setDaemon(True)
+    self.thread.start()
+    self.url = 'http://localhost:%d' % (self.server.server_address[1],)
+    self.pool = ConnectionPool(max_per_host=2)
+    self.opener = urllib2.build_opener(KeepAliveHandler(self.pool))
+
+  def tearDown(self):
+    self.pool.close_all()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_connection_reused(self):
+    for i in range(5):
+      assert_equal('x' * 100, self.opener.open(self.url + '/data').read())
+    assert_equal(1, self.server.connections)
+    assert_equal(1, self.pool.size())
+
+  def test_error_response_reused(self):
+    try:
+      self.opener.open(self.url + '/missing')
+    except urllib2.HTTPError, ex:
+      assert_equal(404, ex.code)
+      ex.read()
+    self.opener.open(self.url + '/data').read()
+    assert_equal(1, self.server.connections)
+
+  def test_partial_read_not_reused(self):
+    resp = self.opener.open(self.url + '/data')
+    resp.read(10)
+    resp.close()
+    assert_equal(0, self.pool.size())
+
+    self.opener.open(self.url + '/data').read()
+    assert_equal(2, self.server.connections)
+
+  def test_max_per_host(self):
+    responses = [ self.opener.open(self.url + '/data') for i in range(4) ]
+    for resp in responses:
+      resp.read()
+    assert_equal(4, self.server.connections)
+    assert_equal(2, self.pool.size())
+
+  def test_idle_eviction(self):
+    pool = ConnectionPool(idle_timeout=-1)
+    opener = urllib2.build_opener(KeepAliveHandler(pool))
+    opener.open(self.url + '/data').read()
+    opener.open(self.url + '/data').read()
+    assert_equal(2, self.server.connections)
+    pool.evict_idle()
+    assert_equal(0, pool.size())
+
+  def test_idle_eviction_other_hosts(self):
+    pool = ConnectionPool(idle_timeout=-1)
+    opener = urllib2.build_opener(KeepAliveHandler(pool))
+    opener.open(self.url + '/data').read()
+    assert_equal(1, pool.size())
+
+    # Releasing a connection to another host closes the expired ones
+    class FakeConnection(object):
+      def close(self):
+        pass
+    pool.put(('http', 'otherhost:80'), FakeConnection())
+    assert_equal(1, pool.size())
+    assert_equal(1, pool.size(('http', 'otherhost:80')))
+
+  def test_stale_connection_retried(self):
+    self.opener.open(self.url + '/data').read()
+    # Simulate the server closing the idle connection behind our back
+    conn = self.pool.get(('http', 'localhost:%d' % (self.server.server_address[1],)))
+    conn.sock.close()
+    self.pool.put(('http', 'localhost:%d' % (self.server.server_address[1],)), conn)
+
+    assert_equal('x' * 100, self.opener.open(self.url + '/data').read())
+
+  def test_sent_request_not_retried(self):
+    self.opener.open(self.url + '/data').read()
+    assert_raises(urllib2.URLError, self.opener.open, self.url + '/drop', 'data')
+    assert_equal(1, self.server.posts)
+
+  def test_no_host(self):
+    assert_raises(urllib2.URLError, KeepAliveHandler(self.pool).http_open, urllib2.Request('http:///data'))
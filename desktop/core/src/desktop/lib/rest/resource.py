@@ -91,6 +91,17 @@ class Resource(object):
     return self.invoke("GET", relpath, params)
 
 
+  def get_stream(self, relpath=None, params=None):
+    """
+    Invoke the GET method on a resource, without reading the response.
+    @param relpath: Optional. A relative path to this resource's path.
+    @param params: Key-value data.
+
+    @return: A file-like object with the response body. The caller must close it.
+    """
+    return self._client.execute("GET", self._join_uri(relpath), params=params)
+
+
   def delete(self, relpath=None, params=None):
     """
     Invoke the DELETE method on a resource.
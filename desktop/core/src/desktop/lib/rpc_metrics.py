@@ -0,0 +1,170 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight, in-process instrumentation of RPC calls: per-method latency
+histograms, byte counts, and a sample of the most recent slow calls.
+"""
+
+import threading
+import time
+
+# Upper bounds (in ms) of the latency histogram buckets. The last bucket
+# catches everything slower.
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# How many slow calls to remember
+SLOW_CALL_SAMPLES = 50
+
+# Longest argument summary kept in a slow call sample
+MAX_SAMPLE_ARGS_LENGTH = 200
+
+
+class MethodStats(object):
+  """Counters of a single RPC method. Updated under the RpcMetrics lock."""
+  def __init__(self):
+    self.calls = 0
+    self.errors = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.histogram = [ 0 ] * (len(LATENCY_BUCKETS_MS) + 1)
+
+  def record(self, duration_ms, bytes_sent, bytes_received, error):
+    self.calls += 1
+    if error:
+      self.errors += 1
+    self.total_ms += duration_ms
+    self.max_ms = max(self.max_ms, duration_ms)
+    self.bytes_sent += bytes_sent
+    self.bytes_received += bytes_received
+    self.histogram[_bucket(duration_ms)] += 1
+
+  def to_dict(self):
+    buckets = [ str(bound) for bound in LATENCY_BUCKETS_MS ] + [ '+inf' ]
+    return {
+      'calls': self.calls,
+      'errors': self.errors,
+      'total_ms': self.total_ms,
+      'avg_ms': self.calls and self.total_ms / self.calls or 0,
+      'max_ms': self.max_ms,
+      'bytes_sent': self.bytes_sent,
+      'bytes_received': self.bytes_received,
+      'histogram': dict(zip(buckets, self.histogram)),
+    }
+
+
+class RpcMetrics(object):
+  """
+  Thread-safe registry of MethodStats, keyed by (service, method).
+
+  Calls at least `slow_call_ms' long are also kept, most recent first, in a
+  bounded list of samples.
+  """
+  def __init__(self, slow_call_ms=1000, max_samples=SLOW_CALL_SAMPLES):
+    self.slow_call_ms = slow_call_ms
+    self._max_samples = max_samples
+    self._lock = threading.Lock()
+    self._methods = { }
+    self._slow_calls = [ ]
+
+  def record(self, service, method, duration_ms, bytes_sent=0, bytes_received=0,
+             error=None, args_summary=None):
+    """
+    Record one call.
+
+    @param args_summary  A callable returning a description of the call
+                         arguments. Only invoked for slow calls.
+    """
+    sample = None
+    if duration_ms >= self.slow_call_ms:
+      args = ''
+      if args_summary is not None:
+        try:
+          args = args_summary()[:MAX_SAMPLE_ARGS_LENGTH]
+        except Exception, ex:
+          args = '<%s>' % (ex,)
+      sample = {
+        'service': service,
+        'method': method,
+        'time': time.time(),
+        'duration_ms': duration_ms,
+        'bytes_sent': bytes_sent,
+        'bytes_received': bytes_received,
+        'error': error is not None and str(error) or None,
+        'args': args,
+      }
+
+    self._lock.acquire()
+    try:
+      stats = self._methods.get((service, method))
+      if stats is None:
+        stats = self._methods[(service, method)] = MethodStats()
+      stats.record(duration_ms, bytes_sent, bytes_received, error is not None)
+      if sample is not None:
+        self._slow_calls.insert(0, sample)
+        del self._slow_calls[self._max_samples:]
+    finally:
+      self._lock.release()
+
+  def reset(self):
+    self._lock.acquire()
+    try:
+      self._methods.clear()
+      self._slow_calls = [ ]
+    finally:
+      self._lock.release()
+
+  def to_dict(self):
+    """
+    to_dict() -> { 'methods': { "service.method": {...} }, 'slow_calls': [...] }
+    """
+    self._lock.acquire()
+    try:
+      methods = dict([ ('%s.%s' % key, stats.to_dict()) for key, stats in self._methods.iteritems() ])
+      return {
+        'slow_call_ms': self.slow_call_ms,
+        'methods': methods,
+        'slow_calls': list(self._slow_calls),
+      }
+    finally:
+      self._lock.release()
+
+
+def _bucket(duration_ms):
+  for i, bound in enumerate(LATENCY_BUCKETS_MS):
+    if duration_ms <= bound:
+      return i
+  return len(LATENCY_BUCKETS_MS)
+
+
+class LazyRepr(object):
+  """
+  Defers repr() of `obj' until the string is needed, e.g. by a logging call
+  whose level is enabled. The result is truncated to `limit' characters.
+  """
+  def __init__(self, obj, limit=1000):
+    self.obj = obj
+    self.limit = limit
+
+  def __str__(self):
+    res = repr(self.obj)
+    if len(res) > self.limit:
+      res = res[:self.limit] + "..."
+    return res
+
+  __repr__ = __str__
@@ -0,0 +1,63 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal, assert_true
+
+from desktop.lib.rpc_metrics import LazyRepr, RpcMetrics
+
+
+def test_record():
+  metrics = RpcMetrics(slow_call_ms=100)
+  metrics.record('Svc', 'ping', 3, bytes_sent=10, bytes_received=20)
+  metrics.record('Svc', 'ping', 7, bytes_sent=10, bytes_received=20, error=IOError('boom'))
+  stats = metrics.to_dict()['methods']['Svc.ping']
+  assert_equal(2, stats['calls'])
+  assert_equal(1, stats['errors'])
+  assert_equal(5, stats['avg_ms'])
+  assert_equal(7, stats['max_ms'])
+  assert_equal(20, stats['bytes_sent'])
+  assert_equal(40, stats['bytes_received'])
+  assert_equal(1, stats['histogram']['5'])
+  assert_equal(1, stats['histogram']['10'])
+  assert_equal([ ], metrics.to_dict()['slow_calls'])
+
+
+def test_slow_call_samples():
+  calls = [ ]
+  def summary():
+    calls.append(1)
+    return 'x' * 1000
+
+  metrics = RpcMetrics(slow_call_ms=100, max_samples=2)
+  metrics.record('Svc', 'fast', 1, args_summary=summary)
+  assert_equal([ ], calls)
+  for i in range(3):
+    metrics.record('Svc', 'slow%d' % i, 200 + i, args_summary=summary)
+  samples = metrics.to_dict()['slow_calls']
+  assert_equal(['slow2', 'slow1'], [ sample['method'] for sample in samples ])
+  assert_true(len(samples[0]['args']) < 1000)
+  assert_equal(1, metrics.to_dict()['methods']['Svc.slow0']['histogram']['250'])
+
+  metrics.reset()
+  assert_equal({ }, metrics.to_dict()['methods'])
+
+
+def test_lazy_repr():
+  class Expensive(object):
+    def __repr__(self):
+      raise AssertionError("Should not be formatted")
+  LazyRepr(Expensive())
+  assert_equal("'aa...", str(LazyRepr('a' * 10, limit=3)))
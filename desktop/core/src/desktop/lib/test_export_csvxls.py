@@ -16,9 +16,23 @@
 # limitations under the License.
 
 import cStringIO
-from desktop.lib.export_csvxls import make_response
+import gzip
+import zipfile
+
+from xml.etree import ElementTree
+
+from desktop.lib import export_csvxls
+from desktop.lib.export_csvxls import make_response, CSVformatter
 from nose.tools import assert_true, assert_equal, assert_false
 
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def _sheet_values(workbook):
+  sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+  return [ [ cell.findtext('%sis/%st' % (SHEET_NS, SHEET_NS)) or cell.findtext(SHEET_NS + 'v') or ''
+             for cell in row ]
+           for row in sheet.getiterator(SHEET_NS + 'row') ]
+
 def test_export_csvxls():
   header = ["x", "y"]
   data = [ ["1", "2"], ["3", "4"] ]
@@ -30,8 +44,75 @@ def test_export_csvxls():
   assert_equal("attachment; filename=foo.csv", response["content-disposition"])
 
   # Check XLS
-  # Should be same as CSV
+  # Should be a real XLSX workbook
   response = make_response(header, data, "xls", "bar")
-  assert_equal("application/xls", response["content-type"])
-  assert_equal("attachment; filename=bar.xls", response["content-disposition"])
-  assert_equal('"x","y"\r\n"1","2"\r\n"3","4"\r\n', response.content)
+  assert_equal(export_csvxls.XLSX_MIMETYPE, response["content-type"])
+  assert_equal("attachment; filename=bar.xlsx", response["content-disposition"])
+  workbook = zipfile.ZipFile(cStringIO.StringIO(response.content))
+  assert_equal(None, workbook.testzip())
+  assert_true('<sheet name="Sheet1" sheetId="1" r:id="rId1"/>' in workbook.read('xl/workbook.xml'))
+  assert_equal([ ['x', 'y'], ['1', '2'], ['3', '4'] ], _sheet_values(workbook))
+
+  # Check TSV
+  response = make_response(header, data, "tsv", "baz")
+  assert_equal("attachment; filename=baz.tsv", response["content-disposition"])
+  assert_equal('x\ty\n1\t2\n3\t4\n', response.content)
+
+  # Check gzip
+  response = make_response(header, data, "csv", "foo", compress=True)
+  assert_equal("application/x-gzip", response["content-type"])
+  assert_equal("attachment; filename=foo.csv.gz", response["content-disposition"])
+  assert_equal('"x","y"\r\n"1","2"\r\n"3","4"\r\n',
+               gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
+
+def test_csv_format_rows():
+  formatter = CSVformatter(encoding='utf-8')
+  rows = [ [1, u'\u00e9t\u00e9', 'a"b', None, 2.5], [2, u'x', 'y', True, 0] ]
+  expected = ''.join([ formatter.format_row(row) for row in rows ])
+  assert_equal('"1","\xc3\xa9t\xc3\xa9","a""b","","2.5"\r\n"2","x","y","True","0"\r\n', expected)
+  assert_equal(expected, ''.join(formatter.format_rows(rows)))
+
+  # Mixed and ragged columns
+  rows = [ [u'\u00e9', 1], ['b', 2, 3], [None] ]
+  assert_equal(''.join([ formatter.format_row(row) for row in rows ]), ''.join(formatter.format_rows(rows)))
+  rows = [ [u'\u00e9', 1], ['b', None] ]
+  assert_equal(''.join([ formatter.format_row(row) for row in rows ]), ''.join(formatter.format_rows(rows)))
+
+  # Other encodings
+  formatter = CSVformatter(encoding='latin-1', delimiter='\t')
+  assert_equal('"\xe9"\t"\xe9"\r\n', ''.join(formatter.format_rows([ [u'\u00e9', '\xc3\xa9'] ])))
+
+  # Output is chunked
+  prev = export_csvxls.CHUNK_SIZE
+  try:
+    export_csvxls.CHUNK_SIZE = 10
+    chunks = list(CSVformatter().format_rows([ [i] for i in range(3 * export_csvxls.BATCH_ROWS) ]))
+    assert_equal(3, len(chunks))
+  finally:
+    export_csvxls.CHUNK_SIZE = prev
+
+def test_xlsx_format():
+  formatter = export_csvxls.XLSXformatter(row_limit=4)
+  rows = [ [1, 2.5, u'\u00e9<&>', None, True, 10 ** 20, 'a\x01b'] ] * 5
+  data = [ formatter.init_doc(), formatter.format_header(['a', 'b', 'c', 'd', 'e', 'f', 'g']) ]
+  try:
+    for chunk in formatter.format_rows(rows):
+      data.append(chunk)
+    assert_true(False)
+  except export_csvxls.TooBigToDownloadException:
+    pass
+  data.append(formatter.fini_doc())
+
+  workbook = zipfile.ZipFile(cStringIO.StringIO(''.join(data)))
+  assert_equal(None, workbook.testzip())
+  values = _sheet_values(workbook)
+  # Capped at 4 rows, including the header
+  assert_equal(4, len(values))
+  assert_equal([ '1', '2.5', u'\u00e9<&>', '', '1', '100000000000000000000', 'ab' ], values[1])
+  sheet = workbook.read('xl/worksheets/sheet1.xml')
+  assert_true('<c><v>1</v></c><c><v>2.5</v></c><c t="inlineStr">' in sheet, sheet)
+
+def test_tsv_format():
+  formatter = export_csvxls.TSVformatter(encoding='utf-8')
+  assert_equal('1\t\\N\ta\\tb\\nc\\\\\t\xc3\xa9\t0.1\n',
+               ''.join(formatter.format_rows([ [1, None, 'a\tb\nc\\', u'\u00e9', 0.1] ])))
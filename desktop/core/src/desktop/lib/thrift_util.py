@@ -17,7 +17,6 @@
 #
 # Utilities for Thrift
 
-import Queue
 import logging
 import select
 import socket
@@ -33,6 +32,7 @@ from thrift.transport.TTransport import TBufferedTransport, TMemoryBuffer,\
 from thrift.protocol.TBinaryProtocol import TBinaryProtocol
 from desktop.lib.thrift_sasl import TSaslClientTransport
 from desktop.lib.exceptions import StructuredException, StructuredThriftTransportException
+from desktop.lib.rpc_metrics import LazyRepr, RpcMetrics
 
 # The maximum depth that we will recurse through a "jsonable" structure
 # while converting to thrift. This prevents us from infinite recursion
@@ -44,26 +44,15 @@ MAX_RECURSION_DEPTH = 50
 WARN_LEVEL_CALL_DURATION_MS = 5000
 INFO_LEVEL_CALL_DURATION_MS = 1000
 
-class LifoQueue(Queue.Queue):
-    '''
-    Variant of Queue that retrieves most recently added entries first.
+# Latency, byte counts and slow call samples of every thrift call
+_rpc_metrics = RpcMetrics(slow_call_ms=INFO_LEVEL_CALL_DURATION_MS)
 
-    This LIFO Queue is included in python2.7 (or 2.6) and later,
-    but it's a simple subclass, so we "backport" it here.
-    '''
+def get_rpc_metrics():
+  """Per-method statistics of the thrift calls made by this process."""
+  return _rpc_metrics.to_dict()
 
-    def _init(self, maxsize):
-        self.queue = []
-        self.maxsize = maxsize
-
-    def _qsize(self, len=len):
-        return len(self.queue)
-
-    def _put(self, item):
-        self.queue.append(item)
-
-    def _get(self):
-        return self.queue.pop()
+def reset_rpc_metrics():
+  _rpc_metrics.reset()
 
 class ConnectionConfig(object):
   """ Struct-like class encapsulating the configuration of a Thrift client. """
@@ -91,6 +80,211 @@ class ConnectionConfig(object):
     self.timeout_seconds = timeout_seconds
 
 
+# Pooled clients that have not been used for this many seconds are closed
+POOL_IDLE_TIMEOUT_SECONDS = 300
+# How often the background checker looks at idle pooled clients
+POOL_CHECK_INTERVAL_SECONDS = 10
+
+
+class _ClientPool(object):
+  """
+  The clients of a single endpoint.
+
+  Clients are created lazily, up to `maxsize'. Callers that find the pool
+  exhausted queue up and are served in FIFO order: a returned client is
+  handed directly to the oldest waiter. When creating a client fails, the
+  oldest waiter gets to try in its place.
+  """
+  def __init__(self, conf, maxsize):
+    self.conf = conf
+    self.maxsize = maxsize
+    self._lock = threading.Lock()
+    self._idle = [ ]              # [ (client, returned_at) ], most recent last
+    self._waiters = [ ]           # [ _Waiter ], oldest first
+    self._size = 0                # Clients in existence, idle or checked out
+
+    self.checkouts = 0
+    self.creates = 0
+    self.waits = 0
+    self.wait_time = 0.0
+    self.max_wait_time = 0.0
+    self.timeouts = 0
+    self.failures = 0
+    self.evictions = 0
+
+  def get(self, timeout=None):
+    self._lock.acquire()
+    try:
+      self.checkouts += 1
+      if self._idle:
+        return self._idle.pop()[0]
+      if self._size < self.maxsize:
+        self._size += 1
+        self.creates += 1
+        cid = self.creates
+        waiter = None
+      else:
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        self.waits += 1
+    finally:
+      self._lock.release()
+
+    if waiter is not None:
+      client = self._wait(waiter, timeout)
+      if client is not None:
+        return client
+      cid = waiter.cid
+    return self._create(cid)
+
+  def _create(self, cid):
+    """Create a client, in a slot already counted in `_size'."""
+    try:
+      client = construct_superclient(self.conf)
+    except:
+      self._lock.acquire()
+      try:
+        self.failures += 1
+        if self._waiters:
+          # Hand the slot over, or the waiters would wait for a put() that
+          # may never come
+          waiter = self._waiters.pop(0)
+          self.creates += 1
+          waiter.cid = self.creates
+          waiter.event.set()
+        else:
+          self._size -= 1
+      finally:
+        self._lock.release()
+      raise
+    client.CID = cid
+    return client
+
+  def _wait(self, waiter, timeout):
+    """
+    Wait for a returned client, or for the right to create one (returns None).
+    """
+    start = time.time()
+    while True:
+      if timeout is not None:
+        this_round_timeout = max(min(timeout - (time.time() - start), 1), 0)
+      else:
+        this_round_timeout = 1
+      waiter.event.wait(this_round_timeout)
+      waited = time.time() - start
+
+      self._lock.acquire()
+      try:
+        served = waiter.client is not None or waiter.cid is not None
+        if served or (timeout is not None and waited >= timeout):
+          self.wait_time += waited
+          self.max_wait_time = max(self.max_wait_time, waited)
+          if served:
+            return waiter.client
+          self._waiters.remove(waiter)
+          self.timeouts += 1
+          raise socket.timeout(
+            ("Timed out after %.2f seconds waiting to retrieve a " +
+             "%s client from the pool.") % (waited, self.conf.service_name))
+      finally:
+        self._lock.release()
+
+      if int(waited) % 10 == 0:
+        logging.warn("Waited %d seconds for a thrift client to %s:%d" %
+                     (waited, self.conf.host, self.conf.port))
+
+  def put(self, client):
+    self._lock.acquire()
+    try:
+      if self._waiters:
+        waiter = self._waiters.pop(0)
+        waiter.client = client
+        waiter.event.set()
+      else:
+        self._idle.append((client, time.time()))
+    finally:
+      self._lock.release()
+
+  def record_failure(self):
+    self._lock.acquire()
+    try:
+      self.failures += 1
+    finally:
+      self._lock.release()
+
+  def check_idle(self, idle_timeout):
+    """
+    Close the clients idle for longer than `idle_timeout' seconds, and
+    reset the connections of the others that went stale.
+    """
+    now = time.time()
+    self._lock.acquire()
+    try:
+      expired = [ client for client, returned_at in self._idle if now - returned_at > idle_timeout ]
+      self._idle = [ (client, returned_at) for client, returned_at in self._idle if now - returned_at <= idle_timeout ]
+      self._size -= len(expired)
+      self.evictions += len(expired)
+      # Checked while holding the lock, so that nobody picks them up meanwhile
+      for client, _ in self._idle:
+        _reset_if_stale(client)
+    finally:
+      self._lock.release()
+
+    for client in expired:
+      try:
+        client.transport.close()
+      except Exception, ex:
+        logging.debug("Failed to close idle thrift client: %s" % (ex,))
+
+  def metrics(self):
+    self._lock.acquire()
+    try:
+      return {
+        'service': self.conf.service_name,
+        'size': self._size,
+        'max_size': self.maxsize,
+        'idle': len(self._idle),
+        'waiting': len(self._waiters),
+        'checkouts': self.checkouts,
+        'creates': self.creates,
+        'waits': self.waits,
+        'wait_time': self.wait_time,
+        'max_wait_time': self.max_wait_time,
+        'timeouts': self.timeouts,
+        'failures': self.failures,
+        'evictions': self.evictions,
+      }
+    finally:
+      self._lock.release()
+
+
+class _Waiter(object):
+  def __init__(self):
+    self.event = threading.Event()
+    self.client = None
+    # Set instead of `client' when the waiter is to create its own
+    self.cid = None
+
+
+def _reset_if_stale(client):
+  """
+  Poke an idle client's socket to see if it's closed on the other end. This can
+  happen if a connection sits in the pool longer than the read timeout of the server.
+  """
+  try:
+    sock = _grab_transport_from_wrapper(client.transport).handle
+    if sock:
+      rlist, wlist, xlist = select.select([sock], [], [], 0)
+      if rlist:
+        # The socket is readable, meaning there is either data from a previous call
+        # (i.e our protocol is out of sync), or the connection was shut down on the
+        # remote side. Either way, the connection is reopened on the next call.
+        client.transport.close()
+  except Exception, ex:
+    logging.debug("Failed to check idle thrift client: %s" % (ex,))
+    client.transport.close()
+
+
 class ConnectionPooler(object):
   """
   Thread-safe connection pooling for thrift. (With about 3 changes,
@@ -103,15 +297,40 @@ class ConnectionPooler(object):
   A connection is a 'SuperClient', which deals with timeout errors
   automatically so we don't have to worry about refreshing a stale pool.
 
-  We could be fancier here - we could reclaim clients ourselves without
-  relying on them to be returned but that would increase complexity. The
-  benefit would be not having to hit the connection pool on every client call.
+  Connections are only created when needed, up to `poolsize' per pool. A
+  background thread closes the ones that have been idle for too long, and
+  resets the ones whose server went away, instead of checking on every call.
   """
 
-  def __init__(self, poolsize=10):
+  def __init__(self, poolsize=10,
+               idle_timeout=POOL_IDLE_TIMEOUT_SECONDS,
+               check_interval=POOL_CHECK_INTERVAL_SECONDS):
     self.pooldict = {}
     self.poolsize = poolsize
+    self.idle_timeout = idle_timeout
+    self.check_interval = check_interval
     self.dictlock = threading.Lock()
+    self._checker = None
+    self._closed = threading.Event()
+
+  def _get_pool(self, conf):
+    key = _get_pool_key(conf)
+    pool = self.pooldict.get(key)
+    if pool is None:
+      self.dictlock.acquire()
+      try:
+        pool = self.pooldict.get(key)
+        if pool is None:
+          pool = _ClientPool(conf, self.poolsize)
+          self.pooldict[key] = pool
+        if self._checker is None:
+          self._closed.clear()
+          self._checker = threading.Thread(target=self._check_loop, name="thrift-pool-checker")
+          self._checker.setDaemon(True)
+          self._checker.start()
+      finally:
+        self.dictlock.release()
+    return pool
 
   def get_client(self, conf,
                  get_client_timeout=None):
@@ -121,56 +340,7 @@ class ConnectionPooler(object):
     @param get_client_timeout: how long (in seconds) to wait on the pool
                                to get a client before failing
     """
-    # First up, check to see if we have a pool for this endpoint
-    if _get_pool_key(conf) not in self.pooldict:
-      # Uh-oh, we need to initialise the queue. Take the dict lock.
-      # Note that this is 'double-checked locking'.
-
-      # The reason this pattern doesn't work in Java is that the write to the dict
-      # may get issued before the construction of the Queue due to new Queue(..) not
-      # being atomic. However in Python this becomes CALL_FUNCTION and STORE_FAST,
-      # therefore as long as a) the function doesn't get inlined b) Python's bytecode
-      # generator doesn't move the write to q before the function completes there's no
-      # way for another thread to observe a partially constructed queue.
-
-      # I haven't found a reference for the Python memory model, so I'm leaving this comment
-      # here in case unladen-swallow or something breaks this assumption of correctness.
-
-      self.dictlock.acquire()
-      try:
-        if _get_pool_key(conf) not in self.pooldict:
-          q = LifoQueue(self.poolsize)
-          self.pooldict[_get_pool_key(conf)] = q
-          for i in xrange(self.poolsize):
-            client = construct_superclient(conf)
-            client.CID = i
-            q.put(client, False)
-      finally:
-        self.dictlock.release()
-
-    connection = None
-
-    start_pool_get_time = time.time()
-    has_waited_for = 0
-    while connection is None:
-      if get_client_timeout is not None:
-        this_round_timeout = max(min(get_client_timeout - has_waited_for, 1), 0)
-      else:
-        this_round_timeout = None
-
-      try:
-        connection = self.pooldict[_get_pool_key(conf)].get(
-          block=True, timeout=this_round_timeout)
-      except Queue.Empty:
-        has_waited_for = time.time() - start_pool_get_time
-        if get_client_timeout is not None and has_waited_for > get_client_timeout:
-          raise socket.timeout(
-            ("Timed out after %.2f seconds waiting to retrieve a " +
-             "%s client from the pool.") % (has_waited_for, conf.service_name))
-        logging.warn("Waited %d seconds for a thrift client to %s:%d" %
-          (has_waited_for, conf.host, conf.port))
-
-    return connection
+    return self._get_pool(conf).get(get_client_timeout)
 
   def return_client(self, conf, client):
     """
@@ -178,7 +348,51 @@ class ConnectionPooler(object):
     pass back a client that was not retrieved from a pool, and
     you might well get an exception for doing so.
     """
-    self.pooldict[_get_pool_key(conf)].put(client)
+    self._get_pool(conf).put(client)
+
+  def record_failure(self, conf):
+    self._get_pool(conf).record_failure()
+
+  def metrics(self):
+    """
+    metrics() -> { "host:port": { counter: value } }
+
+    Counters of every pool, e.g. for an admin page.
+    """
+    res = { }
+    for (klass, host, port), pool in self.pooldict.items():
+      res['%s %s:%s' % (klass.__module__, host, port)] = pool.metrics()
+    return res
+
+  def close(self):
+    """
+    Stop the background checker and close the idle clients. The pooler
+    can still be used afterwards; e.g. the tests call this at the end so
+    that no thread is left behind. The pools are kept, as they still count
+    the clients checked out.
+    """
+    self.dictlock.acquire()
+    try:
+      checker, self._checker = self._checker, None
+      pools = self.pooldict.values()
+    finally:
+      self.dictlock.release()
+    if checker is not None:
+      self._closed.set()
+      checker.join()
+    for pool in pools:
+      pool.check_idle(-1)
+
+  def _check_loop(self):
+    while True:
+      self._closed.wait(self.check_interval)
+      if self._closed.isSet():
+        return
+      for pool in self.pooldict.values():
+        try:
+          pool.check_idle(self.idle_timeout)
+        except Exception, ex:
+          logging.exception("Failed to check thrift pool %s: %s" % (pool.conf.service_name, ex))
 
 def _get_pool_key(conf):
    """
@@ -195,6 +409,23 @@ def construct_superclient(conf):
   return SuperClient(service, transport, timeout_seconds=conf.timeout_seconds)
 
 
+class CountingSocket(TSocket):
+  """A TSocket that counts the bytes going through it, for the RPC metrics."""
+  def __init__(self, *args, **kwargs):
+    TSocket.__init__(self, *args, **kwargs)
+    self.bytes_read = 0
+    self.bytes_written = 0
+
+  def read(self, sz):
+    buff = TSocket.read(self, sz)
+    self.bytes_read += len(buff)
+    return buff
+
+  def write(self, buff):
+    TSocket.write(self, buff)
+    self.bytes_written += len(buff)
+
+
 def connect_to_thrift(conf):
   """
   Connect to a thrift endpoint as determined by the 'conf' parameter.
@@ -202,7 +433,7 @@ def connect_to_thrift(conf):
 
   Returns a tuple of (service, protocol, transport)
   """
-  sock = TSocket(conf.host, conf.port)
+  sock = CountingSocket(conf.host, conf.port)
   if conf.timeout_seconds:
     # Thrift trivia: You can do this after the fact with
     # _grab_transport_from_wrapper(self.wrapped.transport).setTimeout(seconds*1000)
@@ -226,6 +457,13 @@ def connect_to_thrift(conf):
 
 _connection_pool = ConnectionPooler()
 
+def get_pool_metrics():
+  """Counters of the thrift connection pools of this process."""
+  return _connection_pool.metrics()
+
+def close_connection_pools():
+  _connection_pool.close()
+
 def get_client(klass, host, port, service_name, **kwargs):
   conf = ConnectionConfig(klass, host, port, service_name, **kwargs)
   return PooledClient(conf)
@@ -263,33 +501,23 @@ class PooledClient(object):
       def wrapper(*args, **kwargs):
         try:
           try:
-            # Poke it to see if it's closed on the other end. This can happen if a connection
-            # sits in the connection pool longer than the read timeout of the server.
-            sock = _grab_transport_from_wrapper(superclient.transport).handle
-            if sock:
-              rlist,wlist,xlist = select.select([sock], [], [], 0)
-              if rlist:
-                # the socket is readable, meaning there is either data from a previous call
-                # (i.e our protocol is out of sync), or the connection was shut down on the
-                # remote side. Either way, we need to reopen the connection.
-                # If the socket was closed remotely, btw, socket.read() will return
-                # an empty string.  This is a fairly normal condition, btw, since
-                # there are timeouts on both the server and client sides.
-                superclient.transport.close()
-                superclient.transport.open()
-
+            # Stale connections are reset by the pool's background checker.
+            # Any that slipped through is reopened by the SuperClient retries.
             superclient.set_timeout(self.conf.timeout_seconds)
             ret = res(*args, **kwargs)
             return ret
           except TApplicationException, e:
             # Unknown thrift exception... typically IO errors
             logging.info("Thrift saw an application exception: " + str(e), exc_info=False)
+            _connection_pool.record_failure(self.conf)
             raise StructuredException('THRIFTAPPLICATION', str(e), data=None, error_code=502)
           except socket.error, e:
             logging.info("Thrift saw a socket error: " + str(e), exc_info=False)
+            _connection_pool.record_failure(self.conf)
             raise StructuredException('THRIFTSOCKET', str(e), data=None, error_code=502)
           except TTransportException, e:
             logging.info("Thrift saw a transport exception: " + str(e), exc_info=False)
+            _connection_pool.record_failure(self.conf)
             raise StructuredThriftTransportException(e, error_code=502)
           except Exception, e:
             # Stack tends to be only noisy here.
@@ -329,27 +557,7 @@ class SuperClient(object):
         try:
           if not self.transport.isOpen():
             self.transport.open()
-          st = time.time()
-          logging.debug("Thrift call: %s.%s(args=%s, kwargs=%s)"
-            % (str(self.wrapped.__class__), attr, repr(args), repr(kwargs)))
-          ret = res(*args, **kwargs)
-          log_msg = repr(ret)
-          if len(log_msg) > 1000:
-            log_msg = log_msg[0:1000] + "..."
-          duration = time.time() - st
-
-          # Log the duration at different levels, depending on how long
-          # it took.
-          logmsg = "Thrift call %s.%s returned in %dms: %s" % (
-            str(self.wrapped.__class__), attr, duration*1000, log_msg)
-          if duration >= WARN_LEVEL_CALL_DURATION_MS:
-            logging.warn(logmsg)
-          elif duration >= INFO_LEVEL_CALL_DURATION_MS:
-            logging.info(logmsg)
-          else:
-            logging.debug(logmsg)
-
-          return ret
+          return self._call_with_metrics(attr, res, args, kwargs)
         except socket.error, e:
           pass
         except TTransportException, e:
@@ -370,6 +578,40 @@ class SuperClient(object):
       raise
     return wrapper
 
+  def _call_with_metrics(self, attr, method, args, kwargs):
+    """Make the call, log its duration, and record it in the RPC metrics."""
+    service = self.wrapped.__class__.__module__
+    sock = _grab_transport_from_wrapper(self.transport)
+    sent, received = getattr(sock, 'bytes_written', 0), getattr(sock, 'bytes_read', 0)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug("Thrift call: %s.%s(args=%s, kwargs=%s)", service, attr, LazyRepr(args), LazyRepr(kwargs))
+
+    def record(error=None):
+      duration_ms = (time.time() - st) * 1000
+      _rpc_metrics.record(service, attr, duration_ms,
+                          getattr(sock, 'bytes_written', 0) - sent,
+                          getattr(sock, 'bytes_read', 0) - received,
+                          error, args_summary=lambda: repr(args))
+      return duration_ms
+
+    st = time.time()
+    try:
+      ret = method(*args, **kwargs)
+    except Exception, ex:
+      record(ex)
+      raise
+    duration_ms = record()
+
+    # Log the duration at different levels, depending on how long it took.
+    # The result is only formatted when debug logging is on.
+    if duration_ms >= WARN_LEVEL_CALL_DURATION_MS:
+      logging.warn("Thrift call %s.%s returned in %dms", service, attr, duration_ms)
+    elif duration_ms >= INFO_LEVEL_CALL_DURATION_MS:
+      logging.info("Thrift call %s.%s returned in %dms", service, attr, duration_ms)
+    elif logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug("Thrift call %s.%s returned in %dms: %s", service, attr, duration_ms, LazyRepr(ret))
+    return ret
+
   def set_timeout(self, timeout_seconds):
     if timeout_seconds != self.timeout_seconds:
       self.timeout_seconds = timeout_seconds
@@ -38,7 +38,7 @@ from thrift.server import TServer
 from thrift.transport import TSocket
 from thrift.transport.TTransport import TBufferedTransportFactory
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_false, assert_raises, assert_true
 
 
 class SimpleThriftServer(object):
@@ -128,6 +128,15 @@ class TestWithThriftServer(object):
   def test_basic_operation(self):
     assert_equal(10, self.client.ping(5))
 
+  def test_rpc_metrics(self):
+    thrift_util.reset_rpc_metrics()
+    assert_equal(10, self.client.ping(5))
+    stats = thrift_util.get_rpc_metrics()['methods'].values()
+    assert_equal(1, len(stats))
+    assert_equal(1, stats[0]['calls'])
+    assert_true(stats[0]['bytes_sent'] > 0)
+    assert_true(stats[0]['bytes_received'] > 0)
+
   def test_connection_race(self):
     class Racer(threading.Thread):
       def __init__(self, client, n_iter, begin):
@@ -154,6 +163,110 @@ class TestWithThriftServer(object):
       racer.join()
       assert_equal(0, len(racer.errors))
 
+  def setUp(self):
+    self.poolers = [ ]
+    self.conf = thrift_util.ConnectionConfig(TestService.Client, '127.0.0.1', self.server.port,
+                                             'Hue Unit Test Client', timeout_seconds=1)
+
+  def tearDown(self):
+    # Stops their checker threads
+    for pooler in self.poolers:
+      pooler.close()
+
+  def _make_pooler(self, **kwargs):
+    pooler = thrift_util.ConnectionPooler(**kwargs)
+    self.poolers.append(pooler)
+    return pooler
+
+  def test_pool_lazy_growth_and_fifo(self):
+    pooler = self._make_pooler(poolsize=2)
+    conf = self.conf
+    first = pooler.get_client(conf)
+    assert_equal(1, pooler.metrics().values()[0]['size'])
+    second = pooler.get_client(conf)
+    assert_raises(socket.timeout, pooler.get_client, conf, get_client_timeout=0.1)
+
+    # Waiters are served in the order they arrived
+    served = [ ]
+    def take(name):
+      served.append((name, pooler.get_client(conf, get_client_timeout=5)))
+    waiters = [ ]
+    for name in ('a', 'b'):
+      waiter = threading.Thread(target=take, args=(name,))
+      waiter.start()
+      waiters.append(waiter)
+      while pooler.metrics().values()[0]['waiting'] < len(waiters):
+        time.sleep(0.01)
+    pooler.return_client(conf, first)
+    pooler.return_client(conf, second)
+    for waiter in waiters:
+      waiter.join()
+    assert_equal({'a': first, 'b': second}, dict(served))
+
+    metrics = pooler.metrics().values()[0]
+    assert_equal(2, metrics['size'])
+    assert_equal(2, metrics['creates'])
+    assert_equal(5, metrics['checkouts'])
+    assert_equal(1, metrics['timeouts'])
+
+  def test_pool_idle_eviction(self):
+    pooler = self._make_pooler(poolsize=2, idle_timeout=-1)
+    conf = self.conf
+    client = pooler.get_client(conf)
+    assert_equal(10, client.ping(5))
+    pooler.return_client(conf, client)
+    pooler.pooldict.values()[0].check_idle(pooler.idle_timeout)
+    metrics = pooler.metrics().values()[0]
+    assert_equal(0, metrics['size'])
+    assert_equal(1, metrics['evictions'])
+    assert_false(client.transport.isOpen())
+
+  def test_pool_failed_create_serves_waiter(self):
+    pooler = self._make_pooler(poolsize=1)
+    conf = self.conf
+    failing = threading.Event()
+    construct_superclient = thrift_util.construct_superclient
+    def construct(conf):
+      if not failing.isSet():
+        failing.set()
+        # Let the other caller queue up before failing
+        while not pooler.metrics().values()[0]['waiting']:
+          time.sleep(0.01)
+        raise socket.error("Connection refused")
+      return construct_superclient(conf)
+
+    served = [ ]
+    def take():
+      served.append(pooler.get_client(conf))
+    thrift_util.construct_superclient = construct
+    try:
+      waiter = threading.Thread(target=take)
+      def start_waiter():
+        failing.wait()
+        waiter.start()
+      threading.Thread(target=start_waiter).start()
+      assert_raises(socket.error, pooler.get_client, conf)
+      # Without a timeout, and although nothing was returned to the pool
+      waiter.join(5)
+      assert_false(waiter.isAlive())
+    finally:
+      thrift_util.construct_superclient = construct_superclient
+
+    assert_equal(1, len(served))
+    metrics = pooler.metrics().values()[0]
+    assert_equal(1, metrics['size'])
+    assert_equal(1, metrics['failures'])
+
+  def test_pool_close_keeps_checked_out_clients(self):
+    pooler = self._make_pooler(poolsize=1)
+    conf = self.conf
+    client = pooler.get_client(conf)
+    pooler.close()
+    pooler.return_client(conf, client)
+    metrics = pooler.metrics().values()[0]
+    assert_equal(1, metrics['size'])
+    assert_equal(1, metrics['idle'])
+
 class ThriftUtilTest(unittest.TestCase):
   def test_simpler_string(self):
     struct = TestStruct()
@@ -0,0 +1,124 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A small in-process cache with LRU eviction and per-entry expiry.
+"""
+
+import threading
+import time
+
+
+class TTLCache(object):
+  """
+  Thread-safe, size-bounded mapping whose entries expire `ttl' seconds after
+  they were stored. When full, the least recently used entry is dropped.
+
+  A `ttl' of 0 (or less) disables the cache: nothing is ever stored.
+  """
+  def __init__(self, maxsize=1000, ttl=60):
+    self._maxsize = maxsize
+    self._ttl = ttl
+    self._lock = threading.Lock()
+    self._data = { }          # key -> (value, expires_at, last_access)
+    self._clock = 0
+
+  @property
+  def enabled(self):
+    return self._ttl > 0 and self._maxsize > 0
+
+  @property
+  def ttl(self):
+    return self._ttl
+
+  def get(self, key, default=None):
+    """get(key, default=None) -> The cached value, or `default' if missing or expired."""
+    if not self.enabled:
+      return default
+    self._lock.acquire()
+    try:
+      entry = self._data.get(key)
+      if entry is None:
+        return default
+      value, expires_at, _ = entry
+      if expires_at < time.time():
+        del self._data[key]
+        return default
+      self._clock += 1
+      self._data[key] = (value, expires_at, self._clock)
+      return value
+    finally:
+      self._lock.release()
+
+  def put(self, key, value, ttl=None):
+    """Store `value', optionally with a `ttl' other than the cache default."""
+    if not self.enabled:
+      return
+    if ttl is None:
+      ttl = self._ttl
+    self._lock.acquire()
+    try:
+      if key not in self._data and len(self._data) >= self._maxsize:
+        self._evict()
+      self._clock += 1
+      self._data[key] = (value, time.time() + ttl, self._clock)
+    finally:
+      self._lock.release()
+
+  def put_many(self, items):
+    """Store several (key, value) pairs at once."""
+    for key, value in items:
+      self.put(key, value)
+
+  def invalidate(self, key):
+    self._lock.acquire()
+    try:
+      self._data.pop(key, None)
+    finally:
+      self._lock.release()
+
+  def invalidate_if(self, predicate):
+    """Drop every entry whose key satisfies `predicate(key)'."""
+    self._lock.acquire()
+    try:
+      for key in [ k for k in self._data.keys() if predicate(k) ]:
+        del self._data[key]
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._data.clear()
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._data)
+
+  def _evict(self):
+    """Make room for one entry. Caller holds the lock."""
+    now = time.time()
+    expired = [ k for k, (_, expires_at, _) in self._data.iteritems() if expires_at < now ]
+    if expired:
+      for key in expired:
+        del self._data[key]
+      return
+    # Drop the oldest tenth in one go, so that a full cache does not pay a
+    # scan on every insert.
+    by_access = sorted(self._data.iteritems(), key=lambda item: item[1][2])
+    for key, _ in by_access[:max(1, len(by_access) / 10)]:
+      del self._data[key]
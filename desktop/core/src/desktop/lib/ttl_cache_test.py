@@ -0,0 +1,64 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal, assert_false, assert_true
+
+from desktop.lib.ttl_cache import TTLCache
+
+
+def test_get_put():
+  cache = TTLCache(maxsize=10, ttl=60)
+  assert_equal(None, cache.get('a'))
+  assert_equal('default', cache.get('a', 'default'))
+  cache.put('a', 1)
+  assert_equal(1, cache.get('a'))
+  cache.invalidate('a')
+  assert_equal(None, cache.get('a'))
+
+
+def test_expiry():
+  cache = TTLCache(maxsize=10, ttl=60)
+  cache.put('a', 1, ttl=-1)
+  assert_equal(None, cache.get('a'))
+  assert_equal(0, len(cache))
+
+
+def test_disabled():
+  cache = TTLCache(maxsize=10, ttl=0)
+  assert_false(cache.enabled)
+  cache.put('a', 1)
+  assert_equal(None, cache.get('a'))
+
+
+def test_lru_eviction():
+  cache = TTLCache(maxsize=3, ttl=60)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  cache.put('c', 3)
+  cache.get('a')
+  cache.put('d', 4)
+  assert_equal(3, len(cache))
+  assert_equal(1, cache.get('a'))
+  assert_equal(None, cache.get('b'))
+  assert_equal(4, cache.get('d'))
+
+
+def test_invalidate_if():
+  cache = TTLCache(maxsize=10, ttl=60)
+  cache.put_many([(('u', '/a'), 1), (('u', '/a/b'), 2), (('u', '/c'), 3)])
+  cache.invalidate_if(lambda key: key[1].startswith('/a'))
+  assert_equal(None, cache.get(('u', '/a/b')))
+  assert_true(cache.get(('u', '/c')))
@@ -0,0 +1,114 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A bounded pool of worker threads, for fanning out blocking calls (REST or
+Thrift requests) from a single request thread.
+"""
+
+import logging
+import Queue
+import threading
+
+LOG = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+  """
+  Runs submitted callables on at most `size' threads.
+
+  Work may submit more work; join() waits for all of it. Exceptions raised
+  by the callables are logged and swallowed: callers that care record them
+  in the callable itself, or use imap_unordered().
+
+  Threads are started on the first submit() and stopped by shutdown().
+  """
+  def __init__(self, size, name='worker-pool'):
+    self._size = max(1, size)
+    self._name = name
+    self._queue = Queue.Queue()
+    self._threads = [ ]
+    self._lock = threading.Lock()
+
+  def submit(self, fn, *args, **kwargs):
+    self._start()
+    self._queue.put((fn, args, kwargs))
+
+  def join(self):
+    """Wait until all the submitted work, including work it submitted, is done."""
+    self._queue.join()
+
+  def shutdown(self):
+    """Stop the threads once they are done with the submitted work."""
+    self._lock.acquire()
+    try:
+      threads, self._threads = self._threads, [ ]
+    finally:
+      self._lock.release()
+    for thread in threads:
+      self._queue.put(None)
+    for thread in threads:
+      thread.join()
+
+  def imap_unordered(self, fn, items):
+    """
+    imap_unordered(fn, items) -> generator of (item, result, exception)
+
+    Call `fn(item)' for every item, and yield the outcomes as they complete.
+    Exactly one of `result' and `exception' is meaningful: `exception' is None
+    when the call succeeded.
+    """
+    results = Queue.Queue()
+
+    def call(item):
+      try:
+        results.put((item, fn(item), None))
+      except Exception, ex:
+        results.put((item, None, ex))
+
+    count = 0
+    for item in items:
+      self.submit(call, item)
+      count += 1
+    for i in xrange(count):
+      yield results.get()
+
+  def _start(self):
+    self._lock.acquire()
+    try:
+      if self._threads:
+        return
+      for i in range(self._size):
+        thread = threading.Thread(target=self._work, name='%s-%d' % (self._name, i))
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+    finally:
+      self._lock.release()
+
+  def _work(self):
+    while True:
+      task = self._queue.get()
+      try:
+        if task is None:
+          return
+        fn, args, kwargs = task
+        try:
+          fn(*args, **kwargs)
+        except Exception, ex:
+          LOG.exception("Uncaught error in %s: %s" % (self._name, ex))
+      finally:
+        self._queue.task_done()
@@ -0,0 +1,84 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from nose.tools import assert_equal, assert_true
+
+from desktop.lib.worker_pool import WorkerPool
+
+
+def test_nested_submit_and_join():
+  pool = WorkerPool(4)
+  seen = [ ]
+  lock = threading.Lock()
+
+  def visit(depth):
+    lock.acquire()
+    try:
+      seen.append(depth)
+    finally:
+      lock.release()
+    if depth < 3:
+      pool.submit(visit, depth + 1)
+      pool.submit(visit, depth + 1)
+
+  try:
+    pool.submit(visit, 0)
+    pool.join()
+  finally:
+    pool.shutdown()
+  assert_equal(15, len(seen))
+
+
+def test_bounded_concurrency():
+  pool = WorkerPool(2)
+  state = {'running': 0, 'max': 0}
+  lock = threading.Lock()
+
+  def work(item):
+    lock.acquire()
+    state['running'] += 1
+    state['max'] = max(state['max'], state['running'])
+    lock.release()
+    time.sleep(0.01)
+    lock.acquire()
+    state['running'] -= 1
+    lock.release()
+    return item
+
+  try:
+    results = list(pool.imap_unordered(work, range(10)))
+  finally:
+    pool.shutdown()
+  assert_equal(range(10), sorted([ result for item, result, ex in results ]))
+  assert_true(state['max'] <= 2)
+
+
+def test_imap_unordered_errors():
+  def fail_on_odd(item):
+    if item % 2:
+      raise ValueError(item)
+    return item
+
+  pool = WorkerPool(3)
+  try:
+    results = list(pool.imap_unordered(fail_on_odd, range(6)))
+  finally:
+    pool.shutdown()
+  failed = sorted([ item for item, result, ex in results if ex is not None ])
+  assert_equal([1, 3, 5], failed)
@@ -29,6 +29,7 @@ import desktop
 import desktop.urls
 import desktop.conf
 import logging
+import simplejson
 import time
 from desktop.lib.django_util import TruncatingModel
 from desktop.lib.exceptions_renderable import PopupException
@@ -51,6 +52,9 @@ def teardown_test_environment():
   themselves and leaving threads hanging around.
   """
   import threading
+  from desktop.lib import thrift_util
+  # The thrift connection pools keep a checker thread while they're in use
+  thrift_util.close_connection_pools()
   # We should shut down all relevant threads by test completion.
   threads = list(threading.enumerate())
 
@@ -229,6 +233,17 @@ def test_thread_dump():
   response = c.get("/debug/threads")
   assert_true("test_thread_dump" in response.content)
 
+def test_thrift_metrics():
+  c = make_logged_in_client()
+  response = c.get("/debug/thrift_metrics")
+  metrics = simplejson.loads(response.content)
+  assert_true('methods' in metrics['calls'])
+  assert_true('pools' in metrics)
+
+  c = make_logged_in_client(username="not_superuser", is_superuser=False)
+  response = c.get("/debug/thrift_metrics")
+  assert_true("You must be a superuser" in response.content)
+
 def test_truncating_model():
   class TinyModel(TruncatingModel):
     short_field = CharField(max_length=10)
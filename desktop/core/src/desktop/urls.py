@@ -56,6 +56,7 @@ dynamic_patterns = patterns('',
   (r'^status_bar/?$', 'desktop.views.status_bar'),
   (r'^admin/', include(admin.site.urls)),
   (r'^debug/threads$', 'desktop.views.threads'),
+  (r'^debug/thrift_metrics$', 'desktop.views.thrift_metrics'),
   (r'^debug/who_am_i$', 'desktop.views.who_am_i'),
   (r'^debug/check_config$', 'desktop.views.check_config'),
   (r'^debug/check_config_ajax$', 'desktop.views.check_config_ajax'),
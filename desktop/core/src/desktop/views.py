@@ -28,7 +28,7 @@ from django.http import HttpResponse
 from django.core.servers.basehttp import FileWrapper
 import django.views.debug
 
-from desktop.lib import django_mako
+from desktop.lib import django_mako, thrift_util
 from desktop.lib.django_util import login_notrequired, render_json, render, render_to_string
 from desktop.lib.paths import get_desktop_root
 from desktop.log.access import access_log_level, access_warn
@@ -202,6 +202,23 @@ def threads(request):
     out.append("")
   return HttpResponse("\n".join(out), content_type="text/plain")
 
+@access_log_level(logging.WARN)
+def thrift_metrics(request):
+  """
+  Dumps the thrift call statistics and connection pool counters as JSON.
+  POSTing with reset=true clears the call statistics.
+  """
+  if not request.user.is_superuser:
+    return HttpResponse(_("You must be a superuser."))
+
+  if request.method == 'POST' and request.POST.get('reset') == 'true':
+    thrift_util.reset_rpc_metrics()
+
+  return render_json({
+    'calls': thrift_util.get_rpc_metrics(),
+    'pools': thrift_util.get_pool_metrics(),
+  })
+
 def jasmine(request):
   return render('jasmine.mako', request, None)
 
@@ -94,6 +94,18 @@ HDFS_CLUSTERS = UnspecifiedConfigSection(
                               default=False, type=coerce_bool),
       TEMP_DIR=Config("temp_dir", help="HDFS directory for temporary files",
                       default='/tmp', type=str),
+      STATS_CACHE_TTL=Config("stats_cache_ttl",
+                             help="Number of seconds file and directory stats are cached " +
+                             "per user. Hue's own changes invalidate them right away. " +
+                             "Set to 0 to disable.",
+                             default=5, type=int),
+      STATS_CACHE_SIZE=Config("stats_cache_size",
+                              help="Maximum number of file and directory stats to cache.",
+                              default=10000, type=int),
+      CONCURRENT_REQUESTS=Config("concurrent_requests",
+                                 help="Maximum number of WebHDFS requests a single recursive " +
+                                 "operation (e.g. chmod or chown) issues in parallel.",
+                                 default=8, type=int),
 
       HADOOP_HDFS_HOME = Config(
         key="hadoop_hdfs_home",
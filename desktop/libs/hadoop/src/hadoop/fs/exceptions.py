@@ -43,3 +43,18 @@ class WebHdfsException(RestException):
     except:
       # Don't mask the original exception
       self.server_exc = None
+
+
+class PartialFailureException(IOError):
+  """
+  A recursive operation failed on some of the paths it visited.
+  `failures' lists (path, exception) pairs. `done' counts the paths that succeeded.
+  """
+  def __init__(self, message, failures, done=0):
+    IOError.__init__(self, message)
+    self.failures = failures
+    self.done = done
+
+  def __str__(self):
+    return "%s (%d failed, %d succeeded; first error on %s: %s)" % \
+        (self.args[0], len(self.failures), self.done, self.failures[0][0], self.failures[0][1])
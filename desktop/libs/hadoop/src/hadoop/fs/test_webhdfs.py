@@ -26,8 +26,9 @@ import random
 from threading import Thread
 
 from hadoop import pseudo_hdfs4
-from hadoop.fs.exceptions import WebHdfsException
+from hadoop.fs.exceptions import WebHdfsException, PartialFailureException
 from hadoop.fs.hadoopfs import Hdfs
+from hadoop.fs.webhdfs import WebHdfs, AppendUpload
 
 LOG = logging.getLogger(__name__)
 
@@ -66,6 +67,84 @@ def test_webhdfs_functions():
   assert_true(fs.isdir("/user/test"))
   fs.remove("/user/test")
 
+@attr('requires_hadoop')
+def test_stats_cache():
+  """Cached stats are served from LISTSTATUS and dropped on change"""
+  cluster = pseudo_hdfs4.shared_cluster()
+  fs = WebHdfs(cluster.fs.uri, cluster.fs.fs_defaultfs, stats_cache_ttl=60)
+  fs.setuser(cluster.superuser)
+  fs.mkdir("/test-stats-cache")
+  try:
+    fs.create("/test-stats-cache/a.txt", data="hello")
+    fs.listdir_stats("/test-stats-cache")
+    assert_true(fs._stats_cache.get((cluster.superuser, "/test-stats-cache/a.txt")))
+
+    # Changes through Hue are visible right away
+    fs.append("/test-stats-cache/a.txt", " world")
+    assert_equals(11, fs.stats("/test-stats-cache/a.txt").size)
+    fs.chmod("/test-stats-cache/a.txt", 0600)
+    assert_equals(0600, fs.stats("/test-stats-cache/a.txt").mode & 0777)
+    fs.rename("/test-stats-cache/a.txt", "/test-stats-cache/b.txt")
+    assert_false(fs.exists("/test-stats-cache/a.txt"))
+    assert_true(fs.isfile("/test-stats-cache/b.txt"))
+
+    # Callers modifying a stat do not modify the cache
+    sb = fs.stats("/test-stats-cache/b.txt")
+    sb['path'] = '..'
+    assert_equals("/test-stats-cache/b.txt", fs.stats("/test-stats-cache/b.txt").path)
+  finally:
+    fs.rmtree("/test-stats-cache")
+  assert_false(fs.exists("/test-stats-cache/b.txt"))
+
+@attr('requires_hadoop')
+def test_listdir_stats_batches():
+  """Listing in parts gives the same entries, whether or not the NameNode supports it"""
+  cluster = pseudo_hdfs4.shared_cluster()
+  fs = cluster.fs
+  fs.setuser(cluster.superuser)
+  fs.mkdir("/test-listdir-batches")
+  try:
+    for i in range(5):
+      fs.create("/test-listdir-batches/%d" % i, data=str(i))
+    expected = [ sb.path for sb in fs.listdir_stats("/test-listdir-batches") ]
+    batches = list(fs.listdir_stats_batches("/test-listdir-batches"))
+    assert_equals(expected, [ sb.path for batch in batches for sb in batch ])
+  finally:
+    fs.rmtree("/test-listdir-batches")
+
+@attr('requires_hadoop')
+def test_create_stream():
+  cluster = pseudo_hdfs4.shared_cluster()
+  fs = cluster.fs
+  fs.setuser(cluster.superuser)
+  stream = fs.create_stream("/test-create-stream.txt", overwrite=True)
+  try:
+    data = "0123456789" * 100000
+    for i in xrange(0, len(data), 4096):
+      stream.write(data[i:i + 4096])
+    stream.close()
+    assert_equals(len(data), fs.stats("/test-create-stream.txt").size)
+    assert_equals(data, fs.read("/test-create-stream.txt", 0, len(data)))
+  finally:
+    fs.remove("/test-create-stream.txt")
+
+@attr('requires_hadoop')
+def test_append_upload():
+  """The stream used instead of create_stream() on secure clusters"""
+  cluster = pseudo_hdfs4.shared_cluster()
+  fs = cluster.fs
+  fs.setuser(cluster.superuser)
+  fs.create("/test-append-upload.txt", overwrite=True)
+  try:
+    stream = AppendUpload(fs, "/test-append-upload.txt", chunk_size=10000)
+    data = "0123456789" * 10000
+    for i in xrange(0, len(data), 4096):
+      stream.write(data[i:i + 4096])
+    stream.close()
+    assert_equals(data, fs.read("/test-append-upload.txt", 0, len(data)))
+  finally:
+    fs.remove("/test-append-upload.txt")
+
 @attr('requires_hadoop')
 def test_seek():
   """Test for DESKTOP-293 - ensure seek works in python2.4"""
@@ -354,4 +433,122 @@ def test_chown():
     try:
       fs.rmtree(dir1)
     finally:
-      pass
\ No newline at end of file
+      pass
+
+def test_chmod_unexpected_error():
+  """Errors other than IOError in the workers are reported, not swallowed"""
+  class FakeStat(object):
+    def __init__(self, path, isDir):
+      self.path = path
+      self.isDir = isDir
+
+  class FakeRoot(object):
+    def put(self, path, params):
+      if path == '/dir/b':
+        raise Exception("Unexpected")
+
+  fs = WebHdfs('http://localhost:1/webhdfs/v1', 'hdfs://localhost:1')
+  fs._root = FakeRoot()
+  fs.isdir = lambda path: True
+  fs.listdir_stats = lambda path: [ FakeStat('/dir/a', False), FakeStat('/dir/b', False) ]
+
+  try:
+    fs.chmod('/dir', 0755, recursive=True)
+    assert_true(False, "Should have raised PartialFailureException")
+  except PartialFailureException, ex:
+    assert_equals(['/dir/b'], [ path for path, error in ex.failures ])
+    assert_equals(2, ex.done)
+
+  # A directory that can not be listed fails once, with its own error
+  def listdir_stats(path):
+    raise IOError("Permission denied")
+  fs.listdir_stats = listdir_stats
+  try:
+    fs.chmod('/dir', 0755, recursive=True)
+    assert_true(False, "Should have raised IOError")
+  except PartialFailureException, ex:
+    assert_true(False, "Should have raised the original error")
+  except IOError, ex:
+    assert_equals("Permission denied", str(ex))
+
+def test_copyfile_failure():
+  """A copy failing halfway removes the partial file"""
+  class FakeStat(object):
+    isDir = False
+    blockSize = 1024
+    replication = 1
+    mode = 0100644
+
+  class FakeReader(object):
+    def __init__(self):
+      self.reads = 0
+    def read(self, size):
+      self.reads += 1
+      if self.reads > 1:
+        raise Exception("Unexpected")
+      return 'data'
+    def close(self):
+      pass
+
+  class FakeWriter(object):
+    aborted = False
+    def write(self, data):
+      pass
+    def close(self):
+      pass
+    def abort(self):
+      self.aborted = True
+
+  fs = WebHdfs('http://localhost:1/webhdfs/v1', 'hdfs://localhost:1')
+  writer = FakeWriter()
+  removed = [ ]
+  fs._stats = lambda path: FakeStat()
+  fs.isdir = lambda path: False
+  fs.read_stream = lambda path: FakeReader()
+  fs.create_stream = lambda path, **kwargs: writer
+  fs.remove = removed.append
+
+  assert_raises(Exception, fs.copyfile, '/src', '/dst')
+  assert_true(writer.aborted)
+  assert_equals(['/dst'], removed)
+
+def test_listdir_stats_batches_errors():
+  """Non ASCII names between batches, and errors that are not about the op itself"""
+  import urllib2
+  from cStringIO import StringIO
+
+  def error(exception, message):
+    body = '{"RemoteException": {"exception": "%s", "message": "%s"}}' % (exception, message)
+    return WebHdfsException(urllib2.HTTPError('http://localhost:1', 400, 'Bad Request', {}, StringIO(body)))
+
+  def status(name):
+    return {'pathSuffix': name, 'type': 'FILE', 'length': 0, 'owner': 'test', 'group': 'test',
+            'permission': '644', 'accessTime': 0, 'modificationTime': 0, 'blockSize': 0, 'replication': 1}
+
+  fs = WebHdfs('http://localhost:1/webhdfs/v1', 'hdfs://localhost:1')
+  calls = [ ]
+  class FakeRoot(object):
+    def get(self, path, params):
+      # Fails if the params cannot be put in a url
+      fs._client._make_url(path, params)
+      calls.append(params.get('startAfter'))
+      if len(calls) == 1:
+        return {'DirectoryListing': {'partialListing': {'FileStatuses': {'FileStatus': [ status(u'é') ]}}, 'remainingEntries': 1}}
+      return {'DirectoryListing': {'partialListing': {'FileStatuses': {'FileStatus': [ status(u'f') ]}}, 'remainingEntries': 0}}
+  fs._root = FakeRoot()
+  assert_equals([ u'é', u'f' ], [ sb.name for batch in fs.listdir_stats_batches('/dir') for sb in batch ])
+  assert_equals([ None, '\xc3\xa9' ], calls)
+
+  # Only an unknown op turns batching off
+  def get(path, params):
+    raise error('IllegalArgumentException', 'Invalid path')
+  fs._root.get = get
+  assert_raises(WebHdfsException, list, fs.listdir_stats_batches('/dir'))
+  assert_true(fs._batch_listing)
+
+  def get(path, params):
+    raise error('IllegalArgumentException', 'No enum constant org.apache.hadoop.hdfs.web.resources.GetOpParam.Op.LISTSTATUS_BATCH')
+  fs._root.get = get
+  fs.listdir_stats = lambda path: [ ]
+  assert_equals([ [ ] ], list(fs.listdir_stats_batches('/dir')))
+  assert_false(fs._batch_listing)
@@ -33,6 +33,7 @@ from django.core.files.uploadhandler import \
     FileUploadHandler, StopFutureHandlers, StopUpload
 import hadoop.cluster
 from hadoop.conf import UPLOAD_CHUNK_SIZE
+from hadoop.fs.exceptions import WebHdfsException
 
 UPLOAD_SUBDIR = 'hue-uploads'
 LOG = logging.getLogger(__name__)
@@ -71,7 +72,11 @@ class HDFStemporaryUploadedFile(object):
 
     # Make the tmp dir 0777
     self._fs.chmod(self._fs.dirname(self._path), 0777)
-    self._file = self._fs.open(self._path, 'w')
+    if hasattr(self._fs, 'create_stream'):
+      # Stream all the chunks to the DataNode in a single request
+      self._file = self._fs.create_stream(self._path, overwrite=True)
+    else:
+      self._file = self._fs.open(self._path, 'w')
     self._do_cleanup = True
 
   def __del__(self):
@@ -95,8 +100,8 @@ class HDFStemporaryUploadedFile(object):
     try:
       self._fs.remove(self._path)
       self._do_cleanup = False
-    except IOError, ex:
-      if ex.errno != errno.ENOENT:
+    except (IOError, WebHdfsException), ex:
+      if getattr(ex, 'errno', None) != errno.ENOENT:
         LOG.exception('Failed to remove temporary upload file "%s". '
                       'Please cleanup manually: %s' % (self._path, ex))
 
@@ -109,6 +114,11 @@ class HDFStemporaryUploadedFile(object):
   def close(self):
     self._file.close()
 
+  def abort(self):
+    """Stop sending data. The temporary file still needs to be removed."""
+    if hasattr(self._file, 'abort'):
+      self._file.abort()
+
 
 class HDFSfileUploadHandler(FileUploadHandler):
   """
@@ -122,6 +132,7 @@ class HDFSfileUploadHandler(FileUploadHandler):
     self._file = None
     self._starttime = 0
     self._activated = False
+    self._completed = False
     # Need to directly modify FileUploadHandler.chunk_size
     FileUploadHandler.chunk_size = UPLOAD_CHUNK_SIZE.get()
 
@@ -150,9 +161,10 @@ class HDFSfileUploadHandler(FileUploadHandler):
       self._file.write(raw_data)
       self._file.flush()
       return None
-    except IOError:
+    except (IOError, WebHdfsException):
       LOG.exception('Error storing upload data in temporary file "%s"' %
                     (self._file.get_temp_path(),))
+      self._file.abort()
       raise StopUpload()
 
   def file_complete(self, file_size):
@@ -160,12 +172,20 @@ class HDFSfileUploadHandler(FileUploadHandler):
       return None
 
     try:
+      self._completed = True
       self._file.finish_upload(file_size)
-    except IOError:
+    except (IOError, WebHdfsException):
       LOG.exception('Error closing uploaded temporary file "%s"' %
                     (self._file.get_temp_path(),))
-      raise
+      self._file.abort()
+      self._file.remove()
+      raise StopUpload()
 
     elapsed = time.time() - self._starttime
     LOG.debug('Uploaded %s bytes to HDFS in %s seconds' % (file_size, elapsed))
     return self._file
+
+  def upload_complete(self):
+    # The upload got interrupted before the file was complete
+    if self._activated and not self._completed:
+      self._file.abort()
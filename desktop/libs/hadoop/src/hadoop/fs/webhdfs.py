@@ -19,20 +19,29 @@
 Interfaces for Hadoop filesystem access via HttpFs/WebHDFS
 """
 
+import copy
 import errno
+import httplib
 import logging
 import posixpath
+import Queue
 import random
+import socket
 import stat
 import threading
+import urllib2
+import urlparse
+
+from cStringIO import StringIO
 
 from django.utils.encoding import smart_str
 from desktop.lib.rest import http_client, resource
+from desktop.lib.ttl_cache import TTLCache
+from desktop.lib.worker_pool import WorkerPool
 from hadoop.fs import normpath, SEEK_SET, SEEK_CUR, SEEK_END
 from hadoop.fs.hadoopfs import Hdfs
-from hadoop.fs.exceptions import WebHdfsException
+from hadoop.fs.exceptions import WebHdfsException, PartialFailureException
 from hadoop.fs.webhdfs_types import WebHdfsStat, WebHdfsContentSummary
-from hadoop.conf import UPLOAD_CHUNK_SIZE
 
 import hadoop.conf
 
@@ -42,6 +51,16 @@ DEFAULT_HDFS_SUPERUSER = 'hdfs'
 # The number of bytes to read if not specified
 DEFAULT_READ_SIZE = 1024*1024 # 1MB
 
+# Size of the chunks sent to the DataNode by a streaming upload
+STREAM_CHUNK_SIZE = 1024*1024 # 1MB
+# How many chunks a streaming upload buffers before write() blocks
+STREAM_MAX_PENDING_CHUNKS = 8
+# A streaming upload that gets no data for this long (in seconds) is aborted
+STREAM_IDLE_TIMEOUT = 600
+# Socket timeout (in seconds) of a streaming upload, e.g. while waiting for
+# the DataNode to acknowledge the file
+STREAM_SOCKET_TIMEOUT = 600
+
 LOG = logging.getLogger(__name__)
 
 class WebHdfs(Hdfs):
@@ -54,16 +73,26 @@ class WebHdfs(Hdfs):
                fs_defaultfs,
                hdfs_superuser=None,
                security_enabled=False,
-               temp_dir="/tmp"):
+               temp_dir="/tmp",
+               stats_cache_ttl=0,
+               stats_cache_size=10000,
+               concurrency=8):
     self._url = url
     self._superuser = hdfs_superuser
     self._security_enabled = security_enabled
     self._temp_dir = temp_dir
     self._fs_defaultfs = fs_defaultfs
+    self._concurrency = concurrency
 
     self._client = self._make_client(url, security_enabled)
     self._root = resource.Resource(self._client)
 
+    # (user, path) -> WebHdfsStat
+    self._stats_cache = TTLCache(maxsize=stats_cache_size, ttl=stats_cache_ttl)
+
+    # Whether the NameNode lists directories in parts, until it says no
+    self._batch_listing = True
+
     # To store user info
     self._thread_local = threading.local()
 
@@ -76,7 +105,10 @@ class WebHdfs(Hdfs):
     return cls(url=_get_service_url(hdfs_config),
                fs_defaultfs=fs_defaultfs,
                security_enabled=hdfs_config.SECURITY_ENABLED.get(),
-               temp_dir=hdfs_config.TEMP_DIR.get())
+               temp_dir=hdfs_config.TEMP_DIR.get(),
+               stats_cache_ttl=hdfs_config.STATS_CACHE_TTL.get(),
+               stats_cache_size=hdfs_config.STATS_CACHE_SIZE.get(),
+               concurrency=hdfs_config.CONCURRENT_REQUESTS.get())
 
   def __str__(self):
     return "WebHdfs at %s" % (self._url,)
@@ -146,7 +178,45 @@ class WebHdfs(Hdfs):
     params['op'] = 'LISTSTATUS'
     json = self._root.get(path, params)
     filestatus_list = json['FileStatuses']['FileStatus']
-    return [ WebHdfsStat(st, path) for st in filestatus_list ]
+    res = [ WebHdfsStat(st, path) for st in filestatus_list ]
+    self._cache_stats(res)
+    return res
+
+  def listdir_stats_batches(self, path):
+    """
+    listdir_stats_batches(path) -> generator of [ WebHdfsStat ]
+
+    Get directory listing with stats, in the parts the NameNode returns
+    with LISTSTATUS_BATCH (Hadoop 2.8 and later), so that a huge directory
+    does not come as one huge response. Falls back to LISTSTATUS when the
+    NameNode does not support it.
+    """
+    path = Hdfs.normpath(path)
+    start_after = None
+    while self._batch_listing:
+      params = self._getparams()
+      params['op'] = 'LISTSTATUS_BATCH'
+      if start_after is not None:
+        params['startAfter'] = smart_str(start_after)
+      try:
+        json = self._root.get(path, params)
+      except WebHdfsException, ex:
+        if start_after is not None or not _is_unsupported_op(ex, params['op']):
+          raise ex
+        LOG.info("LISTSTATUS_BATCH is not supported by %s, listing directories at once: %s" % (self._url, ex))
+        self._batch_listing = False
+        break
+
+      listing = json['DirectoryListing']
+      filestatus_list = listing['partialListing']['FileStatuses']['FileStatus']
+      res = [ WebHdfsStat(st, path) for st in filestatus_list ]
+      self._cache_stats(res)
+      yield res
+      if not listing['remainingEntries'] or not filestatus_list:
+        return
+      start_after = filestatus_list[-1]['pathSuffix']
+
+    yield self.listdir_stats(path)
 
   def listdir(self, path, glob=None):
     """
@@ -171,15 +241,43 @@ class WebHdfs(Hdfs):
   def _stats(self, path):
     """This version of stats returns None if the entry is not found"""
     path = Hdfs.normpath(path)
+    cached = self._stats_cache.get((self.user, path))
+    if cached is not None:
+      return copy.copy(cached)
+
     params = self._getparams()
     params['op'] = 'GETFILESTATUS'
     try:
       json = self._root.get(path, params)
-      return WebHdfsStat(json['FileStatus'], path)
+      res = WebHdfsStat(json['FileStatus'], path)
     except WebHdfsException, ex:
       if ex.server_exc == 'FileNotFoundException' or ex.code == 404:
         return None
       raise ex
+    self._stats_cache.put((self.user, path), copy.copy(res))
+    return res
+
+  def _cache_stats(self, stats):
+    """Remember listed stats for the current user. Callers may modify the originals."""
+    if self._stats_cache.enabled:
+      user = self.user
+      self._stats_cache.put_many([ ((user, sb.path), copy.copy(sb)) for sb in stats ])
+
+  def _invalidate_stats(self, path):
+    """
+    Forget the cached stats of `path', everything below it and its parent
+    directory (whose mtime changes), for all users.
+    """
+    if not self._stats_cache.enabled:
+      return
+    path = Hdfs.normpath(path)
+    parent = Hdfs.dirname(path)
+    prefix = path.rstrip('/') + '/'
+
+    def affected(key):
+      cached_path = key[1]
+      return cached_path in (path, parent) or cached_path.startswith(prefix)
+    self._stats_cache.invalidate_if(affected)
 
   def stats(self, path):
     """
@@ -216,6 +314,7 @@ class WebHdfs(Hdfs):
     params['op'] = 'DELETE'
     params['recursive'] = recursive and 'true' or 'false'
     result = self._root.delete(path, params)
+    self._invalidate_stats(path)
     # This part of the API is nonsense.
     # The lack of exception should indicate success.
     if not result['boolean']:
@@ -245,6 +344,7 @@ class WebHdfs(Hdfs):
     if mode is not None:
       params['permission'] = safe_octal(mode)
     success = self._root.put(path, params)
+    self._invalidate_stats(path)
     if not success:
       raise IOError("Mkdir failed: %s" % (smart_str(path),))
 
@@ -276,6 +376,8 @@ class WebHdfs(Hdfs):
     # Encode `new' because it's in the params
     params['destination'] = smart_str(new)
     result = self._root.put(old, params)
+    self._invalidate_stats(old)
+    self._invalidate_stats(new)
     if not result['boolean']:
       raise IOError("Rename failed: %s -> %s" %
                     (smart_str(old), smart_str(new)))
@@ -298,16 +400,84 @@ class WebHdfs(Hdfs):
 
     Get directory entry names without stats, recursively.
     """
-    paths = [path]
-    while paths:
-      path = paths.pop()
-      if self.isdir(path):
-        hdfs_paths = self.listdir_stats(path, glob)
-        paths[:0] = [x.path for x in hdfs_paths]
-      yield path
+    yield path
+    if not self.isdir(path):
+      return
+    dirs = [path]
+    while dirs:
+      for sb in self.listdir_stats(dirs.pop(), glob):
+        yield sb.path
+        if sb.isDir:
+          dirs.append(sb.path)
+
+  def _put_recursive(self, path, params, progress=None):
+    """
+    _put_recursive(path, params, progress=None)
+
+    Issue the same PUT (e.g. SETOWNER) on `path' and everything below it, with
+    up to `concurrency' requests in flight. Directories are told apart from
+    files by their LISTSTATUS entry, and are listed before they are changed.
+
+    `progress(done, failed)' is called after every path. When some paths
+    fail, the rest are still processed and PartialFailureException is raised
+    at the end.
+    """
+    user = self.user
+    lock = threading.Lock()
+    counts = {'done': 0}
+    failures = [ ]
+
+    def record(xpath, ex=None):
+      lock.acquire()
+      try:
+        if ex is None:
+          counts['done'] += 1
+        else:
+          LOG.warn("Recursive %s failed on %s: %s" % (params['op'], xpath, ex))
+          failures.append((xpath, ex))
+        done, failed = counts['done'], len(failures)
+      finally:
+        lock.release()
+      if progress is not None:
+        progress(done, failed)
+
+    def visit(xpath, is_dir):
+      # Pool threads do not inherit the thread-local user. Any error is
+      # recorded here: the pool would only log it.
+      self.setuser(user)
+      if is_dir:
+        try:
+          for sb in self.listdir_stats(xpath):
+            pool.submit(visit, sb.path, sb.isDir)
+        except Exception, ex:
+          # Not changed either, so that each path fails once
+          record(xpath, ex)
+          return
+      try:
+        self._root.put(xpath, params)
+        ex = None
+      except Exception, ex:
+        pass
+      record(xpath, ex)
+
+    is_dir = self.isdir(path)
+    pool = WorkerPool(self._concurrency, name='webhdfs-%s' % (params['op'].lower(),))
+    try:
+      pool.submit(visit, path, is_dir)
+      pool.join()
+    finally:
+      pool.shutdown()
+
+    if failures:
+      _raise_partial_failure("Recursive %s of %s" % (params['op'], smart_str(path)),
+                             failures, counts['done'])
+
+  def chown(self, path, user=None, group=None, recursive=False, progress=None):
+    """
+    chown(path, user=None, group=None, recursive=False, progress=None)
 
-  def chown(self, path, user=None, group=None, recursive=False):
-    """chown(path, user=None, group=None, recursive=False)"""
+    @see _put_recursive for `progress' and partial failures.
+    """
     path = Hdfs.normpath(path)
     params = self._getparams()
     params['op'] = 'SETOWNER'
@@ -315,28 +485,33 @@ class WebHdfs(Hdfs):
       params['owner'] = user
     if group is not None:
       params['group'] = group
-    if recursive:
-      for xpath in self._listdir_r(path):
-        self._root.put(xpath, params)
-    else:
-      self._root.put(path, params)
+    try:
+      if recursive:
+        self._put_recursive(path, params, progress)
+      else:
+        self._root.put(path, params)
+    finally:
+      self._invalidate_stats(path)
 
 
-  def chmod(self, path, mode, recursive=False):
+  def chmod(self, path, mode, recursive=False, progress=None):
     """
-    chmod(path, mode, recursive=False)
+    chmod(path, mode, recursive=False, progress=None)
 
     `mode' should be an octal integer or string.
+    @see _put_recursive for `progress' and partial failures.
     """
     path = Hdfs.normpath(path)
     params = self._getparams()
     params['op'] = 'SETPERMISSION'
     params['permission'] = safe_octal(mode)
-    if recursive:
-      for xpath in self._listdir_r(path):
-        self._root.put(xpath, params)
-    else:
-      self._root.put(path, params)
+    try:
+      if recursive:
+        self._put_recursive(path, params, progress)
+      else:
+        self._root.put(path, params)
+    finally:
+      self._invalidate_stats(path)
 
   def get_home_dir(self):
     """get_home_dir() -> Home directory for the current user"""
@@ -367,6 +542,24 @@ class WebHdfs(Hdfs):
       raise ex
 
 
+  def read_stream(self, path, offset=0, length=None, bufsize=None):
+    """
+    read_stream(path, offset=0, length=None[, bufsize]) -> file-like object
+
+    Open a file for streaming. The whole range is served by a single OPEN
+    request, whose response body is returned unread. The caller must close it.
+    """
+    path = Hdfs.normpath(path)
+    params = self._getparams()
+    params['op'] = 'OPEN'
+    params['offset'] = long(offset)
+    if length is not None:
+      params['length'] = long(length)
+    if bufsize is not None:
+      params['bufsize'] = bufsize
+    return self._root.get_stream(path, params)
+
+
   def open(self, path, mode='r'):
     """
     DEPRECATED!
@@ -398,6 +591,41 @@ class WebHdfs(Hdfs):
       params['permission'] = safe_octal(permission)
 
     self._invoke_with_redirect('PUT', path, params, data)
+    self._invalidate_stats(path)
+
+
+  def create_stream(self, path, overwrite=False, blocksize=None,
+                    replication=None, permission=None):
+    """
+    create_stream(path, overwrite=False, blocksize=None, replication=None, permission=None)
+      -> ChunkedUpload
+
+    Creates a file and returns a writable stream to it. All the data goes to
+    the DataNode in a single request, instead of one APPEND per write.
+    The stream must be closed for the file to be complete.
+
+    With security enabled, the data is sent by the usual Kerberos aware
+    client instead: the file is created, then appended to one chunk at a time.
+    """
+    path = Hdfs.normpath(path)
+    if self.security_enabled:
+      self.create(path, overwrite=overwrite, blocksize=blocksize,
+                  replication=replication, permission=permission)
+      return AppendUpload(self, path)
+
+    params = self._getparams()
+    params['op'] = 'CREATE'
+    params['overwrite'] = overwrite and 'true' or 'false'
+    if blocksize is not None:
+      params['blocksize'] = long(blocksize)
+    if replication is not None:
+      params['replication'] = int(replication)
+    if permission is not None:
+      params['permission'] = safe_octal(permission)
+
+    stream = ChunkedUpload(self._get_redirect_location('PUT', path, params), method='PUT')
+    self._invalidate_stats(path)
+    return stream
 
 
   def append(self, path, data):
@@ -410,41 +638,99 @@ class WebHdfs(Hdfs):
     params = self._getparams()
     params['op'] = 'APPEND'
     self._invoke_with_redirect('POST', path, params, data)
+    self._invalidate_stats(path)
 
 
   def copyfile(self, src, dst):
+    """
+    copyfile(src, dst)
+
+    Copy a file through one streaming read from the source DataNode and one
+    streaming write to the destination, without buffering it in memory.
+    A copy that fails halfway does not leave a truncated `dst' behind.
+    """
     sb = self._stats(src)
     if sb is None:
       raise IOError(errno.ENOENT, "Copy src '%s' does not exist" % (src,))
     if sb.isDir:
-      raise IOError(errno.INVAL, "Copy src '%s' is a directory" % (src,))
+      raise IOError(errno.EINVAL, "Copy src '%s' is a directory" % (src,))
     if self.isdir(dst):
-      raise IOError(errno.INVAL, "Copy dst '%s' is a directory" % (dst,))
+      raise IOError(errno.EINVAL, "Copy dst '%s' is a directory" % (dst,))
 
-    offset = 0
+    reader = self.read_stream(src)
+    try:
+      writer = self.create_stream(dst,
+                                  overwrite=True,
+                                  blocksize=sb.blockSize,
+                                  replication=sb.replication,
+                                  permission=oct(stat.S_IMODE(sb.mode)))
+      try:
+        while True:
+          data = reader.read(STREAM_CHUNK_SIZE)
+          if not data:
+            break
+          writer.write(data)
+        writer.close()
+      except:
+        writer.abort()
+        self._remove_partial(dst)
+        raise
+    finally:
+      reader.close()
 
-    while True:
-      data = self.read(src, offset, UPLOAD_CHUNK_SIZE.get())
-      if offset == 0:
-        self.create(dst,
-                    overwrite=True,
-                    blocksize=sb.blockSize,
-                    replication=sb.replication,
-                    permission=oct(stat.S_IMODE(sb.mode)),
-                    data=data)
-
-      cnt = len(data)
-      if cnt == 0:
-        break
 
-      if offset != 0:
-        self.append(dst, data)
-      offset += cnt
+  def _remove_partial(self, path):
+    """Remove what was written of a file that failed to copy."""
+    try:
+      self.remove(path)
+    except Exception, ex:
+      LOG.error("Failed to remove partial copy %s: %s" % (path, ex))
 
 
   def copy_remote_dir(self, source, destination, dir_mode=0755, owner=None):
+    """
+    copy_remote_dir(source, destination, dir_mode=0755, owner=None)
+
+    Copy a directory tree. Directories are created as the tree is listed,
+    while up to `concurrency' files are copied in parallel. Files that fail
+    to copy do not stop the others; PartialFailureException is raised at the end.
+    """
     if owner is None:
       owner = self.DEFAULT_USER
+
+    lock = threading.Lock()
+    counts = {'done': 0}
+    failures = [ ]
+
+    def copy(source_file, destination_file):
+      # Any error is recorded here: the pool would only log it
+      try:
+        self.do_as_user(owner, self.copyfile, source_file, destination_file)
+        self.do_as_superuser(self.chown, destination_file, owner, owner)
+        ex = None
+      except Exception, ex:
+        LOG.warn("Failed to copy %s to %s: %s" % (source_file, destination_file, ex))
+      lock.acquire()
+      try:
+        if ex is None:
+          counts['done'] += 1
+        else:
+          failures.append((source_file, ex))
+      finally:
+        lock.release()
+
+    pool = WorkerPool(self._concurrency, name='webhdfs-copy')
+    try:
+      self._copy_remote_dir(source, destination, dir_mode, owner, pool, copy)
+      pool.join()
+    finally:
+      pool.shutdown()
+
+    if failures:
+      _raise_partial_failure("Copy of %s" % (smart_str(source),), failures, counts['done'])
+
+
+  def _copy_remote_dir(self, source, destination, dir_mode, owner, pool, copy):
     self.do_as_user(owner, self.mkdir, destination, mode=dir_mode)
     self.do_as_user(owner, self.chmod, destination, mode=dir_mode) # To remove after HDFS-3491
 
@@ -452,10 +738,9 @@ class WebHdfs(Hdfs):
       source_file = stat.path
       destination_file = posixpath.join(destination, stat.name)
       if stat.isDir:
-        self.copy_remote_dir(source_file, destination_file, dir_mode, owner)
+        self._copy_remote_dir(source_file, destination_file, dir_mode, owner, pool, copy)
       else:
-        self.do_as_user(owner, self.copyfile, source_file, destination_file)
-        self.do_as_superuser(self.chown, destination_file, owner, owner)
+        pool.submit(copy, source_file, destination_file)
 
 
   @staticmethod
@@ -474,6 +759,19 @@ class WebHdfs(Hdfs):
 
     Returns the response from the redirected request.
     """
+    next_url = self._get_redirect_location(method, path, params)
+
+    # Now talk to the real thing. The redirect url already includes the params.
+    client = self._make_client(next_url, self.security_enabled)
+    headers = {'Content-Type': 'application/octet-stream'}
+    return resource.Resource(client).invoke(method, data=data, headers=headers)
+
+
+  def _get_redirect_location(self, method, path, params=None):
+    """
+    Issue the first leg of a create/append, and return the DataNode url
+    the NameNode redirects to.
+    """
     next_url = None
     try:
       # Do not pass data in the first leg.
@@ -486,11 +784,7 @@ class WebHdfs(Hdfs):
     if next_url is None:
       raise WebHdfsException(
         "Failed to create '%s'. HDFS did not return a redirect" % (path,))
-
-    # Now talk to the real thing. The redirect url already includes the params.
-    client = self._make_client(next_url, self.security_enabled)
-    headers = {'Content-Type': 'application/octet-stream'}
-    return resource.Resource(client).invoke(method, data=data, headers=headers)
+    return next_url
 
 
   def _get_redirect_url(self, webhdfs_ex):
@@ -597,6 +891,188 @@ class File(object):
     pass
 
 
+class ChunkedUpload(object):
+  """
+  A file being written to a DataNode through one long-lived request with
+  chunked transfer encoding.
+
+  write() only queues the data, a sender thread puts it on the wire. At most
+  `max_pending' chunks are buffered: once the queue is full write() blocks,
+  so a slow DataNode slows down the producer instead of filling up memory.
+
+  The request carries no credentials: it only works against a DataNode url
+  handed out by the NameNode, or an HttpFS server without security.
+  """
+  def __init__(self, url, method='PUT', chunk_size=STREAM_CHUNK_SIZE,
+               max_pending=STREAM_MAX_PENDING_CHUNKS, idle_timeout=STREAM_IDLE_TIMEOUT,
+               timeout=STREAM_SOCKET_TIMEOUT):
+    self._url = url
+    self._chunk_size = chunk_size
+    self._idle_timeout = idle_timeout
+    self._queue = Queue.Queue(max_pending)
+    self._error = None
+    self._closed = False
+
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+    if scheme == 'https':
+      self._conn = httplib.HTTPSConnection(netloc, timeout=timeout)
+    else:
+      self._conn = httplib.HTTPConnection(netloc, timeout=timeout)
+    if query:
+      path += '?' + query
+    try:
+      self._conn.putrequest(method, path, skip_accept_encoding=True)
+      self._conn.putheader('Content-Type', 'application/octet-stream')
+      self._conn.putheader('Transfer-Encoding', 'chunked')
+      self._conn.endheaders()
+    except (socket.error, httplib.HTTPException), ex:
+      self._conn.close()
+      raise WebHdfsException(urllib2.URLError(ex))
+
+    self._sender = threading.Thread(target=self._send_loop, name='webhdfs-upload %s' % (netloc,))
+    self._sender.setDaemon(True)
+    self._sender.start()
+
+  def write(self, data):
+    if self._closed:
+      raise IOError(errno.EINVAL, "Upload stream is closed")
+    for i in xrange(0, len(data), self._chunk_size):
+      self._put(data[i:i + self._chunk_size])
+
+  def flush(self):
+    pass
+
+  def close(self):
+    """Finish the request. Raises WebHdfsException if the DataNode did not accept the file."""
+    if self._closed:
+      return
+    try:
+      self._put(None)
+      self._closed = True
+      self._sender.join()
+      self._check_error()
+
+      resp = self._conn.getresponse()
+      body = resp.read()
+      if not 200 <= resp.status < 300:
+        raise WebHdfsException(
+            urllib2.HTTPError(self._url, resp.status, resp.reason, resp.msg, StringIO(body)))
+    except (socket.error, httplib.HTTPException), ex:
+      raise WebHdfsException(urllib2.URLError(ex))
+    finally:
+      self._closed = True
+      self._conn.close()
+
+  def abort(self):
+    """Give up on the upload. The file is left incomplete."""
+    if self._closed:
+      return
+    self._closed = True
+    if self._error is None:
+      self._error = IOError("Upload aborted")
+    self._conn.close()
+    try:
+      self._queue.put_nowait(None)
+    except Queue.Full:
+      pass    # The sender is busy and will fail on the closed connection
+
+  def _put(self, chunk):
+    while True:
+      self._check_error()
+      try:
+        self._queue.put(chunk, timeout=1)
+        return
+      except Queue.Full:
+        pass
+
+  def _check_error(self):
+    if self._error is not None:
+      if isinstance(self._error, WebHdfsException):
+        raise self._error
+      raise WebHdfsException(urllib2.URLError(self._error))
+
+  def _send_loop(self):
+    try:
+      while True:
+        try:
+          chunk = self._queue.get(timeout=self._idle_timeout)
+        except Queue.Empty:
+          raise IOError(errno.ETIMEDOUT, "No data for %s seconds" % (self._idle_timeout,))
+        if chunk is None:
+          break
+        self._conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+      self._conn.send('0\r\n\r\n')
+    except Exception, ex:
+      if self._error is None:
+        LOG.error("Streaming upload to %s failed: %s" % (self._url, ex))
+        self._error = ex
+
+
+class AppendUpload(object):
+  """
+  A writable stream to an existing file, sent one APPEND per `chunk_size'
+  bytes. Slower than ChunkedUpload, but the requests go through the client
+  of the filesystem and its authentication.
+  """
+  def __init__(self, fs, path, chunk_size=STREAM_CHUNK_SIZE):
+    self._fs = fs
+    self._path = path
+    self._chunk_size = chunk_size
+    self._buffer = [ ]
+    self._buffered = 0
+    self._closed = False
+
+  def write(self, data):
+    if self._closed:
+      raise IOError(errno.EINVAL, "Upload stream is closed")
+    self._buffer.append(data)
+    self._buffered += len(data)
+    if self._buffered >= self._chunk_size:
+      self._send()
+
+  def flush(self):
+    pass
+
+  def close(self):
+    if self._closed:
+      return
+    self._closed = True
+    self._send()
+
+  def abort(self):
+    """Give up on the upload. The file is left incomplete."""
+    self._closed = True
+    self._buffer = [ ]
+    self._buffered = 0
+
+  def _send(self):
+    data = ''.join(self._buffer)
+    self._buffer = [ ]
+    self._buffered = 0
+    if data:
+      self._fs.append(self._path, data)
+
+
+def _is_unsupported_op(webhdfs_ex, op):
+  """
+  Whether the NameNode rejected `op' as unknown, e.g. "IllegalArgumentException:
+  No enum constant ...GetOpParam.Op.LISTSTATUS_BATCH".
+  """
+  if webhdfs_ex.server_exc == 'UnsupportedOperationException':
+    return True
+  return webhdfs_ex.server_exc == 'IllegalArgumentException' and op in webhdfs_ex.message
+
+
+def _raise_partial_failure(message, failures, done):
+  """
+  Raise the original error when the only path visited failed, or a
+  PartialFailureException summing up all the `failures' otherwise.
+  """
+  if len(failures) == 1 and done == 0:
+    raise failures[0][1]
+  raise PartialFailureException(message, failures, done)
+
+
 def safe_octal(octal_value):
   """
   safe_octal(octal_value) -> octal value in string